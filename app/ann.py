@@ -0,0 +1,172 @@
+"""
+Approximate nearest-neighbour search for VectorDB.
+
+`IVFIndex` is an inverted-file index: a spherical k-means coarse quantizer
+splits the rows into `nlist` lists, and a query is scored exactly only
+against the rows of its `nprobe` closest lists. Raising `nprobe` trades
+latency for recall. New rows are assigned to their nearest list on the
+next search (incremental insert); the quantizer is retrained once the
+index has grown IVF_RETRAIN_GROWTH times since it was trained. Below
+`min_rows` rows the owning VectorDB falls back to exact search.
+
+Set VECTOR_INDEX_TYPE=ivf to enable it; see benchmarks/bench_ann_recall.py
+for recall against exact search.
+"""
+import os
+from typing import List, Optional, Tuple
+import numpy as np
+
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "flat")  # "flat" or "ivf"
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))  # 0: sqrt(rows) when training
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+IVF_MIN_ROWS = int(os.getenv("IVF_MIN_ROWS", "20000"))
+IVF_RETRAIN_GROWTH = float(os.getenv("IVF_RETRAIN_GROWTH", "4"))
+IVF_TRAIN_PER_LIST = 64
+IVF_KMEANS_ITERS = 10
+# Rows assigned per matrix product, to bound temporary memory.
+ASSIGN_BLOCK = 65536
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def spherical_kmeans(vectors: np.ndarray, k: int, iters: int = IVF_KMEANS_ITERS, seed: int = 0) -> np.ndarray:
+    """`k` unit-norm centroids of the (normalized) rows of `vectors`."""
+    rng = np.random.default_rng(seed)
+    data = _normalize(np.asarray(vectors, dtype=np.float32))
+    centroids = data[rng.choice(len(data), size=k, replace=False)].copy()
+    for _ in range(iters):
+        labels = np.argmax(data @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, data)
+        counts = np.bincount(labels, minlength=k)
+        empty = counts == 0
+        # Restart empty lists from random points.
+        sums[empty] = data[rng.choice(len(data), size=int(empty.sum()))]
+        centroids = _normalize(sums)
+    return centroids
+
+
+class IVFIndex:
+    name = "ivf"
+
+    def __init__(self, nlist: int = IVF_NLIST, nprobe: int = IVF_NPROBE, min_rows: int = IVF_MIN_ROWS,
+                 retrain_growth: float = IVF_RETRAIN_GROWTH, seed: int = 0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_rows = min_rows
+        self.retrain_growth = retrain_growth
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        self.trained_rows = 0
+        self._epoch = None
+        self._reset_lists()
+
+    def _reset_lists(self):
+        k = 0 if self.centroids is None else len(self.centroids)
+        self._assign = np.zeros(0, dtype=np.int32)       # row -> list
+        self._lists: List[np.ndarray] = [np.zeros(0, dtype=np.int64) for _ in range(k)]
+        self._pending: List[List[int]] = [[] for _ in range(k)]
+        self._assigned = 0                               # rows [0, _assigned) are in lists
+
+    # --- Keeping up with the owning VectorDB ---
+    def sync(self, db) -> bool:
+        """Train and assign rows as needed; False while exact search should be used."""
+        n = len(db._ids)
+        if db._epoch != self._epoch:
+            # Rows were renumbered (e.g. a persistent index was compacted).
+            self._epoch = db._epoch
+            self._reset_lists()
+        if self.centroids is None or n >= self.trained_rows * self.retrain_growth:
+            if n < self.min_rows:
+                return self.centroids is not None
+            self.train(db)
+        if self._assigned < n:
+            self._assign_rows(db, self._assigned, n)
+        return True
+
+    def train(self, db):
+        n = len(db._ids)
+        rows = np.arange(n) if db._live is None else np.flatnonzero(db._live[:n])
+        nlist = self.nlist or max(1, int(np.sqrt(len(rows))))
+        rng = np.random.default_rng(self.seed)
+        sample = rng.choice(rows, size=min(len(rows), nlist * IVF_TRAIN_PER_LIST), replace=False)
+        self.centroids = spherical_kmeans(db._vectors[np.sort(sample)], min(nlist, len(sample)), seed=self.seed)
+        self.trained_rows = n
+        self._reset_lists()
+
+    def _assign_rows(self, db, start: int, end: int):
+        if len(self._assign) < end:
+            grown = np.zeros(max(end, 2 * len(self._assign)), dtype=np.int32)
+            grown[:len(self._assign)] = self._assign
+            self._assign = grown
+        for block in range(start, end, ASSIGN_BLOCK):
+            stop = min(end, block + ASSIGN_BLOCK)
+            labels = np.argmax(np.asarray(db._vectors[block:stop]) @ self.centroids.T, axis=1)
+            self._assign[block:stop] = labels
+            order = np.argsort(labels, kind="stable")
+            bounds = np.searchsorted(labels[order], np.arange(len(self.centroids) + 1))
+            for lst in np.flatnonzero(np.diff(bounds)):
+                self._pending[lst].extend((order[bounds[lst]:bounds[lst + 1]] + block).tolist())
+        self._assigned = end
+
+    def row_removed(self, db, row: int, last: int):
+        # VectorDB.remove moved row `last` into `row` and dropped `last`.
+        # Stale list entries are filtered out at search time via `_assign`.
+        if row != last and row < self._assigned:
+            if last < self._assigned:
+                self._assign[row] = self._assign[last]
+            else:
+                self._assign[row] = np.argmax(self.centroids @ db._vectors[row])
+            self._pending[self._assign[row]].append(row)
+        self._assigned = min(self._assigned, last)
+
+    def _list_rows(self, lst: int) -> np.ndarray:
+        if self._pending[lst]:
+            rows = np.concatenate([self._lists[lst], np.array(self._pending[lst], dtype=np.int64)])
+            self._pending[lst] = []
+            # Drop entries whose row left the list; they accumulate from moves.
+            valid = rows < self._assigned
+            valid[valid] = self._assign[rows[valid]] == lst
+            self._lists[lst] = np.unique(rows[valid])
+        return self._lists[lst]
+
+    # --- Search ---
+    def candidates(self, query: np.ndarray, n: int, nprobe: Optional[int] = None) -> np.ndarray:
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        sims = self.centroids @ query
+        probe = np.argpartition(-sims, nprobe - 1)[:nprobe] if nprobe < len(sims) else np.arange(len(sims))
+        lists = [self._list_rows(lst) for lst in probe]
+        rows = np.concatenate(lists)
+        owners = np.repeat(probe, [len(rows) for rows in lists])
+        # Skip entries of rows that were removed or moved since they were listed.
+        valid = rows < min(n, self._assigned)
+        valid[valid] = self._assign[rows[valid]] == owners[valid]
+        return rows[valid]
+
+    def search(self, db, queries: np.ndarray, top_k: int, nprobe: Optional[int] = None) -> List[List[Tuple[float, int]]]:
+        n = len(db._ids)
+        results = []
+        for query in queries:
+            rows = self.candidates(query, n, nprobe)
+            results.extend(db._exact_search(query, top_k, rows=rows))
+        return results
+
+    def stats(self) -> dict:
+        return {
+            "type": self.name,
+            "trained": self.centroids is not None,
+            "nlist": 0 if self.centroids is None else len(self.centroids),
+            "nprobe": self.nprobe,
+            "trained_rows": self.trained_rows,
+            "assigned_rows": self._assigned,
+        }
+
+
+def build_ann() -> Optional[IVFIndex]:
+    if VECTOR_INDEX_TYPE == "ivf":
+        return IVFIndex()
+    if VECTOR_INDEX_TYPE != "flat":
+        raise ValueError(f"Unknown VECTOR_INDEX_TYPE {VECTOR_INDEX_TYPE!r}; use 'flat' or 'ivf'")
+    return None
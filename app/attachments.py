@@ -0,0 +1,323 @@
+"""
+Content-addressed attachment store.
+
+Every uploaded file is stored once under its SHA-256 in ATTACHMENT_DIR
+(`objects/ab/abcdef...`) and described by one document in `attachments`:
+
+    {_id: sha256, size, content_type, filename, refs: [owner, ...],
+     created_at, last_uploaded_at}
+
+Uploads stream into a temp file in the same directory tree (hashed and
+size-checked on the way) and are renamed into place atomically; a file
+whose content is already stored is simply dropped. `refs` lists the tasks
+(`task:<id>`) and chat messages (`chat:<id>`) that link to the attachment.
+Attachments without refs are deleted by `gc` once they are older than the
+grace period.
+
+    python -m app.attachments gc [grace_hours]
+"""
+import os
+import re
+import sys
+import uuid
+import asyncio
+import shutil
+import hashlib
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from pymongo import ReturnDocument, UpdateMany
+from app.cache import TTLCache
+from app.database import attachment_collection
+
+ATTACHMENT_DIR = os.getenv("ATTACHMENT_DIR", "attachments")
+# Largest single-request upload; resumable uploads have their own limit.
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(25 * 1024 * 1024)))
+# Bytes handed to a worker thread per write.
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+ATTACHMENT_GC_GRACE_HOURS = float(os.getenv("ATTACHMENT_GC_GRACE_HOURS", "24"))
+
+ATTACHMENT_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+_ATTACHMENT_URL_RE = re.compile(r"/attachments/([0-9a-f]{64})\b")
+
+# Attachment metadata never changes, so lookups for serving can be cached.
+_meta_cache = TTLCache(maxsize=10000, ttl=3600)
+
+
+def object_path(digest: str) -> str:
+    return os.path.join(ATTACHMENT_DIR, "objects", digest[:2], digest)
+
+
+def temp_path(name: Optional[str] = None) -> str:
+    # Same filesystem as the objects, so the final rename is atomic.
+    directory = os.path.join(ATTACHMENT_DIR, "tmp")
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{name or uuid.uuid4().hex}.part")
+
+
+def attachment_url(base_url: str, digest: str, filename: Optional[str] = None) -> str:
+    url = f"{base_url}attachments/{digest}"
+    return f"{url}/{filename}" if filename else url
+
+
+def describe(meta: Dict, base_url: str) -> Dict:
+    # Client-facing view of an attachment record.
+    return {
+        "id": meta["_id"],
+        "url": attachment_url(base_url, meta["_id"], meta["filename"]),
+        "filename": meta["filename"],
+        "content_type": meta["content_type"],
+        "size": meta["size"],
+    }
+
+
+def attachment_ids(values: Iterable[str]) -> Set[str]:
+    """Attachment ids referenced by ids or attachment URLs in `values`."""
+    found = set()
+    for value in values or ():
+        if not isinstance(value, str):
+            continue
+        if ATTACHMENT_ID_RE.match(value):
+            found.add(value)
+        else:
+            found.update(_ATTACHMENT_URL_RE.findall(value))
+    return found
+
+
+class StreamingWriter:
+    """
+    Appends chunks to a file on a worker thread while hashing them, and
+    rejects the upload with 413 once it grows past `max_bytes`.
+    """
+
+    def __init__(self, path: str, max_bytes: int, offset: int = 0, hasher=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.size = offset
+        self.hasher = hasher if hasher is not None else hashlib.sha256()
+        self._buffer = bytearray()
+        self._file = None
+
+    def _open(self):
+        # Drop anything past `offset` left by an interrupted request.
+        self._file = open(self.path, "r+b" if os.path.exists(self.path) else "wb")
+        self._file.truncate(self.size)
+        self._file.seek(self.size)
+
+    def _write(self, data: bytes):
+        if self._file is None:
+            self._open()
+        self.hasher.update(data)
+        self._file.write(data)
+
+    async def write(self, chunk: bytes):
+        if self.size + len(self._buffer) + len(chunk) > self.max_bytes:
+            raise HTTPException(status_code=413, detail=f"Upload exceeds the {self.max_bytes} byte limit")
+        self._buffer += chunk
+        if len(self._buffer) >= UPLOAD_CHUNK_SIZE:
+            await self.flush()
+
+    async def flush(self):
+        if self._buffer:
+            data, self._buffer = bytes(self._buffer), bytearray()
+            await run_in_threadpool(self._write, data)
+            self.size += len(data)
+
+    async def close(self):
+        await self.flush()
+        if self._file is None:
+            await run_in_threadpool(self._open)
+        await run_in_threadpool(self._file.close)
+
+    async def abort(self, keep: bool = False):
+        # Close after a failed request; `keep` leaves the file for a retry.
+        if self._file is not None:
+            await run_in_threadpool(self._file.close)
+        if not keep:
+            await discard(self.path)
+
+    def hexdigest(self) -> str:
+        return self.hasher.hexdigest()
+
+
+def _discard(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+async def discard(path: str):
+    await run_in_threadpool(_discard, path)
+
+
+def hash_file(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def append_part(path: str, part: str, offset: int):
+    """Move the bytes of `part` to `offset` of `path`, dropping anything after it."""
+    if offset == 0:
+        os.replace(part, path)
+        return
+    with open(part, "rb") as src, open(path, "r+b" if os.path.exists(path) else "wb") as dst:
+        dst.truncate(offset)
+        dst.seek(offset)
+        shutil.copyfileobj(src, dst, UPLOAD_CHUNK_SIZE)
+    _discard(part)
+
+
+def _place(tmp: str, digest: str):
+    final = object_path(digest)
+    if os.path.exists(final):
+        # Already stored: deduplicate.
+        _discard(tmp)
+        return
+    os.makedirs(os.path.dirname(final), exist_ok=True)
+    os.replace(tmp, final)
+
+
+async def commit(tmp: str, digest: str, size: int, filename: str, content_type: Optional[str]) -> Dict:
+    """Move a fully written temp file into the store and return its record."""
+    now = datetime.utcnow()
+    # Touch the record first so a concurrent gc no longer considers it unused.
+    meta = await attachment_collection.find_one_and_update(
+        {"_id": digest},
+        {
+            "$setOnInsert": {
+                "size": size,
+                "content_type": content_type or "application/octet-stream",
+                "filename": os.path.basename(filename or "") or digest,
+                "refs": [],
+                "created_at": now,
+            },
+            "$set": {"last_uploaded_at": now},
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    await run_in_threadpool(_place, tmp, digest)
+    return meta
+
+
+async def save_upload(file, filename: str, content_type: Optional[str], max_bytes: int = UPLOAD_MAX_BYTES) -> Dict:
+    """Stream a starlette UploadFile into the store."""
+    writer = StreamingWriter(temp_path(), max_bytes)
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            await writer.write(chunk)
+        await writer.close()
+    except BaseException:
+        await writer.abort()
+        raise
+    return await commit(writer.path, writer.hexdigest(), writer.size, filename, content_type)
+
+
+async def get_attachment(digest: str) -> Optional[Dict]:
+    meta = _meta_cache.get(digest)
+    if meta is None:
+        meta = await attachment_collection.find_one({"_id": digest}, {"refs": 0})
+        if meta is not None:
+            _meta_cache.set(digest, meta)
+    return meta
+
+
+def forget_attachment(digest: str):
+    _meta_cache.pop(digest)
+
+
+# --- References ---
+def _ref_writes(owner: str, ids: Set[str]) -> List[UpdateMany]:
+    return [
+        UpdateMany({"refs": owner, "_id": {"$nin": list(ids)}}, {"$pull": {"refs": owner}}),
+        UpdateMany({"_id": {"$in": list(ids)}}, {"$addToSet": {"refs": owner}}),
+    ]
+
+
+async def sync_refs(owners: Dict[str, Iterable[str]]):
+    """Make each owner reference exactly the attachments found in its values."""
+    writes = [write for owner, values in owners.items() for write in _ref_writes(owner, attachment_ids(values))]
+    if writes:
+        await attachment_collection.bulk_write(writes, ordered=False)
+
+
+async def add_refs(owners: Dict[str, Iterable[str]]):
+    """Add references from newly created owners."""
+    writes = [
+        UpdateMany({"_id": {"$in": list(ids)}}, {"$addToSet": {"refs": owner}})
+        for owner, ids in ((owner, attachment_ids(values)) for owner, values in owners.items()) if ids
+    ]
+    if writes:
+        await attachment_collection.bulk_write(writes, ordered=False)
+
+
+async def release_refs(owners: List[str]):
+    if owners:
+        await attachment_collection.update_many({"refs": {"$in": owners}}, {"$pull": {"refs": {"$in": owners}}})
+
+
+# --- Garbage collection ---
+def _unlink_object(digest: str) -> Optional[str]:
+    # Move the object aside instead of deleting it, so it can be put back.
+    final = object_path(digest)
+    aside = f"{final}.{uuid.uuid4().hex}.gc"
+    try:
+        os.replace(final, aside)
+    except OSError:
+        return None
+    return aside
+
+
+async def _remove_object(digest: str):
+    aside = await run_in_threadpool(_unlink_object, digest)
+    if aside is None:
+        return
+    # A commit that re-created the record after our delete may have
+    # deduplicated against this file: put it back instead of losing it.
+    if await attachment_collection.find_one({"_id": digest}, {"_id": 1}) is not None:
+        await run_in_threadpool(os.replace, aside, object_path(digest))
+    else:
+        await discard(aside)
+
+
+async def collect_garbage(grace_hours: float = ATTACHMENT_GC_GRACE_HOURS) -> int:
+    cutoff = datetime.utcnow() - timedelta(hours=grace_hours)
+    removed = 0
+    unused = attachment_collection.find({"refs": {"$size": 0}, "last_uploaded_at": {"$lt": cutoff}}, {"_id": 1})
+    async for doc in unused:
+        # Re-checked in the delete so a concurrent upload or new ref wins.
+        result = await attachment_collection.delete_one(
+            {"_id": doc["_id"], "refs": {"$size": 0}, "last_uploaded_at": {"$lt": cutoff}}
+        )
+        if result.deleted_count:
+            await _remove_object(doc["_id"])
+            removed += 1
+    # Temp files of abandoned uploads.
+    tmp_dir = os.path.join(ATTACHMENT_DIR, "tmp")
+    if os.path.isdir(tmp_dir):
+        for name in os.listdir(tmp_dir):
+            path = os.path.join(tmp_dir, name)
+            if datetime.utcfromtimestamp(os.path.getmtime(path)) < cutoff:
+                await discard(path)
+    return removed
+
+
+async def _main(argv):
+    if not argv or argv[0] != "gc":
+        print("usage: python -m app.attachments gc [grace_hours]")
+        return 2
+    grace = float(argv[1]) if len(argv) > 1 else ATTACHMENT_GC_GRACE_HOURS
+    print(f"Removed {await collect_garbage(grace)} unreferenced attachments")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
@@ -1,22 +1,54 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional, Tuple
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi import Request, HTTPException
 from .auth_handler import decode_access_token
 
+@dataclass(frozen=True)
+class Principal:
+    """The authenticated caller of a request."""
+    username: str
+    token: str
+    claims: dict = field(repr=False)
+
+    @property
+    def expires_at(self) -> Optional[datetime]:
+        exp = self.claims.get("exp")
+        return datetime.utcfromtimestamp(exp) if exp is not None else None
+
 class JWTBearer(HTTPBearer):
     def __init__(self, auto_error: bool = True):
         super(JWTBearer, self).__init__(auto_error=auto_error)
 
     async def __call__(self, request: Request) -> str:
+        token, _ = await self.authenticate(request)
+        return token
+
+    async def authenticate(self, request: Request) -> Tuple[str, dict]:
         credentials: HTTPAuthorizationCredentials = await super(JWTBearer, self).__call__(request)
         if not credentials or credentials.scheme.lower() != "bearer":
             raise HTTPException(status_code=403, detail="Invalid authorization scheme")
 
         token = credentials.credentials
-        if not self.verify_jwt(token):
+        payload = decode_access_token(token)
+        if not payload:
             raise HTTPException(status_code=403, detail="Invalid or expired token")
 
-        return token
+        return token, payload
 
     def verify_jwt(self, token: str) -> bool:
         payload = decode_access_token(token)
         return bool(payload)  # Returns False if decoding fails
+
+class JWTPrincipal(JWTBearer):
+    async def __call__(self, request: Request) -> Principal:
+        token, payload = await self.authenticate(request)
+        username = payload.get("sub")
+        if not username:
+            raise HTTPException(status_code=403, detail="Invalid or expired token")
+        return Principal(username=username, token=token, claims=payload)
+
+# Single dependency for protected routes: verifies the bearer token once
+# (through the verified-token cache) and yields the caller's Principal.
+get_principal = JWTPrincipal()
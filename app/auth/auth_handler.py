@@ -1,16 +1,51 @@
+import os
+import time
+import hashlib
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from fastapi.security import OAuth2PasswordBearer
 from fastapi import Depends, HTTPException
 from app.database import user_collection
+from app.cache import TTLCache
 
 # Secret key for JWT (use a strong key in production)
 SECRET_KEY = "your_secret_key_here"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Verified tokens are cached by their SHA-256 digest so hot endpoints don't
+# re-verify the signature on every request. Entries never outlive `exp`.
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "300"))
+token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
+
+# User documents (without the password hash) looked up by get_current_user.
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+# bcrypt cost factor. Pinning min/max to the same value makes passlib flag
+# any hash made with a different cost as needing an update.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Password work runs on its own thread pool (bcrypt releases the GIL),
+# and at most PASSWORD_HASH_MAX_PENDING calls may be queued or running.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 2)))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_pending_password_jobs = 0
 
 # ✅ Hash password
 def get_password_hash(password: str) -> str:
@@ -20,6 +55,31 @@ def get_password_hash(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+async def _run_password_job(func, *args):
+    global _pending_password_jobs
+    if _pending_password_jobs >= PASSWORD_HASH_MAX_PENDING:
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy, please try again shortly",
+            headers={"Retry-After": "1"},
+        )
+    _pending_password_jobs += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(password_executor, func, *args)
+    finally:
+        _pending_password_jobs -= 1
+
+# ✅ Hash password without blocking the event loop
+async def hash_password_async(password: str) -> str:
+    return await _run_password_job(pwd_context.hash, password)
+
+# ✅ Verify password without blocking the event loop.
+# Returns (valid, new_hash); new_hash is set when the stored hash was made
+# with an outdated cost factor and should be replaced.
+async def verify_and_update_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return await _run_password_job(pwd_context.verify_and_update, plain_password, hashed_password)
+
 # ✅ Generate JWT Token
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
@@ -29,11 +89,20 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
 
 # ✅ Decode JWT Token
 def decode_access_token(token: str):
+    key = hashlib.sha256(token.encode()).digest()
+    payload = token_cache.get(key)
+    if payload is not None:
+        return payload
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
     except JWTError:
         return None
+    ttl = TOKEN_CACHE_TTL
+    if payload.get("exp") is not None:
+        ttl = min(ttl, payload["exp"] - time.time())
+    if ttl > 0:
+        token_cache.set(key, payload, ttl=ttl)
+    return payload
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
@@ -42,15 +111,30 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         status_code=401,
         detail="Could not validate credentials",
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except JWTError:
+    payload = decode_access_token(token)
+    if payload is None:
+        raise credentials_exception
+    username: str = payload.get("sub")
+    if username is None:
         raise credentials_exception
 
-    user = await user_collection.find_one({"username": username})
+    user = await get_cached_user(username)
     if user is None:
         raise credentials_exception
-    return user
\ No newline at end of file
+    return user
+
+async def get_cached_user(username: str):
+    user = user_cache.get(username)
+    if user is not None:
+        return user
+    user = await user_collection.find_one({"username": username}, {"password": 0})
+    if user is not None:
+        user_cache.set(username, user)
+    return user
+
+def invalidate_user(username: str):
+    # Call whenever a user record is created, changed or deleted.
+    user_cache.pop(username)
+
+def user_cache_stats() -> dict:
+    return user_cache.stats()
\ No newline at end of file
@@ -0,0 +1,161 @@
+"""
+Pub/sub backplane for live events shared by all workers.
+
+Publishers send `(channel, key, data)` events, e.g. a chat message for
+one conversation or task changes for one user; every worker delivers
+them to the handlers it subscribed for that channel, which fan them out
+to their local WebSocket connections. Select the implementation with CHAT_BACKPLANE:
+
+- `memory` (default): delivers within this process only. Enough for a
+  single uvicorn worker, and for tests.
+- `mongo`: events are inserted into `chat_events` and every worker tails
+  the collection with a change stream (requires a replica set or Atlas).
+  Events are delivered to local subscribers immediately and skipped when
+  they come back through the stream. After a stream error the worker
+  resumes from the last event it saw; if that point is no longer in the
+  oplog (or its event expired), it logs the gap and restarts from now.
+"""
+import os
+import uuid
+import asyncio
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+from pymongo.errors import OperationFailure, PyMongoError
+from app.database import chat_event_collection
+
+CHAT_BACKPLANE = os.getenv("CHAT_BACKPLANE", "memory")  # "memory" or "mongo"
+# Seconds between attempts to reopen a failed change stream.
+BACKPLANE_RETRY_SECONDS = 1.0
+BACKPLANE_MAX_RETRY_SECONDS = 30.0
+# Change stream errors after which the resume token can never be used again:
+# InvalidResumeToken, ChangeStreamFatalError, ChangeStreamHistoryLost.
+RESUME_TOKEN_LOST_CODES = (260, 280, 286)
+
+Handler = Callable[[str, Any], None]
+
+
+class Backplane:
+    name = "base"
+
+    def __init__(self):
+        self.handlers: Dict[str, List[Handler]] = {}
+        self.published = 0
+        self.delivered = 0
+
+    def subscribe(self, channel: str, handler: Handler):
+        """Call `handler(key, data)` for every event published on `channel`."""
+        self.handlers.setdefault(channel, []).append(handler)
+
+    def _deliver(self, channel: str, key: str, data: Any):
+        self.delivered += 1
+        for handler in self.handlers.get(channel, ()):
+            try:
+                handler(key, data)
+            except Exception as e:
+                print(f"Backplane handler for {channel} failed: {str(e)}")
+
+    async def publish(self, channel: str, key: str, data: Any):
+        raise NotImplementedError
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def stats(self) -> dict:
+        return {"type": self.name, "published": self.published, "delivered": self.delivered}
+
+
+class InMemoryBackplane(Backplane):
+    name = "memory"
+
+    async def publish(self, channel: str, key: str, data: Any):
+        self.published += 1
+        self._deliver(channel, key, data)
+
+
+class MongoBackplane(Backplane):
+    name = "mongo"
+
+    def __init__(self, collection=chat_event_collection):
+        super().__init__()
+        self.collection = collection
+        self.origin = uuid.uuid4().hex  # this worker
+        self.resume_token = None
+        self._watcher: Optional[asyncio.Task] = None
+
+    async def publish(self, channel: str, key: str, data: Any):
+        self.published += 1
+        # Local subscribers don't wait for the round trip through the stream.
+        self._deliver(channel, key, data)
+        await self.collection.insert_one({
+            "channel": channel,
+            "key": key,
+            "data": data,
+            "origin": self.origin,
+            "created_at": datetime.utcnow(),
+        })
+
+    async def start(self):
+        if self._watcher is None:
+            self._watcher = asyncio.create_task(self._watch())
+
+    async def _watch(self):
+        pipeline = [{"$match": {"operationType": "insert", "fullDocument.origin": {"$ne": self.origin}}}]
+        delay = BACKPLANE_RETRY_SECONDS
+        while True:
+            try:
+                async with self.collection.watch(pipeline, resume_after=self.resume_token) as stream:
+                    delay = BACKPLANE_RETRY_SECONDS
+                    async for change in stream:
+                        self.resume_token = stream.resume_token
+                        event = change["fullDocument"]
+                        self._deliver(event["channel"], event["key"], event["data"])
+            except asyncio.CancelledError:
+                raise
+            except PyMongoError as e:
+                if self.resume_token is not None and isinstance(e, OperationFailure) \
+                        and e.code in RESUME_TOKEN_LOST_CODES:
+                    # Retrying with the same token would fail forever.
+                    print(f"Backplane cannot resume ({str(e)}); events since the last one seen "
+                          "are lost, restarting the change stream from now")
+                    self.resume_token = None
+                    continue
+                print(f"Backplane change stream failed ({str(e)}), retrying in {delay:.0f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, BACKPLANE_MAX_RETRY_SECONDS)
+
+    async def close(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+
+    def stats(self) -> dict:
+        return {**super().stats(), "watching": self._watcher is not None and not self._watcher.done()}
+
+
+BACKPLANES = {
+    "memory": InMemoryBackplane,
+    "mongo": MongoBackplane,
+}
+
+_backplane: Optional[Backplane] = None
+
+
+def get_backplane() -> Backplane:
+    global _backplane
+    if _backplane is None:
+        if CHAT_BACKPLANE not in BACKPLANES:
+            raise ValueError(f"Unknown CHAT_BACKPLANE {CHAT_BACKPLANE!r}; use 'memory' or 'mongo'")
+        _backplane = BACKPLANES[CHAT_BACKPLANE]()
+    return _backplane
+
+
+async def close_backplane():
+    if _backplane is not None:
+        await _backplane.close()
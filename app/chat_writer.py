@@ -0,0 +1,148 @@
+"""
+Write-behind persistence for chat messages.
+
+Messages get their ObjectId on the server and are buffered; a background
+task writes the buffer with one `insert_many` once CHAT_FLUSH_MAX_BATCH
+messages are waiting or CHAT_FLUSH_INTERVAL_MS has passed. CHAT_DURABILITY
+decides when the sender is acknowledged:
+
+- `write` (default): after the batch holding the message was inserted.
+  Concurrent senders share one round trip.
+- `enqueue`: as soon as the message is buffered. Lowest latency, but
+  messages still buffered are lost if the process dies; the buffer is
+  flushed on a normal shutdown.
+"""
+import os
+import asyncio
+from typing import Dict, List, Optional, Tuple
+from pymongo.errors import BulkWriteError, PyMongoError
+from app.database import chat_collection
+from app.attachments import add_refs
+
+CHAT_DURABILITY = os.getenv("CHAT_DURABILITY", "write")  # "write" or "enqueue"
+CHAT_FLUSH_MAX_BATCH = int(os.getenv("CHAT_FLUSH_MAX_BATCH", "500"))
+CHAT_FLUSH_INTERVAL_MS = float(os.getenv("CHAT_FLUSH_INTERVAL_MS", "10"))
+# Attempts per batch in enqueue mode, where nobody is waiting to see the error.
+CHAT_FLUSH_RETRIES = 3
+
+if CHAT_DURABILITY not in ("write", "enqueue"):
+    raise ValueError(f"Unknown CHAT_DURABILITY {CHAT_DURABILITY!r}; use 'write' or 'enqueue'")
+
+
+class ChatWriter:
+    def __init__(self, collection=chat_collection, durability: str = CHAT_DURABILITY,
+                 max_batch: int = CHAT_FLUSH_MAX_BATCH, interval_ms: float = CHAT_FLUSH_INTERVAL_MS):
+        self.collection = collection
+        self.durability = durability
+        self.max_batch = max_batch
+        self.interval = interval_ms / 1000
+        self._buffer: List[Tuple[Dict, Optional[asyncio.Future]]] = []
+        self._pending: Optional[asyncio.Event] = None  # something is buffered
+        self._full: Optional[asyncio.Event] = None     # flush now, don't wait for the interval
+        self._flusher: Optional[asyncio.Task] = None
+        self._closing = False
+        self.flushes = 0
+        self.written = 0
+        self.failed = 0
+
+    def _ensure_flusher(self):
+        if self._flusher is None or self._flusher.done():
+            self._pending, self._full = asyncio.Event(), asyncio.Event()
+            self._flusher = asyncio.create_task(self._run())
+
+    async def write(self, message: Dict):
+        """Buffer `message` (which must have its `_id`) and acknowledge per the durability mode."""
+        self._ensure_flusher()
+        future = asyncio.get_running_loop().create_future() if self.durability == "write" else None
+        self._buffer.append((message, future))
+        self._pending.set()
+        if len(self._buffer) >= self.max_batch:
+            self._full.set()
+        if future is not None:
+            await future
+
+    async def _run(self):
+        while not (self._closing and not self._buffer):
+            await self._pending.wait()
+            # Give concurrent senders the interval to join the batch.
+            if not self._closing:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._pending.clear()
+            self._full.clear()
+            await self.flush()
+
+    async def flush(self):
+        while self._buffer:
+            batch, self._buffer = self._buffer[:self.max_batch], self._buffer[self.max_batch:]
+            await self._write_batch(batch)
+
+    async def _write_batch(self, batch: List[Tuple[Dict, Optional[asyncio.Future]]]):
+        messages = [message for message, _ in batch]
+        error = None
+        attempts = 1 if self.durability == "write" else CHAT_FLUSH_RETRIES
+        for _ in range(attempts):
+            try:
+                await self.collection.insert_many(messages, ordered=False)
+                error = None
+                break
+            except BulkWriteError as e:
+                # Duplicate keys are messages a previous attempt already wrote.
+                others = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+                error = e if others else None
+                if error is None:
+                    break
+            except Exception as e:
+                error = e
+        self.flushes += 1
+        if error is None:
+            self.written += len(messages)
+            try:
+                await add_refs({f"chat:{message['_id']}": [message.get("message")] for message in messages})
+            except PyMongoError as e:
+                print(f"Could not record chat attachment refs: {str(e)}")
+        else:
+            self.failed += len(messages)
+            print(f"Chat write-behind flush of {len(messages)} messages failed: {str(error)}")
+        for _, future in batch:
+            if future is not None and not future.done():
+                if error is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(error)
+
+    async def close(self):
+        self._closing = True
+        if self._flusher is not None and not self._flusher.done():
+            self._pending.set()
+            self._full.set()
+            await self._flusher
+        self._flusher = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "durability": self.durability,
+            "buffered": len(self._buffer),
+            "flushes": self.flushes,
+            "written": self.written,
+            "failed": self.failed,
+        }
+
+
+_chat_writer: Optional[ChatWriter] = None
+
+
+def get_chat_writer() -> ChatWriter:
+    global _chat_writer
+    if _chat_writer is None:
+        _chat_writer = ChatWriter()
+    return _chat_writer
+
+
+async def close_chat_writer():
+    # Flush what is still buffered before the process exits.
+    if _chat_writer is not None:
+        await _chat_writer.close()
@@ -0,0 +1,168 @@
+"""
+WebSocket fan-out.
+
+Every connection owns a bounded send queue drained by its own writer task,
+so `broadcast` only enqueues and never waits on a socket: one slow or dead
+client cannot delay the others or the sender's receive loop. When a queue
+is full the connection is either disconnected (WS_OVERFLOW_POLICY=disconnect,
+the client reconnects and replays history) or loses its oldest queued
+frame (drop_oldest). A send that stalls for WS_SEND_TIMEOUT seconds, or
+fails, evicts the connection.
+
+Broadcast events are rendered to a frame once per distinct `render`
+function of the receiving connections. Idle connections get their
+heartbeat frame every WS_HEARTBEAT_SECONDS if they have one; protocol-level
+pings for plain-text clients are sent by uvicorn (--ws-ping-interval).
+"""
+import os
+import time
+import asyncio
+from collections import deque
+from typing import Any, Callable, Dict, Hashable, List, Optional
+from fastapi import WebSocket
+
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+WS_OVERFLOW_POLICY = os.getenv("WS_OVERFLOW_POLICY", "disconnect")  # "disconnect" or "drop_oldest"
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+WS_HEARTBEAT_SECONDS = float(os.getenv("WS_HEARTBEAT_SECONDS", "20"))
+# Close code for evicted slow consumers ("try again later").
+WS_CLOSE_SLOW_CONSUMER = 1013
+# Recent delivery latencies kept for the percentiles in `stats`.
+LATENCY_SAMPLES = 1024
+
+if WS_OVERFLOW_POLICY not in ("disconnect", "drop_oldest"):
+    raise ValueError(f"Unknown WS_OVERFLOW_POLICY {WS_OVERFLOW_POLICY!r}; use 'disconnect' or 'drop_oldest'")
+
+
+class Connection:
+    def __init__(self, key: Hashable, websocket: WebSocket, heartbeat: Optional[str] = None,
+                 render: Optional[Callable[[Any], str]] = None):
+        self.key = key
+        self.websocket = websocket
+        self.heartbeat = heartbeat
+        self.render = render  # event -> frame; None for events that are frames already
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+        self.writer: Optional[asyncio.Task] = None
+        self.closed = False
+        self.evicting = False  # an eviction is scheduled; send nothing more
+        self.dropped = 0
+
+
+class ConnectionManager:
+    def __init__(self):
+        self.active_connections: Dict[Hashable, List[Connection]] = {}
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)  # seconds from enqueue to sent
+        self.sent = 0
+        self.dropped = 0
+        self.evicted = 0
+        self.broadcasts = 0
+        self._evictions = set()  # keeps scheduled eviction tasks referenced until done
+
+    async def connect(self, key: Hashable, websocket: WebSocket, heartbeat: Optional[str] = None,
+                      render: Optional[Callable[[Any], str]] = None, start: bool = True) -> Connection:
+        """
+        Accept and register `websocket`. With start=False, frames are queued
+        until `start` is called, so the caller can first send frames of its
+        own (e.g. history) directly.
+        """
+        await websocket.accept()
+        connection = Connection(key, websocket, heartbeat, render)
+        self.active_connections.setdefault(key, []).append(connection)
+        if start:
+            self.start(connection)
+        return connection
+
+    def start(self, connection: Connection):
+        if connection.writer is None and not connection.closed:
+            connection.writer = asyncio.create_task(self._write_loop(connection))
+
+    def disconnect(self, connection: Connection):
+        connection.closed = True
+        connections = self.active_connections.get(connection.key)
+        if connections and connection in connections:
+            connections.remove(connection)
+            if not connections:
+                del self.active_connections[connection.key]
+        if connection.writer is not None and connection.writer is not asyncio.current_task():
+            connection.writer.cancel()
+
+    def send(self, connection: Connection, message: str):
+        """Queue one frame for `connection` without waiting for the socket."""
+        if connection.closed or connection.evicting:
+            return
+        item = (message, time.monotonic())
+        try:
+            connection.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            if WS_OVERFLOW_POLICY == "disconnect":
+                # One eviction per connection, however many sends hit the full queue.
+                connection.evicting = True
+                task = asyncio.create_task(self._evict(connection))
+                self._evictions.add(task)
+                task.add_done_callback(self._evictions.discard)
+                return
+            connection.queue.get_nowait()
+            connection.queue.put_nowait(item)
+            connection.dropped += 1
+            self.dropped += 1
+
+    def broadcast(self, key: Hashable, event: Any):
+        self.broadcasts += 1
+        frames = {}
+        for connection in list(self.active_connections.get(key, ())):
+            render = connection.render
+            if render not in frames:
+                frames[render] = event if render is None else render(event)
+            self.send(connection, frames[render])
+
+    async def _write_loop(self, connection: Connection):
+        websocket = connection.websocket
+        try:
+            while True:
+                try:
+                    message, queued_at = await asyncio.wait_for(connection.queue.get(), WS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if connection.heartbeat is None:
+                        continue
+                    message, queued_at = connection.heartbeat, None
+                await asyncio.wait_for(websocket.send_text(message), WS_SEND_TIMEOUT)
+                if queued_at is not None:
+                    self.sent += 1
+                    self.latencies.append(time.monotonic() - queued_at)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Stalled or dead socket.
+            await self._evict(connection)
+
+    async def _evict(self, connection: Connection):
+        if connection.closed:
+            return
+        self.evicted += 1
+        self.disconnect(connection)
+        try:
+            await asyncio.wait_for(connection.websocket.close(code=WS_CLOSE_SLOW_CONSUMER), WS_SEND_TIMEOUT)
+        except Exception:
+            pass
+
+    def stats(self) -> dict:
+        connections = [c for group in self.active_connections.values() for c in group]
+        depths = [c.queue.qsize() for c in connections]
+        latencies = sorted(self.latencies)
+
+        def percentile(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 3)
+
+        return {
+            "keys": len(self.active_connections),
+            "connections": len(connections),
+            "queue_depth": {"total": sum(depths), "max": max(depths, default=0), "limit": WS_SEND_QUEUE_SIZE},
+            "overflow_policy": WS_OVERFLOW_POLICY,
+            "broadcasts": self.broadcasts,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "evicted": self.evicted,
+            "fanout_latency_ms": {"p50": percentile(0.5), "p99": percentile(0.99), "max": percentile(1.0)},
+        }
@@ -0,0 +1,168 @@
+"""
+Builds the message list sent to the LLM for a chat turn.
+
+The prompt is bounded by a token budget: the opening greeting, a running
+summary of older turns and the newest turns that fit. Injected context
+snapshots (task lists, document excerpts) are only kept for their latest
+occurrence. Turns that fall out of the window are folded into the
+conversation's stored summary in the background.
+"""
+import os
+import re
+import asyncio
+from typing import List, Dict, Tuple
+from app.llm import get_llm
+
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", "3000"))
+# How many of the newest stored messages are considered for the window.
+CHAT_HISTORY_FETCH = int(os.getenv("CHAT_HISTORY_FETCH", "200"))
+# Summarize once at least this many messages have dropped out of the window.
+CHAT_SUMMARY_MIN_MESSAGES = int(os.getenv("CHAT_SUMMARY_MIN_MESSAGES", "6"))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "300"))
+
+# Kinds of injected system messages where only the newest one matters.
+SNAPSHOT_KINDS = ("task_snapshot", "doc_context")
+
+# Per-message framing overhead in chat-format prompts.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+def count_tokens(text: str) -> int:
+    """
+    Local token estimate, close to BPE tokenizers for English text:
+    one token per punctuation mark and roughly one per 4 characters of a word.
+    """
+    return sum(1 + (len(piece) - 1) // 4 for piece in _TOKEN_RE.findall(text or ""))
+
+
+def message_tokens(message: Dict) -> int:
+    return count_tokens(message.get("content")) + MESSAGE_OVERHEAD_TOKENS
+
+
+def _kind(message: Dict):
+    kind = message.get("kind")
+    if kind or message.get("role") != "system":
+        return kind
+    # Messages stored before snapshots were tagged.
+    content = message.get("content") or ""
+    if content.startswith(("Here are your current tasks:", "You have no tasks at the moment.")):
+        return "task_snapshot"
+    if content.startswith("Document Title:"):
+        return "doc_context"
+    return None
+
+
+def _for_llm(message: Dict) -> Dict[str, str]:
+    return {"role": message["role"], "content": message["content"]}
+
+
+def build_context(
+    history: List[Dict],
+    new_messages: List[Dict],
+    summary: str = None,
+    summary_upto: int = 0,
+    budget: int = CHAT_CONTEXT_TOKENS,
+) -> Tuple[List[Dict[str, str]], List[Dict]]:
+    """
+    Returns (prompt messages, overflow). `history` is the stored conversation
+    (oldest first, with `seq`), `new_messages` this turn's messages which are
+    always included. `overflow` are stored messages left out of the window
+    that the summary does not cover yet.
+    """
+    combined = history + new_messages
+    newest_snapshot = {}
+    for i, message in enumerate(combined):
+        kind = _kind(message)
+        if kind in SNAPSHOT_KINDS:
+            newest_snapshot[kind] = i
+    stale = {i for i, message in enumerate(combined)
+             if _kind(message) in SNAPSHOT_KINDS and newest_snapshot[_kind(message)] != i}
+
+    head = []
+    candidates = [m for i, m in enumerate(history) if i not in stale]
+    if candidates and candidates[0].get("seq") == 1 and candidates[0]["role"] == "system":
+        head = [candidates.pop(0)]
+    new_kept = [m for i, m in enumerate(new_messages, start=len(history)) if i not in stale]
+
+    summary_message = []
+    if summary:
+        summary_message = [{"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"}]
+
+    remaining = budget - sum(message_tokens(m) for m in head + summary_message + new_kept)
+    recent = []
+    for message in reversed(candidates):
+        cost = message_tokens(message)
+        if cost > remaining:
+            break
+        recent.append(message)
+        remaining -= cost
+    recent.reverse()
+
+    dropped = candidates[:len(candidates) - len(recent)]
+    overflow = [m for m in dropped if m.get("seq", 0) > summary_upto and _kind(m) not in SNAPSHOT_KINDS]
+    prompt = [_for_llm(m) for m in head] + summary_message + [_for_llm(m) for m in recent + new_kept]
+    return prompt, overflow
+
+
+_summarizing = set()
+_background_tasks = set()
+
+
+def summary_chunks(overflow: List[Dict], budget: int) -> List[List[str]]:
+    """
+    Split `overflow` (oldest first) into consecutive chunks of
+    "role: content" lines of at most `budget` tokens each. A message larger
+    than the budget gets a chunk of its own.
+    """
+    chunks, chunk, used = [], [], 0
+    for message in overflow:
+        line = f"{message['role']}: {message['content']}"
+        cost = count_tokens(line)
+        if chunk and used + cost > budget:
+            chunks.append(chunk)
+            chunk, used = [], 0
+        chunk.append(line)
+        used += cost
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+async def update_summary(store, conversation_id: str, previous_summary: str, overflow: List[Dict]):
+    # Fold `overflow` into the running summary stored with the conversation,
+    # oldest messages first. Each chunk keeps the summarization prompt within
+    # the context budget and is saved as soon as it is folded in, so a failure
+    # leaves `summary_upto` at the last message actually summarized.
+    if len(overflow) < CHAT_SUMMARY_MIN_MESSAGES or conversation_id in _summarizing:
+        return
+    _summarizing.add(conversation_id)
+    try:
+        summary = previous_summary
+        position = 0
+        for lines in summary_chunks(overflow, CHAT_CONTEXT_TOKENS - CHAT_SUMMARY_MAX_TOKENS):
+            prompt = [
+                {"role": "system", "content": (
+                    "Summarize the conversation so far for an assistant that will continue it. "
+                    "Keep facts, names, dates, decisions and open questions. Be concise."
+                )},
+                {"role": "user", "content": (
+                    f"Previous summary:\n{summary or '(none)'}\n\nNew messages:\n" + "\n".join(lines)
+                )},
+            ]
+            summary = await get_llm().complete(prompt, temperature=0, max_tokens=CHAT_SUMMARY_MAX_TOKENS)
+            position += len(lines)
+            await store.save_summary(conversation_id, summary, overflow[position - 1]["seq"])
+    except Exception as e:
+        print(f"Error summarizing conversation {conversation_id}: {str(e)}")
+    finally:
+        _summarizing.discard(conversation_id)
+
+
+def schedule_summary(store, conversation_id: str, previous_summary: str, overflow: List[Dict]):
+    if len(overflow) < CHAT_SUMMARY_MIN_MESSAGES:
+        return
+    task = asyncio.create_task(update_summary(store, conversation_id, previous_summary, overflow))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
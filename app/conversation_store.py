@@ -0,0 +1,141 @@
+from datetime import datetime
+from typing import List, Dict, Optional, Tuple
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+
+class ConversationStore:
+    """
+    Append-only storage for AI conversations.
+
+    Each conversation has a small header document in `meta_collection`
+    (`_id` = conversation id, `seq` = last allocated sequence number) and
+    one document per message in `message_collection`, keyed by
+    (conversation_id, seq). A chat turn only inserts its new messages
+    instead of rewriting the whole history.
+    """
+
+    def __init__(self, meta_collection, message_collection, greeting: str):
+        self.meta = meta_collection
+        self.messages = message_collection
+        self.greeting = greeting
+
+    async def _ensure(self, conversation_id: str, fields: Tuple[str, ...] = ()) -> dict:
+        # The conversation header, after creating the conversation (with its
+        # greeting) or migrating a legacy one if needed.
+        meta = await self.meta.find_one({"_id": conversation_id}, {"messages": 1, **dict.fromkeys(fields, 1)})
+        if meta is None:
+            await self._create(conversation_id)
+            return {}
+        if meta.pop("messages", None) is not None:
+            await self._migrate_legacy(conversation_id)
+        return meta
+
+    async def _create(self, conversation_id: str):
+        # Only the request whose upsert creates the header writes the greeting,
+        # at the seq reserved for it.
+        now = datetime.utcnow()
+        try:
+            result = await self.meta.update_one(
+                {"_id": conversation_id}, {"$setOnInsert": {"seq": 1, "updated_at": now}}, upsert=True
+            )
+        except DuplicateKeyError:
+            return  # created by a concurrent request
+        if result.upserted_id is not None:
+            await self.messages.insert_one({
+                "role": "system", "content": self.greeting,
+                "conversation_id": conversation_id, "seq": 1, "created_at": now,
+            })
+
+    async def get_context(self, conversation_id: str, limit: Optional[int] = None) -> Tuple[List[Dict], dict]:
+        """
+        The newest `limit` messages plus the conversation header, which
+        carries the running `summary` and the `summary_upto` seq it covers.
+        """
+        meta = await self._ensure(conversation_id, ("summary", "summary_upto"))
+        return await self.load(conversation_id, limit), meta
+
+    async def save_summary(self, conversation_id: str, summary: str, upto: int):
+        # Never overwrite a summary that already covers more of the conversation.
+        await self.meta.update_one(
+            {"_id": conversation_id, "$or": [{"summary_upto": {"$lt": upto}}, {"summary_upto": {"$exists": False}}]},
+            {"$set": {"summary": summary, "summary_upto": upto}},
+        )
+
+    async def load(self, conversation_id: str, limit: Optional[int] = None) -> List[Dict]:
+        # The most recent `limit` messages (all when None), oldest first.
+        cursor = self.messages.find(
+            {"conversation_id": conversation_id}, {"_id": 0, "role": 1, "content": 1, "kind": 1, "seq": 1}
+        ).sort("seq", -1)
+        if limit:
+            cursor = cursor.limit(limit)
+        messages = await cursor.to_list(length=limit)
+        messages.reverse()
+        return messages
+
+    async def append(self, conversation_id: str, messages: List[Dict[str, str]]):
+        if not messages:
+            return
+        now = datetime.utcnow()
+        try:
+            meta = await self._reserve(conversation_id, len(messages), now)
+        except DuplicateKeyError:
+            # The header still holds a legacy `messages` array (or a concurrent
+            # request just created it): migrate first so the legacy messages
+            # get the lower seqs.
+            await self._migrate_legacy(conversation_id)
+            meta = await self._reserve(conversation_id, len(messages), now)
+        first_seq = meta["seq"] - len(messages) + 1
+        await self.messages.insert_many([
+            {**message, "conversation_id": conversation_id, "seq": first_seq + i, "created_at": now}
+            for i, message in enumerate(messages)
+        ])
+
+    async def _reserve(self, conversation_id: str, count: int, now: datetime) -> dict:
+        # Reserve a block of sequence numbers, creating the header if needed.
+        # A legacy header doesn't match, so the upsert fails on its _id instead.
+        return await self.meta.find_one_and_update(
+            {"_id": conversation_id, "messages": {"$exists": False}},
+            {"$inc": {"seq": count}, "$set": {"updated_at": now}},
+            projection={"seq": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def history_page(self, conversation_id: str, limit: int = 50,
+                           before: Optional[int] = None) -> Tuple[List[Dict], Optional[int]]:
+        """
+        One page of history, newest page first. Returns the messages
+        (oldest first within the page) and the `before` value for the
+        next, older page, or None when there is nothing older.
+        """
+        await self._ensure(conversation_id)
+
+        query = {"conversation_id": conversation_id}
+        if before is not None:
+            query["seq"] = {"$lt": before}
+        cursor = self.messages.find(query, {"_id": 0, "conversation_id": 0}).sort("seq", -1).limit(limit + 1)
+        page = await cursor.to_list(length=limit + 1)
+        has_more = len(page) > limit
+        page = page[:limit]
+        page.reverse()
+        next_before = page[0]["seq"] if has_more and page else None
+        return page, next_before
+
+    async def _migrate_legacy(self, conversation_id: str):
+        # Conversations written before per-message storage keep their
+        # history in a `messages` array. Claim it and reserve seqs 1..n for it
+        # in one update. Appends can only reserve seqs after the claim (see
+        # `_reserve`), so new messages always follow the migrated ones.
+        legacy = await self.meta.find_one_and_update(
+            {"_id": conversation_id, "messages": {"$exists": True}},
+            [{"$set": {"seq": {"$size": {"$ifNull": ["$messages", []]}}}}, {"$unset": "messages"}],
+            projection={"messages": 1},
+            return_document=ReturnDocument.BEFORE,
+        )
+        if legacy and legacy.get("messages"):
+            now = datetime.utcnow()
+            await self.messages.insert_many([
+                {**message, "conversation_id": conversation_id, "seq": seq, "created_at": now}
+                for seq, message in enumerate(legacy["messages"], start=1)
+            ])
@@ -1,8 +1,9 @@
 from .database import todo_collection
 from .models import task_serializer
 from bson import ObjectId
-from .database import database
-from .models import chat_message_serializer
+from .database import chat_collection
+from .models import chat_message_serializer, CHAT_MESSAGE_PROJECTION
+from .chat_writer import get_chat_writer
 
 async def create_todo(todo_data):
     new_todo = await todo_collection.insert_one(todo_data.dict())
@@ -29,19 +30,78 @@ async def delete_todo(id):
     await todo_collection.delete_one({"_id": ObjectId(id)})
     return {"message": "Todo deleted successfully"}
 
-chat_collection = database["chat_messages"]
+def conversation_key(user1: str, user2: str) -> str:
+    # Same key for both directions of a conversation.
+    return "|".join(sorted([user1, user2]))
 
 async def create_chat_message(chat_data: dict) -> dict:
-    result = await chat_collection.insert_one(chat_data)
-    new_message = await chat_collection.find_one({"_id": result.inserted_id})
-    return chat_message_serializer(new_message)
+    # The id is assigned here, so the message can be broadcast without reading it back.
+    chat_data.setdefault("_id", ObjectId())
+    chat_data.setdefault("conversation_key", conversation_key(chat_data["sender"], chat_data["receiver"]))
+    await get_chat_writer().write(chat_data)
+    return chat_message_serializer(chat_data)
 
-async def get_chat_history(user1: str, user2: str) -> list:
+# Legacy clients get the history as one frame per message, so it stays capped.
+LEGACY_HISTORY_LIMIT = 1000
+
+async def get_chat_history(user1: str, user2: str, limit: int = LEGACY_HISTORY_LIMIT) -> list:
+    # The latest `limit` messages, oldest first.
+    query = {"conversation_key": conversation_key(user1, user2)}
+    cursor = chat_collection.find(query, CHAT_MESSAGE_PROJECTION).sort([("timestamp", -1), ("_id", -1)])
+    messages = await cursor.to_list(length=limit)
+    messages.reverse()
+    return messages
+
+async def _message_position(key: str, message_id: str):
+    # (timestamp, _id) of a message in the conversation, or None if unknown.
+    if not message_id or not ObjectId.is_valid(message_id):
+        return None
+    message = await chat_collection.find_one({"_id": ObjectId(message_id), "conversation_key": key}, {"timestamp": 1})
+    return (message["timestamp"], message["_id"]) if message else None
+
+async def get_chat_messages_after(user1: str, user2: str, last_seen_id: str, batch_size: int):
+    """
+    Yield every message newer than `last_seen_id` in batches, oldest first.
+    Yields nothing if the id is not in the conversation.
+    """
+    key = conversation_key(user1, user2)
+    position = await _message_position(key, last_seen_id)
+    if position is None:
+        return
+    timestamp, _id = position
     query = {
-        "$or": [
-            {"sender": user1, "receiver": user2},
-            {"sender": user2, "receiver": user1}
-        ]
+        "conversation_key": key,
+        "$or": [{"timestamp": {"$gt": timestamp}}, {"timestamp": timestamp, "_id": {"$gt": _id}}],
     }
-    messages = await chat_collection.find(query).sort("timestamp", 1).to_list(length=1000)
-    return [chat_message_serializer(msg) for msg in messages]
\ No newline at end of file
+    cursor = chat_collection.find(query, CHAT_MESSAGE_PROJECTION).sort([("timestamp", 1), ("_id", 1)])
+    batch = []
+    async for message in cursor.batch_size(batch_size):
+        batch.append(message)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+async def has_chat_message(user1: str, user2: str, message_id: str) -> bool:
+    return await _message_position(conversation_key(user1, user2), message_id) is not None
+
+async def get_chat_messages_before(user1: str, user2: str, before_id: str, limit: int) -> tuple:
+    """
+    Up to `limit` messages older than `before_id` (the latest ones when it
+    is None), oldest first, and whether there are more before them.
+    """
+    key = conversation_key(user1, user2)
+    query = {"conversation_key": key}
+    if before_id is not None:
+        position = await _message_position(key, before_id)
+        if position is None:
+            return [], False
+        timestamp, _id = position
+        query["$or"] = [{"timestamp": {"$lt": timestamp}}, {"timestamp": timestamp, "_id": {"$lt": _id}}]
+    cursor = chat_collection.find(query, CHAT_MESSAGE_PROJECTION).sort([("timestamp", -1), ("_id", -1)]).limit(limit + 1)
+    messages = await cursor.to_list(length=limit + 1)
+    has_older = len(messages) > limit
+    del messages[limit:]
+    messages.reverse()
+    return messages, has_older
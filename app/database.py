@@ -12,4 +12,15 @@ todo_collection = database["todos"]
 user_collection = database["users"]
 ai_collection = database["ai"]
 conversation_collection = database["conversations"]
-doc_conversation_collection = database["doc_conversations"]
\ No newline at end of file
+doc_conversation_collection = database["doc_conversations"]
+chat_collection = database["chat_messages"]
+conversation_message_collection = database["conversation_messages"]
+doc_conversation_message_collection = database["doc_conversation_messages"]
+llm_cache_collection = database["llm_cache"]
+task_digest_collection = database["task_digests"]
+document_collection = database["documents"]
+ingestion_job_collection = database["ingestion_jobs"]
+attachment_collection = database["attachments"]
+upload_session_collection = database["upload_sessions"]
+chat_event_collection = database["chat_events"]
+migration_collection = database["migrations"]
@@ -0,0 +1,148 @@
+"""
+Chunked ingestion and retrieval for document chat.
+
+A document is split into overlapping chunks of about DOC_CHUNK_TOKENS
+tokens, each embedded and stored in the vector index as its own row
+(`<doc_id>#<n>`) with its character offsets. The `documents` collection
+keeps one registry entry per document (title, length, chunk count).
+A chat turn retrieves the chunks closest to the question and packs the
+best ones into a DOC_CONTEXT_TOKENS budget.
+"""
+import os
+import re
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+from app.database import document_collection
+from app.context_window import count_tokens
+from app.vector_db import VectorDB, embed_texts
+
+DOC_CHUNK_TOKENS = int(os.getenv("DOC_CHUNK_TOKENS", "200"))
+DOC_CHUNK_OVERLAP = int(os.getenv("DOC_CHUNK_OVERLAP", "40"))
+DOC_EMBED_BATCH = int(os.getenv("DOC_EMBED_BATCH", "64"))
+DOC_TOP_K = int(os.getenv("DOC_TOP_K", "8"))
+DOC_CONTEXT_TOKENS = int(os.getenv("DOC_CONTEXT_TOKENS", "1200"))
+
+_WORD_RE = re.compile(r"\S+")
+
+
+def chunk_id(doc_id: str, index: int) -> str:
+    return f"{doc_id}#{index}"
+
+
+def chunk_spans(text: str, chunk_tokens: int = DOC_CHUNK_TOKENS,
+                overlap_tokens: int = DOC_CHUNK_OVERLAP) -> List[Tuple[int, int]]:
+    """
+    (start, end) character offsets of chunks covering `text`. Chunks end
+    on word boundaries and each one repeats about `overlap_tokens` tokens
+    from the end of the previous one.
+    """
+    words = [(m.start(), m.end(), count_tokens(m.group())) for m in _WORD_RE.finditer(text or "")]
+    spans = []
+    i = 0
+    while i < len(words):
+        j, tokens = i, 0
+        while j < len(words) and (j == i or tokens + words[j][2] <= chunk_tokens):
+            tokens += words[j][2]
+            j += 1
+        spans.append((words[i][0], words[j - 1][1]))
+        if j == len(words):
+            break
+        # Step back over the overlap, always moving forward by at least one word.
+        k, overlap = j, 0
+        while k - 1 > i and overlap + words[k - 1][2] <= overlap_tokens:
+            k -= 1
+            overlap += words[k][2]
+        i = k
+    return spans
+
+
+def embed_chunks(texts: List[str], batch_size: int = DOC_EMBED_BATCH) -> np.ndarray:
+    batches = [embed_texts(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)]
+    return np.concatenate(batches) if batches else embed_texts([])
+
+
+def prepare_chunks(content: str) -> Tuple[List[Tuple[int, int]], List[str], np.ndarray]:
+    """Chunk offsets, chunk texts and their embeddings. CPU-bound."""
+    spans = chunk_spans(content)
+    texts = [content[start:end] for start, end in spans]
+    return spans, texts, embed_chunks(texts)
+
+
+def store_chunks(vector_db: VectorDB, doc_id: str, spans: List[Tuple[int, int]], texts: List[str],
+                 embeddings: np.ndarray, previous_chunks: int = 0):
+    if spans:
+        vector_db.add_batch(
+            [chunk_id(doc_id, i) for i in range(len(spans))],
+            embeddings,
+            [{"doc_id": doc_id, "chunk": i, "start": start, "end": end, "text": text}
+             for i, ((start, end), text) in enumerate(zip(spans, texts))],
+        )
+    # Drop the whole-document row of a pre-chunking upload and the trailing
+    # chunks of a longer previous version.
+    stale = [doc_id] + [chunk_id(doc_id, i) for i in range(len(spans), previous_chunks)]
+    vector_db.remove_batch(stale)
+
+
+async def index_chunks(vector_db: VectorDB, doc_id: str, title: str, length: int,
+                       spans: List[Tuple[int, int]], texts: List[str], embeddings: np.ndarray,
+                       username: Optional[str] = None) -> Dict:
+    previous = await document_collection.find_one({"_id": doc_id}, {"chunks": 1})
+    # The persistent index waits for its file lock and fsyncs; keep that off the event loop.
+    await run_in_threadpool(store_chunks, vector_db, doc_id, spans, texts, embeddings,
+                            (previous or {}).get("chunks", 0))
+
+    record = {
+        "title": title,
+        "length": length,
+        "chunks": len(spans),
+        "username": username,
+        "updated_at": datetime.utcnow(),
+    }
+    await document_collection.update_one({"_id": doc_id}, {"$set": record}, upsert=True)
+    return {"_id": doc_id, **record}
+
+
+async def ingest_document(vector_db: VectorDB, doc_id: str, title: str, content: str,
+                          username: Optional[str] = None) -> Dict:
+    # Chunking and embedding are CPU-bound; keep them off the event loop.
+    spans, texts, embeddings = await run_in_threadpool(prepare_chunks, content)
+    return await index_chunks(vector_db, doc_id, title, len(content), spans, texts, embeddings, username)
+
+
+async def get_document(vector_db: VectorDB, doc_id: str) -> Optional[Dict]:
+    doc = await document_collection.find_one({"_id": doc_id})
+    if doc is not None:
+        return doc
+    # Documents uploaded before chunking are a single row holding the full text.
+    # Reading the persistent index may replay its log or reload it; not on the loop.
+    legacy = await run_in_threadpool(vector_db.get, doc_id)
+    if legacy and "content" in legacy:
+        return await ingest_document(vector_db, doc_id, legacy.get("title", ""), legacy["content"])
+    return None
+
+
+def retrieve_chunks(vector_db: VectorDB, doc: Dict, query: str, top_k: int = DOC_TOP_K,
+                    budget: int = DOC_CONTEXT_TOKENS) -> List[Dict]:
+    """
+    The chunks of `doc` most similar to `query` that fit in `budget`
+    tokens, in document order.
+    """
+    ids = [chunk_id(doc["_id"], i) for i in range(doc.get("chunks", 0))]
+    hits = vector_db.search_items(embed_texts([query])[0], top_k, ids=ids)
+    chosen, used = [], 0
+    for _, chunk in hits:
+        tokens = count_tokens(chunk["text"])
+        if used + tokens > budget:
+            continue
+        chosen.append(chunk)
+        used += tokens
+    return sorted(chosen, key=lambda chunk: chunk["start"])
+
+
+def format_doc_context(doc: Dict, chunks: List[Dict]) -> str:
+    if not chunks:
+        return f"Document Title: {doc['title']}\nNo relevant excerpts were found in the document."
+    excerpts = "\n\n".join(f"[chars {c['start']}-{c['end']}]\n{c['text']}" for c in chunks)
+    return f"Document Title: {doc['title']}\nRelevant excerpts:\n{excerpts}"
@@ -0,0 +1,196 @@
+"""
+Text embedding backends.
+
+The default `HashingEmbedder` runs offline on CPU: each text becomes a
+sparse bag of hashed features (words, word bigrams and character n-grams
+of each word, minus stop words), optionally IDF-weighted, which is projected to a dense
+vector by signed feature hashing in one `np.bincount` per batch. Output
+rows are L2-normalized float32.
+
+    python -m app.embeddings fit-idf <out.npy> <text file> ...
+"""
+import os
+import re
+import sys
+import zlib
+import hashlib
+import threading
+from functools import lru_cache
+from typing import Dict, Optional, Sequence, Tuple
+import numpy as np
+from app.cache import TTLCache
+
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "hashing")
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "256"))
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+# Optional .npy of per-bucket IDF weights, see `fit_idf`.
+EMBEDDING_IDF_PATH = os.getenv("EMBEDDING_IDF_PATH", "")
+
+# Size of the hashed feature space the IDF table is indexed by.
+IDF_BUCKETS = 1 << 18
+CHAR_NGRAMS = (3, 4, 5)
+BIGRAM_WEIGHT = 0.5
+
+# Dropped before hashing; without an IDF table they would dominate every vector.
+STOP_WORDS = frozenset("""
+a an and are as at be but by did do does for from had has have how i in is it its
+me my of on or our so that the their them there these they this to was we were
+what when where which who why will with you your
+""".split())
+
+_SIGN_BIT = np.uint32(1 << 31)
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _tokens(text: str):
+    return [token for token in _WORD_RE.findall((text or "").lower()) if token not in STOP_WORDS]
+
+
+def _hash(feature: str) -> int:
+    # crc32 is stable across processes, unlike the salted built-in hash().
+    return zlib.crc32(feature.encode())
+
+
+@lru_cache(maxsize=100_000)
+def _token_features(token: str) -> Tuple[np.ndarray, np.ndarray]:
+    # The word itself (weight 1) plus its character n-grams (weight 1 in total).
+    padded = f"<{token}>"
+    grams = [padded[i:i + n] for n in CHAR_NGRAMS for i in range(len(padded) - n + 1)]
+    hashes = np.array([_hash("w:" + token)] + [_hash("c:" + g) for g in grams], dtype=np.uint32)
+    weights = np.full(len(hashes), 1.0 / max(1, len(grams)), dtype=np.float32)
+    weights[0] = 1.0
+    return hashes, weights
+
+
+def text_features(text: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Hashed features of `text` and their term weights."""
+    tokens = _tokens(text)
+    if not tokens:
+        return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.float32)
+    parts = [_token_features(token) for token in tokens]
+    bigrams = np.array([_hash(f"b:{a} {b}") for a, b in zip(tokens, tokens[1:])], dtype=np.uint32)
+    hashes = np.concatenate([h for h, _ in parts] + [bigrams])
+    weights = np.concatenate([w for _, w in parts] + [np.full(len(bigrams), BIGRAM_WEIGHT, dtype=np.float32)])
+    return hashes, weights
+
+
+def fit_idf(texts: Sequence[str], buckets: int = IDF_BUCKETS) -> np.ndarray:
+    """Smoothed IDF per hashed feature bucket over a reference corpus."""
+    df = np.zeros(buckets, dtype=np.float64)
+    for text in texts:
+        hashes, _ = text_features(text)
+        df[np.unique(hashes % buckets)] += 1
+    return (np.log((1 + len(texts)) / (1 + df)) + 1).astype(np.float32)
+
+
+class EmbeddingBackend:
+    """Turns batches of texts into (len(texts), dim) float32 arrays."""
+
+    name = "base"
+
+    def __init__(self, dim: int):
+        self.dim = dim
+
+    @property
+    def model(self) -> str:
+        # Identifies the vector space; stored indexes are rebuilt when it changes.
+        return f"{self.name}-{self.dim}"
+
+    def embed_batch(self, texts: Sequence[str]) -> np.ndarray:
+        raise NotImplementedError
+
+    def embed(self, text: str) -> np.ndarray:
+        return self.embed_batch([text])[0]
+
+
+class HashingEmbedder(EmbeddingBackend):
+    name = "hashing"
+
+    def __init__(self, dim: int = EMBEDDING_DIM, idf: Optional[np.ndarray] = None,
+                 cache_size: int = EMBEDDING_CACHE_SIZE):
+        super().__init__(dim)
+        self.idf = idf
+        self.cache = TTLCache(maxsize=cache_size) if cache_size else None
+        # Ingestion embeds on worker threads, queries on the event loop.
+        self._cache_lock = threading.Lock()
+
+    @property
+    def model(self) -> str:
+        if self.idf is None:
+            return super().model
+        return f"{super().model}-idf{hashlib.sha256(self.idf.tobytes()).hexdigest()[:12]}"
+
+    def _project(self, texts: Sequence[str]) -> np.ndarray:
+        features = [text_features(text) for text in texts]
+        hashes = np.concatenate([h for h, _ in features] + [np.zeros(0, dtype=np.uint32)])
+        weights = np.concatenate([w for _, w in features] + [np.zeros(0, dtype=np.float32)])
+        rows = np.repeat(np.arange(len(texts)), [len(h) for h, _ in features])
+        if self.idf is not None:
+            weights = weights * self.idf[hashes % len(self.idf)]
+        signs = np.where(hashes & _SIGN_BIT, -1.0, 1.0)
+        buckets = rows * self.dim + (hashes % self.dim).astype(np.int64)
+        vectors = np.bincount(buckets, weights=weights * signs, minlength=len(texts) * self.dim)
+        vectors = vectors.reshape(len(texts), self.dim).astype(np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def embed_batch(self, texts: Sequence[str]) -> np.ndarray:
+        if self.cache is None:
+            return self._project(texts)
+        keys = [hashlib.blake2b((text or "").encode(), digest_size=16).digest() for text in texts]
+        out = np.empty((len(texts), self.dim), dtype=np.float32)
+        missing: Dict[bytes, list] = {}
+        with self._cache_lock:
+            for i, key in enumerate(keys):
+                vector = self.cache.get(key)
+                if vector is None:
+                    missing.setdefault(key, []).append(i)
+                else:
+                    out[i] = vector
+        if missing:
+            computed = self._project([texts[rows[0]] for rows in missing.values()])
+            with self._cache_lock:
+                for (key, rows), vector in zip(missing.items(), computed):
+                    out[rows] = vector
+                    self.cache.set(key, vector)
+        return out
+
+
+EMBEDDING_BACKENDS = {
+    "hashing": HashingEmbedder,
+}
+
+_embedder: Optional[EmbeddingBackend] = None
+
+
+def get_embedder() -> EmbeddingBackend:
+    global _embedder
+    if _embedder is None:
+        idf = np.load(EMBEDDING_IDF_PATH) if EMBEDDING_IDF_PATH else None
+        kwargs = {"idf": idf} if idf is not None else {}
+        _embedder = EMBEDDING_BACKENDS[EMBEDDING_BACKEND](dim=EMBEDDING_DIM, **kwargs)
+    return _embedder
+
+
+def set_embedder(embedder: EmbeddingBackend) -> EmbeddingBackend:
+    # Swap the backend, e.g. in benchmarks. Build vector indexes after this.
+    global _embedder
+    _embedder = embedder
+    return _embedder
+
+
+def _main(argv):
+    if len(argv) < 3 or argv[0] != "fit-idf":
+        print("usage: python -m app.embeddings fit-idf <out.npy> <text file> ...")
+        return 2
+    texts = []
+    for path in argv[2:]:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            texts.extend(paragraph for paragraph in f.read().split("\n\n") if paragraph.strip())
+    np.save(argv[1], fit_idf(texts))
+    print(f"IDF over {len(texts)} paragraphs written to {argv[1]}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
@@ -0,0 +1,151 @@
+"""
+Index declarations and startup migrations.
+
+`ensure_indexes()` runs on application startup and is idempotent:
+create_indexes is a no-op for indexes that already exist with the same
+spec, and each data migration runs once (recorded in `migrations`). Run
+`python -m app.indexes report` to list declared indexes that are missing
+and existing indexes that are undeclared or have never been used, or
+`python -m app.indexes migrate` to apply pending migrations by hand.
+"""
+import asyncio
+import sys
+from datetime import datetime
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+from app.database import database, todo_collection, chat_collection, migration_collection
+
+# Collection name -> indexes the application relies on.
+INDEXES = {
+    "users": [
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+    ],
+    "todos": [
+        # Matches the task listing order: pinned first, then by due date.
+        IndexModel(
+            [("username", ASCENDING), ("pinned", DESCENDING), ("dueDate", ASCENDING), ("_id", ASCENDING)],
+            name="username_pinned_dueDate",
+        ),
+    ],
+    "chat_messages": [
+        IndexModel(
+            [("conversation_key", ASCENDING), ("timestamp", ASCENDING), ("_id", ASCENDING)],
+            name="conversation_key_timestamp",
+        ),
+    ],
+    "conversation_messages": [
+        IndexModel([("conversation_id", ASCENDING), ("seq", ASCENDING)], name="conversation_seq", unique=True),
+    ],
+    "doc_conversation_messages": [
+        IndexModel([("conversation_id", ASCENDING), ("seq", ASCENDING)], name="conversation_seq", unique=True),
+    ],
+    "llm_cache": [
+        # TTL index: MongoDB removes entries once expires_at has passed.
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "attachments": [
+        # Releasing an owner's references and finding unreferenced attachments.
+        IndexModel([("refs", ASCENDING)], name="refs"),
+    ],
+    "upload_sessions": [
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "chat_events": [
+        # Backplane events only matter while workers tail the change stream.
+        IndexModel([("created_at", ASCENDING)], name="created_at_ttl", expireAfterSeconds=3600),
+    ],
+}
+
+
+async def backfill_conversation_key():
+    # Chat messages written before conversation_key existed.
+    result = await chat_collection.update_many(
+        {"conversation_key": {"$exists": False}},
+        [{"$set": {"conversation_key": {"$cond": [
+            {"$lte": ["$sender", "$receiver"]},
+            {"$concat": ["$sender", "|", "$receiver"]},
+            {"$concat": ["$receiver", "|", "$sender"]},
+        ]}}}],
+    )
+    if result.modified_count:
+        print(f"Backfilled conversation_key on {result.modified_count} chat messages")
+
+
+async def backfill_pinned():
+    # Tasks created before `pinned` existed sort inconsistently against the index.
+    result = await todo_collection.update_many({"pinned": {"$exists": False}}, {"$set": {"pinned": False}})
+    if result.modified_count:
+        print(f"Backfilled pinned=False on {result.modified_count} tasks")
+
+
+# Applied once each, in order, and recorded in `migrations`. They are
+# idempotent, so two workers racing on the first start is harmless.
+MIGRATIONS = [
+    ("backfill_conversation_key", backfill_conversation_key),
+    ("backfill_pinned", backfill_pinned),
+]
+
+
+async def migrate():
+    applied = {doc["_id"] async for doc in migration_collection.find({}, {"_id": 1})}
+    for name, migration in MIGRATIONS:
+        if name in applied:
+            continue
+        await migration()
+        await migration_collection.update_one(
+            {"_id": name}, {"$set": {"applied_at": datetime.utcnow()}}, upsert=True
+        )
+        print(f"Applied migration {name}")
+
+
+async def ensure_indexes():
+    await migrate()
+    for collection_name, indexes in INDEXES.items():
+        try:
+            await database[collection_name].create_indexes(indexes)
+        except OperationFailure as e:
+            # e.g. duplicate usernames prevent the unique index; don't block startup.
+            print(f"Could not create indexes on {collection_name}: {str(e)}")
+
+
+async def index_report() -> dict:
+    report = {}
+    for collection_name, indexes in INDEXES.items():
+        collection = database[collection_name]
+        declared = {index.document["name"] for index in indexes}
+        existing = await collection.index_information()
+        usage = {}
+        try:
+            async for stats in collection.aggregate([{"$indexStats": {}}]):
+                usage[stats["name"]] = stats["accesses"]["ops"]
+        except OperationFailure:
+            pass
+        report[collection_name] = {
+            "missing": sorted(declared - set(existing)),
+            "undeclared": sorted(name for name in existing if name != "_id_" and name not in declared),
+            "unused": sorted(name for name, ops in usage.items() if ops == 0 and name != "_id_"),
+        }
+    return report
+
+
+async def _main(argv):
+    command = argv[0] if argv else "report"
+    if command == "ensure":
+        await ensure_indexes()
+        print("Indexes ensured.")
+    elif command == "migrate":
+        await migrate()
+        print("Migrations applied.")
+    elif command == "report":
+        for collection_name, info in (await index_report()).items():
+            print(f"{collection_name}:")
+            for key in ("missing", "undeclared", "unused"):
+                print(f"  {key}: {', '.join(info[key]) or '-'}")
+    else:
+        print("usage: python -m app.indexes [report|ensure|migrate]")
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
@@ -0,0 +1,163 @@
+"""
+Background ingestion of uploaded files into the document-chat index.
+
+A job extracts the text of a PDF, DOCX or plain-text file and chunks and
+embeds it on a process pool, so parsing runs on every core and never on
+the event loop. The chunks are then indexed from the event loop. Jobs are
+tracked in `ingestion_jobs` (queued -> processing -> done | failed).
+"""
+import os
+import uuid
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from fastapi import HTTPException
+from app.database import ingestion_job_collection
+from app.doc_ingest import prepare_chunks, index_chunks
+from app.vector_db import VectorDB
+from app.attachments import attachment_ids, get_attachment, object_path
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # pragma: no cover - optional dependency
+    PdfReader = None
+
+try:
+    import docx
+except ImportError:  # pragma: no cover - optional dependency
+    docx = None
+
+UPLOAD_DIR = "uploads"
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "0")) or os.cpu_count() or 1
+# Jobs queued or running in this process before new ones are refused.
+INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "100"))
+
+TEXT_EXTENSIONS = (".txt", ".md")
+SUPPORTED_EXTENSIONS = (".pdf", ".docx") + TEXT_EXTENSIONS
+
+_executor: Optional[ProcessPoolExecutor] = None
+_jobs: Dict[asyncio.Task, str] = {}  # running job task -> job id
+
+
+# --- Worker-process side ---
+def extract_text(path: str, extension: str) -> str:
+    if extension == ".pdf":
+        if PdfReader is None:
+            raise RuntimeError("PDF support requires the pypdf package")
+        return "\n\n".join(page.extract_text() or "" for page in PdfReader(path).pages)
+    if extension == ".docx":
+        if docx is None:
+            raise RuntimeError("DOCX support requires the python-docx package")
+        return "\n\n".join(paragraph.text for paragraph in docx.Document(path).paragraphs)
+    if extension in TEXT_EXTENSIONS:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            return f.read()
+    raise ValueError(f"Unsupported file type: {extension or 'none'}")
+
+
+def extract_and_prepare(path: str, extension: str) -> Tuple[int, List[Tuple[int, int]], List[str], np.ndarray]:
+    text = extract_text(path, extension)
+    return (len(text),) + prepare_chunks(text)
+
+
+# --- Event-loop side ---
+def get_executor() -> ProcessPoolExecutor:
+    # "spawn" so workers do not inherit the server's threads and sockets.
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=INGEST_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+async def resolve_upload(reference: str) -> Tuple[str, str]:
+    """
+    (path, original filename) of an uploaded file, given its attachment id
+    or URL, or the name of a file in the legacy upload directory.
+    """
+    digests = attachment_ids([reference])
+    if digests:
+        digest = digests.pop()
+        meta = await get_attachment(digest)
+        path, filename = object_path(digest), (meta or {}).get("filename", "")
+    else:
+        # Only files directly inside the upload directory can be ingested.
+        filename = os.path.basename(reference or "")
+        path = os.path.join(UPLOAD_DIR, filename)
+    if not filename or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail=f"Uploaded file {reference} not found")
+    if os.path.splitext(filename)[1].lower() not in SUPPORTED_EXTENSIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported file type; expected one of {', '.join(SUPPORTED_EXTENSIONS)}",
+        )
+    return path, filename
+
+
+async def _set_status(job_id: str, status: str, **fields):
+    await ingestion_job_collection.update_one(
+        {"_id": job_id}, {"$set": {"status": status, "updated_at": datetime.utcnow(), **fields}}
+    )
+
+
+async def _run_job(vector_db: VectorDB, job: Dict, path: str):
+    try:
+        await _set_status(job["_id"], "processing")
+        loop = asyncio.get_running_loop()
+        extension = os.path.splitext(job["filename"])[1].lower()
+        length, spans, texts, embeddings = await loop.run_in_executor(
+            get_executor(), extract_and_prepare, path, extension
+        )
+        record = await index_chunks(vector_db, job["doc_id"], job["title"], length, spans, texts, embeddings,
+                                    job["username"])
+        await _set_status(job["_id"], "done", chunks=record["chunks"], length=length)
+    except Exception as exc:
+        await _set_status(job["_id"], "failed", error=str(exc) or type(exc).__name__)
+
+
+async def submit_ingestion(vector_db: VectorDB, path: str, filename: str, doc_id: str, title: str,
+                           username: str) -> Dict:
+    if len(_jobs) >= INGEST_MAX_PENDING:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many documents are being ingested, please try again shortly",
+            headers={"Retry-After": "5"},
+        )
+    now = datetime.utcnow()
+    job = {
+        "_id": uuid.uuid4().hex,
+        "username": username,
+        "filename": filename,
+        "doc_id": doc_id,
+        "title": title,
+        "status": "queued",
+        "created_at": now,
+        "updated_at": now,
+    }
+    await ingestion_job_collection.insert_one(job)
+    task = asyncio.create_task(_run_job(vector_db, job, path))
+    _jobs[task] = job["_id"]
+    task.add_done_callback(lambda done: _jobs.pop(done, None))
+    return job
+
+
+async def get_job(job_id: str, username: str) -> Optional[Dict]:
+    return await ingestion_job_collection.find_one({"_id": job_id, "username": username})
+
+
+async def close_ingestion():
+    global _executor
+    interrupted = list(_jobs.values())
+    for task in list(_jobs):
+        task.cancel()
+    if interrupted:
+        await ingestion_job_collection.update_many(
+            {"_id": {"$in": interrupted}, "status": {"$in": ["queued", "processing"]}},
+            {"$set": {"status": "failed", "error": "Server shut down before the job finished",
+                      "updated_at": datetime.utcnow()}},
+        )
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
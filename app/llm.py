@@ -0,0 +1,259 @@
+import os
+import asyncio
+import random
+from typing import List, Dict, AsyncIterator, Optional
+from fastapi import HTTPException
+from dotenv import load_dotenv
+from app.llm_cache import CompletionCache, build_completion_cache
+
+load_dotenv("app/.env")
+
+# --- Settings ---
+LLM_BACKEND = os.getenv("LLM_BACKEND", "groq")  # "groq" or "fake"
+LLM_MODEL = os.getenv("LLM_MODEL", "llama-3.1-8b-instant")
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "1"))
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", "1024"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "10"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+
+
+class LLMError(Exception):
+    def __init__(self, message: str, retryable: bool = False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class LLMBusyError(LLMError):
+    pass
+
+
+# --- Backends ---
+class LLMBackend:
+    """A backend turns a list of chat messages into a stream of text deltas."""
+
+    async def stream(self, messages: List[Dict[str, str]], **params) -> AsyncIterator[str]:
+        raise NotImplementedError
+        yield
+
+    async def aclose(self):
+        pass
+
+
+class GroqBackend(LLMBackend):
+    def __init__(self, api_key: Optional[str] = None):
+        api_key = api_key or os.getenv("GROQ_API_KEY")
+        if not api_key:
+            raise ValueError("API key for Groq is missing in the .env file.")
+
+        import httpx
+        from groq import AsyncClient
+        # One keep-alive pool per process, shared by every router.
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE,
+            ),
+            timeout=httpx.Timeout(LLM_REQUEST_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+        )
+        # Retries are handled by the gateway so they can be jittered and counted.
+        self.client = AsyncClient(api_key=api_key, http_client=self.http_client, max_retries=0)
+
+    async def stream(self, messages: List[Dict[str, str]], **params) -> AsyncIterator[str]:
+        import groq
+        try:
+            completion = await self.client.chat.completions.create(
+                messages=messages, stream=True, **params
+            )
+            async for chunk in completion:
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+        except (groq.APIConnectionError, groq.RateLimitError, groq.InternalServerError) as e:
+            # APIConnectionError also covers timeouts.
+            raise LLMError(str(e), retryable=True) from e
+        except groq.APIStatusError as e:
+            raise LLMError(str(e), retryable=e.status_code >= 500) from e
+
+    async def aclose(self):
+        await self.http_client.aclose()
+
+
+class FakeBackend(LLMBackend):
+    """
+    Offline backend for tests and benchmarks. Echoes the last user message
+    word by word, optionally sleeping between deltas to mimic token latency.
+    """
+
+    def __init__(self, delay: float = None, reply: Optional[str] = None):
+        self.delay = float(os.getenv("LLM_FAKE_DELAY", "0")) if delay is None else delay
+        self.reply = reply
+
+    async def stream(self, messages: List[Dict[str, str]], **params) -> AsyncIterator[str]:
+        reply = self.reply
+        if reply is None:
+            last_user = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+            reply = f"You said: {last_user}"
+        for i, word in enumerate(reply.split(" ")):
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            yield word if i == 0 else " " + word
+
+
+BACKENDS = {
+    "groq": GroqBackend,
+    "fake": FakeBackend,
+}
+
+
+# --- Gateway ---
+class LLMGateway:
+    """
+    Shared entry point for all LLM calls: caps concurrent upstream requests
+    per process (extra callers queue on a semaphore) and retries
+    rate-limit / server errors with jittered exponential backoff.
+    Completions are served from / stored in `cache` when one is configured;
+    pass `cache=False` to skip it for a single call.
+    """
+
+    def __init__(self, backend: LLMBackend, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 queue_timeout: float = LLM_QUEUE_TIMEOUT, max_retries: int = LLM_MAX_RETRIES,
+                 cache: Optional[CompletionCache] = None):
+        self.backend = backend
+        self.cache = cache
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self.in_flight = 0
+        self.waiting = 0
+
+    def default_params(self) -> dict:
+        return {
+            "model": LLM_MODEL,
+            "temperature": LLM_TEMPERATURE,
+            "max_tokens": LLM_MAX_TOKENS,
+            "top_p": 1,
+            "stop": None,
+        }
+
+    async def _acquire(self):
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise LLMBusyError("Too many concurrent LLM requests, try again later.")
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+
+    def _release(self):
+        self.in_flight -= 1
+        self.semaphore.release()
+
+    def _backoff(self, attempt: int) -> float:
+        # "Full jitter" backoff.
+        return random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * (2 ** attempt)))
+
+    async def stream(self, messages: List[Dict[str, str]], cache: bool = True, **params) -> AsyncIterator[str]:
+        params = {**self.default_params(), **params}
+        cache_key = None
+        if cache and self.cache is not None and self.cache.cacheable(params):
+            cache_key = self.cache.key(messages, params)
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+
+        response = ""
+        async for delta in self._stream_upstream(messages, params):
+            response += delta
+            yield delta
+        if cache_key is not None and response:
+            await self.cache.set(cache_key, response)
+
+    async def _stream_upstream(self, messages: List[Dict[str, str]], params: dict) -> AsyncIterator[str]:
+        await self._acquire()
+        try:
+            attempt = 0
+            while True:
+                started = False
+                try:
+                    async for delta in self.backend.stream(messages, **params):
+                        started = True
+                        yield delta
+                    return
+                except LLMError as e:
+                    # Once deltas have reached the caller a retry would duplicate output.
+                    if started or not e.retryable or attempt >= self.max_retries:
+                        raise
+                    delay = self._backoff(attempt)
+                    print(f"LLM request failed ({str(e)}), retrying in {delay:.2f}s")
+                    attempt += 1
+                    await asyncio.sleep(delay)
+        finally:
+            self._release()
+
+    async def complete(self, messages: List[Dict[str, str]], cache: bool = True, **params) -> str:
+        response = ""
+        async for delta in self.stream(messages, cache=cache, **params):
+            response += delta
+        return response
+
+    def stats(self) -> dict:
+        stats = {"in_flight": self.in_flight, "waiting": self.waiting}
+        if self.cache is not None:
+            stats["cache"] = self.cache.stats()
+        return stats
+
+    async def aclose(self):
+        await self.backend.aclose()
+
+
+_gateway: Optional[LLMGateway] = None
+
+
+def get_llm() -> LLMGateway:
+    # Built lazily so a missing API key fails the request, not the import.
+    global _gateway
+    if _gateway is None:
+        _gateway = LLMGateway(BACKENDS[LLM_BACKEND](), cache=build_completion_cache())
+    return _gateway
+
+
+def set_llm_backend(backend: LLMBackend) -> LLMGateway:
+    # Swap the backend, e.g. `set_llm_backend(FakeBackend())` in tests/benchmarks.
+    global _gateway
+    _gateway = LLMGateway(backend, cache=build_completion_cache())
+    return _gateway
+
+
+async def stream_llm(messages: List[Dict[str, str]], **params) -> AsyncIterator[str]:
+    print("Streaming messages to LLM:", messages)
+    async for delta in get_llm().stream(messages, **params):
+        yield delta
+
+
+async def query_llm(messages: List[Dict[str, str]], **params) -> str:
+    try:
+        print("Sending messages to LLM:", messages)
+        response = await get_llm().complete(messages, **params)
+        print("Received response from LLM:", response)
+        return response
+    except LLMBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        print(f"Error with Groq API: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error with Groq API: {str(e)}")
+
+
+async def close_llm():
+    global _gateway
+    if _gateway is not None:
+        await _gateway.aclose()
+        _gateway = None
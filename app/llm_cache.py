@@ -0,0 +1,92 @@
+import os
+import re
+import hashlib
+from datetime import datetime, timedelta
+from typing import List, Dict, Optional
+from app.cache import TTLCache
+from app.responses import dumps
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_MONGO = os.getenv("LLM_CACHE_MONGO", "0") == "1"
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "1000"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "3600"))
+# Sampling with temperature > 0 is non-deterministic, so such requests are
+# not cached unless this is set.
+LLM_CACHE_ALLOW_NONZERO_TEMPERATURE = os.getenv("LLM_CACHE_ALLOW_NONZERO_TEMPERATURE", "0") == "1"
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    return _WHITESPACE_RE.sub(" ", text or "").strip().casefold()
+
+
+class CompletionCache:
+    """
+    Two-tier cache of full LLM completions keyed by a hash of the model,
+    sampling parameters and normalized prompt: an in-process LRU in front
+    of an optional MongoDB collection shared by all workers.
+    """
+
+    def __init__(self, memory: TTLCache, collection=None, ttl: float = LLM_CACHE_TTL,
+                 allow_nonzero_temperature: bool = LLM_CACHE_ALLOW_NONZERO_TEMPERATURE):
+        self.memory = memory
+        self.collection = collection
+        self.ttl = ttl
+        self.allow_nonzero_temperature = allow_nonzero_temperature
+        self.mongo_hits = 0
+        self.mongo_misses = 0
+        self.bypassed = 0
+
+    def cacheable(self, params: dict) -> bool:
+        if self.allow_nonzero_temperature or not params.get("temperature"):
+            return True
+        self.bypassed += 1
+        return False
+
+    def key(self, messages: List[Dict[str, str]], params: dict) -> str:
+        payload = {
+            "params": {k: v for k, v in sorted(params.items()) if k != "stream"},
+            "messages": [[m.get("role"), normalize(m.get("content"))] for m in messages],
+        }
+        return hashlib.sha256(dumps(payload)).hexdigest()
+
+    async def get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is not None or self.collection is None:
+            return value
+        # The TTL monitor only runs periodically, so check expiry here too.
+        doc = await self.collection.find_one({"_id": key, "expires_at": {"$gt": datetime.utcnow()}})
+        if doc is None:
+            self.mongo_misses += 1
+            return None
+        self.mongo_hits += 1
+        remaining = (doc["expires_at"] - datetime.utcnow()).total_seconds()
+        self.memory.set(key, doc["response"], ttl=remaining)
+        return doc["response"]
+
+    async def set(self, key: str, response: str):
+        self.memory.set(key, response, ttl=self.ttl)
+        if self.collection is not None:
+            await self.collection.update_one(
+                {"_id": key},
+                {"$set": {"response": response, "expires_at": datetime.utcnow() + timedelta(seconds=self.ttl)}},
+                upsert=True,
+            )
+
+    def stats(self) -> dict:
+        return {
+            "memory": self.memory.stats(),
+            "mongo": {"enabled": self.collection is not None, "hits": self.mongo_hits, "misses": self.mongo_misses},
+            "bypassed": self.bypassed,
+        }
+
+
+def build_completion_cache() -> Optional[CompletionCache]:
+    if not LLM_CACHE_ENABLED:
+        return None
+    collection = None
+    if LLM_CACHE_MONGO:
+        from app.database import llm_cache_collection
+        collection = llm_cache_collection
+    return CompletionCache(TTLCache(maxsize=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL), collection)
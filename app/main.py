@@ -1,13 +1,36 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from pymongo.errors import PyMongoError
 from fastapi.middleware.cors import CORSMiddleware
 from app.routes.tasks import router as task_router
 from app.routes.auth_routes import router as auth_router
 from app.routes.conversations import router as conversation_router  
 from app.routes.ai import router as ai_router
 from app.routes import ai, chat_with_doc
+from app.routes.attachments import router as attachment_router
 from fastapi.staticfiles import StaticFiles
+from app.llm import close_llm
+from app.ingestion import close_ingestion
+from app.backplane import get_backplane, close_backplane
+from app.chat_writer import close_chat_writer
+from app.indexes import ensure_indexes
+from app.responses import FastJSONResponse
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        await ensure_indexes()
+    except PyMongoError as e:
+        # Serve anyway; `python -m app.indexes ensure` can be run once MongoDB is back.
+        print(f"Could not ensure indexes and migrations: {str(e)}")
+    await get_backplane().start()
+    yield
+    await close_llm()
+    await close_ingestion()
+    await close_chat_writer()
+    await close_backplane()
+
+app = FastAPI(default_response_class=FastJSONResponse, lifespan=lifespan)
 
 @app.get('/')
 async def home():
@@ -26,6 +49,7 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Files uploaded before the attachment store; new uploads are served from /attachments.
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 
 # Include routers with the proper prefixes.
@@ -34,3 +58,4 @@ app.include_router(auth_router, prefix="/auth", tags=["Auth"])
 app.include_router(conversation_router, prefix="/ws", tags=["Conversations"]) 
 app.include_router(ai_router, prefix="/api/todo-ai", tags=["ToDo-AI"])
 app.include_router(chat_with_doc.router, prefix="/docchat", tags=["Chat-With-Doc"])
+app.include_router(attachment_router, prefix="/attachments", tags=["Attachments"])
@@ -19,3 +19,8 @@ def chat_message_serializer(chat_message) -> dict:
         "message": chat_message.get("message"),
         "timestamp": chat_message.get("timestamp"),
     }
+
+# Find projection producing chat_message_serializer's shape in MongoDB, so
+# listed messages can be encoded as they come back (ObjectId ids are
+# rendered as strings by app.responses.dumps). Needs MongoDB 4.4+.
+CHAT_MESSAGE_PROJECTION = {"_id": 0, "id": "$_id", "sender": 1, "receiver": 1, "message": 1, "timestamp": 1}
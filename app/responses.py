@@ -0,0 +1,41 @@
+import json
+from datetime import datetime, date
+from typing import Any
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+
+# orjson is optional: without it responses fall back to the stdlib encoder.
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def _default(obj: Any):
+    # Types orjson / json don't know about. orjson handles datetimes natively.
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response rendered with orjson when available. ObjectId and
+    datetime values are encoded directly, so handlers can return BSON
+    documents without a jsonable_encoder pass. Returning an instance
+    from a handler (instead of a dict) skips FastAPI's jsonable_encoder
+    entirely.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
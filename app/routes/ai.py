@@ -1,21 +1,14 @@
-import os
-from typing import List, Dict
-from fastapi import APIRouter, HTTPException, Query, Depends, Request
+from typing import List, Dict, Optional, Tuple
+from fastapi import APIRouter, Query, Depends
 from pydantic import BaseModel
-from datetime import datetime
-from dotenv import load_dotenv
-from app.database import conversation_collection, todo_collection
-from app.auth.auth_bearer import JWTBearer
-from app.auth.auth_handler import decode_access_token
-
-load_dotenv("app/.env")
-
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-if not GROQ_API_KEY:
-    raise ValueError("API key for Groq is missing in the .env file.")
-
-from groq import Client
-client = Client(api_key=GROQ_API_KEY)
+from app.database import conversation_collection, conversation_message_collection
+from app.task_digest import get_task_digest, format_tasks
+from app.conversation_store import ConversationStore
+from app.context_window import CHAT_HISTORY_FETCH, build_context, schedule_summary
+from app.auth.auth_bearer import Principal, get_principal
+from app.sse import stream_reply
+from app.llm import query_llm, stream_llm
+from app.responses import FastJSONResponse
 
 router = APIRouter()
 
@@ -24,104 +17,79 @@ class UserInput(BaseModel):
     role: str = "user"
     conversation_id: str
 
-async def get_or_create_conversation(conversation_id: str) -> List[Dict[str, str]]:
-    conversation_doc = await conversation_collection.find_one({"_id": conversation_id})
-    if conversation_doc:
-        return conversation_doc.get("messages", [])
-    else:
-        new_conversation = [{"role": "system", "content": "Welcome to new chat. How may I help you?"}]
-        await conversation_collection.insert_one({
-            "_id": conversation_id,
-            "messages": new_conversation,
-            "updated_at": datetime.utcnow()
-        })
-        return new_conversation
-
-async def update_conversation_in_db(conversation_id: str, messages: List[Dict[str, str]]):
-    await conversation_collection.update_one(
-        {"_id": conversation_id},
-        {"$set": {
-            "messages": messages,
-            "updated_at": datetime.utcnow()
-        }},
-        upsert=True
-    )
+conversation_store = ConversationStore(
+    conversation_collection,
+    conversation_message_collection,
+    greeting="Welcome to new chat. How may I help you?",
+)
 
-def query_groq_api(messages: List[Dict[str, str]]) -> str:
-    try:
-        print("Sending messages to Groq API:", messages)
-        completion = client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=messages,
-            temperature=1,
-            max_tokens=1024,
-            top_p=1,
-            stream=True,
-            stop=None,
-        )
-        response = ""
-        for chunk in completion:
-            response += chunk.choices[0].delta.content or ""
-        print("Received response from Groq API:", response)
-        return response
-    except Exception as e:
-        print(f"Error with Groq API: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error with Groq API: {str(e)}")
+@router.get("/chats", dependencies=[Depends(get_principal)])
+async def get_chat_history(
+    conversation_id: str = Query(..., description="The ID of the conversation"),
+    limit: int = Query(50, ge=1, le=500),
+    before: Optional[int] = Query(None, description="next_before from the previous page"),
+):
+    messages, next_before = await conversation_store.history_page(conversation_id, limit, before)
+    return FastJSONResponse({"conversation_id": conversation_id, "messages": messages, "next_before": next_before})
 
-def format_tasks(tasks: List[Dict]) -> str:
-    if not tasks:
-        return "You have no tasks at the moment."
-    task_lines = []
-    for task in tasks:
-        title = task.get("title", "Untitled Task")
-        due_date = task.get("dueDate")
-        priority = task.get("priority", "N/A")
-        if due_date:
-            task_lines.append(f"- {title} (Due: {due_date}, Priority: {priority})")
-        else:
-            task_lines.append(f"- {title} (Priority: {priority})")
-    return "Here are your current tasks:\n" + "\n".join(task_lines)
-
-@router.get("/chats", dependencies=[Depends(JWTBearer())])
-async def get_chat_history(conversation_id: str = Query(..., description="The ID of the conversation")):
-    messages = await get_or_create_conversation(conversation_id)
-    return {"conversation_id": conversation_id, "messages": messages}
-
-@router.post("/", dependencies=[Depends(JWTBearer())])
-async def chat(input: UserInput, token: str = Depends(JWTBearer())):
-    # Decode the JWT token to get the username.
-    user_data = decode_access_token(token)
-    username = user_data.get("sub")
-    
-    # Retrieve the conversation history.
-    messages = await get_or_create_conversation(input.conversation_id)
-    
-    # Append the user's new message.
-    messages.append({"role": input.role, "content": input.message})
+async def prepare_chat_messages(input: UserInput, username: str) -> Tuple[List[Dict[str, str]], List[Dict]]:
+    # Retrieve the recent conversation history and its running summary.
+    history, meta = await conversation_store.get_context(input.conversation_id, limit=CHAT_HISTORY_FETCH)
+    # Messages added this turn; only these are written back.
+    new_messages = [{"role": input.role, "content": input.message}]
     
     
     if any(keyword in input.message.lower() for keyword in ["task", "tasks", "todo", "todos", "work", "assignment", "job", "duty", 
                                                             "project", "responsibility", "deliverable"]):
-        query = {"username": username}
+        priority = None
         lower_message = input.message.lower()
         if "low priority" in lower_message:
-            query["priority"] = "low"
+            priority = "low"
         elif "high priority" in lower_message:
-            query["priority"] = "high"
+            priority = "high"
         elif "medium priority" in lower_message:
-            query["priority"] = "medium"
+            priority = "medium"
         
-        tasks_cursor = todo_collection.find(query)
-        tasks = await tasks_cursor.to_list(length=None)
-        tasks_info = format_tasks(tasks)
+        # One lookup of the user's incrementally maintained task digest.
+        digest = await get_task_digest(username)
+        tasks_info = format_tasks(digest, priority)
         # Append a system message with the tasks information.
-        messages.append({"role": "system", "content": tasks_info})
+        new_messages.append({"role": "system", "content": tasks_info, "kind": "task_snapshot"})
+
+    # Fit the prompt into the token budget; older turns go into the summary.
+    messages, overflow = build_context(history, new_messages, meta.get("summary"), meta.get("summary_upto", 0))
+    schedule_summary(conversation_store, input.conversation_id, meta.get("summary"), overflow)
+    return messages, new_messages
+
+@router.post("/")
+async def chat(input: UserInput, principal: Principal = Depends(get_principal)):
+    username = principal.username
     
-    # Query the Groq API with the updated conversation context.
-    response = query_groq_api(messages)
+    messages, new_messages = await prepare_chat_messages(input, username)
+    
+    # Query the LLM with the updated conversation context.
+    response = await query_llm(messages)
     
     # Append the assistant's response to the conversation.
-    messages.append({"role": "assistant", "content": response})
-    await update_conversation_in_db(input.conversation_id, messages)
+    new_messages.append({"role": "assistant", "content": response})
+    await conversation_store.append(input.conversation_id, new_messages)
     
     return {"response": response, "conversation_id": input.conversation_id}
+
+@router.post("/stream")
+async def chat_stream(input: UserInput, principal: Principal = Depends(get_principal)):
+    """
+    Same as `chat`, but the reply is streamed back as Server-Sent Events
+    (`delta` events while generating, then a final `done` event).
+    The assistant message is persisted once the stream has finished.
+    """
+    username = principal.username
+
+    messages, new_messages = await prepare_chat_messages(input, username)
+
+    async def persist(response: str) -> dict:
+        new_messages.append({"role": "assistant", "content": response})
+        await conversation_store.append(input.conversation_id, new_messages)
+        return {"response": response, "conversation_id": input.conversation_id}
+
+    return stream_reply(stream_llm(messages), persist)
@@ -0,0 +1,190 @@
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from fastapi import APIRouter, HTTPException, Depends, Request, Response, Query, Path
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
+from pydantic import BaseModel, Field
+from app.auth.auth_bearer import Principal, get_principal
+from app.database import upload_session_collection
+from app.responses import FastJSONResponse
+from app.cache import TTLCache
+from app.attachments import (
+    ATTACHMENT_GC_GRACE_HOURS, StreamingWriter, temp_path, object_path, describe, commit, discard, append_part,
+    hash_file, get_attachment, forget_attachment,
+)
+
+router = APIRouter()
+
+RESUMABLE_UPLOAD_MAX_BYTES = int(os.getenv("RESUMABLE_UPLOAD_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+# Suggested size of each PUT for resumable uploads.
+RESUMABLE_CHUNK_SIZE = 8 * 1024 * 1024
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Seconds a chunk PUT may hold a session while appending its bytes; a claim
+# left behind by a crashed worker is taken over after that.
+UPLOAD_APPEND_LEASE_SECONDS = 600
+# Upload sessions whose running hash this worker keeps; evicted ones are hashed on completion.
+UPLOAD_HASHER_CACHE_SIZE = int(os.getenv("UPLOAD_HASHER_CACHE_SIZE", "1000"))
+
+# upload id -> (offset, running sha256) for sessions whose chunks reached this
+# worker in order. Otherwise the file is hashed once on completion. Entries of
+# abandoned sessions expire with the session.
+_session_hashers = TTLCache(maxsize=UPLOAD_HASHER_CACHE_SIZE, ttl=ATTACHMENT_GC_GRACE_HOURS * 3600)
+
+
+class UploadSessionCreate(BaseModel):
+    filename: str
+    size: int = Field(..., ge=0, le=RESUMABLE_UPLOAD_MAX_BYTES)
+    content_type: Optional[str] = None
+    sha256: Optional[str] = Field(None, pattern=r"^[0-9a-f]{64}$")  # verified on completion
+
+
+# --- Resumable uploads ---
+async def _get_session(upload_id: str, username: str) -> Dict:
+    session = await upload_session_collection.find_one({"_id": upload_id, "username": username})
+    if session is None:
+        raise HTTPException(status_code=404, detail="Upload session not found or expired")
+    return session
+
+
+@router.post("/uploads", status_code=201)
+async def create_upload_session(body: UploadSessionCreate, principal: Principal = Depends(get_principal)):
+    """
+    Start a resumable upload. Send the bytes with PUT /uploads/{upload_id}?offset=N
+    in any number of requests, then POST /uploads/{upload_id}/complete.
+    """
+    session = {
+        "_id": uuid.uuid4().hex,
+        "username": principal.username,
+        "filename": os.path.basename(body.filename),
+        "content_type": body.content_type,
+        "size": body.size,
+        "sha256": body.sha256,
+        "offset": 0,
+        "expires_at": datetime.utcnow() + timedelta(hours=ATTACHMENT_GC_GRACE_HOURS),
+    }
+    await upload_session_collection.insert_one(session)
+    return {"upload_id": session["_id"], "offset": 0, "size": body.size, "chunk_size": RESUMABLE_CHUNK_SIZE}
+
+
+@router.get("/uploads/{upload_id}")
+async def get_upload_session(upload_id: str, principal: Principal = Depends(get_principal)):
+    # Where to resume after a dropped connection.
+    session = await _get_session(upload_id, principal.username)
+    return {"upload_id": upload_id, "offset": session["offset"], "size": session["size"]}
+
+
+@router.put("/uploads/{upload_id}")
+async def upload_chunk(upload_id: str, request: Request, offset: int = Query(..., ge=0),
+                       principal: Principal = Depends(get_principal)):
+    session = await _get_session(upload_id, principal.username)
+    if offset != session["offset"]:
+        return FastJSONResponse({"detail": "Offset mismatch", "offset": session["offset"]}, status_code=409)
+
+    # Each request streams into its own part file, so concurrent PUTs at the
+    # same offset never write to the session's file. Continue a copy of the
+    # cached hash for the same reason.
+    offset_hasher = _session_hashers.get(upload_id)
+    hasher = offset_hasher[1].copy() if offset_hasher and offset_hasher[0] == offset else None
+    part = temp_path(f"{upload_id}-{uuid.uuid4().hex}")
+    writer = StreamingWriter(part, session["size"] - offset, hasher=hasher)
+    try:
+        async for chunk in request.stream():
+            await writer.write(chunk)
+        await writer.close()
+    except BaseException:
+        # The client resumes from `offset`.
+        await writer.abort()
+        raise
+    if writer.size == 0:
+        await discard(part)
+        return {"upload_id": upload_id, "offset": offset, "size": session["size"]}
+
+    # Claim the session at `offset`, then append and advance it. Only one
+    # request wins the claim; `offset` only moves once the bytes are in place,
+    # so completion never sees a half-appended file.
+    token = uuid.uuid4().hex
+    now = datetime.utcnow()
+    claimed = await upload_session_collection.update_one(
+        {"_id": upload_id, "offset": offset, "$or": [
+            {"appending": None}, {"appending_since": {"$lt": now - timedelta(seconds=UPLOAD_APPEND_LEASE_SECONDS)}},
+        ]},
+        {"$set": {"appending": token, "appending_since": now}},
+    )
+    if claimed.modified_count == 0:
+        await discard(part)
+        raise HTTPException(status_code=409, detail="Concurrent upload to the same session")
+    release = {"$unset": {"appending": "", "appending_since": ""}}
+    try:
+        await run_in_threadpool(append_part, temp_path(upload_id), part, offset)
+    except BaseException:
+        await discard(part)
+        await upload_session_collection.update_one({"_id": upload_id, "appending": token}, release)
+        raise
+    end = offset + writer.size
+    advanced = await upload_session_collection.update_one(
+        {"_id": upload_id, "appending": token}, {**release, "$set": {"offset": end}}
+    )
+    if advanced.modified_count == 0:
+        # Our claim expired and another request took over the session.
+        raise HTTPException(status_code=409, detail="Concurrent upload to the same session")
+    if hasher is not None or offset == 0:
+        _session_hashers.set(upload_id, (end, writer.hasher))
+    return {"upload_id": upload_id, "offset": end, "size": session["size"]}
+
+
+@router.post("/uploads/{upload_id}/complete")
+async def complete_upload(upload_id: str, request: Request, principal: Principal = Depends(get_principal)):
+    session = await _get_session(upload_id, principal.username)
+    if session["offset"] != session["size"]:
+        return FastJSONResponse(
+            {"detail": "Upload is incomplete", "offset": session["offset"], "size": session["size"]}, status_code=409
+        )
+    path = temp_path(upload_id)
+    offset_hasher = _session_hashers.get(upload_id)
+    _session_hashers.pop(upload_id)
+    if offset_hasher and offset_hasher[0] == session["size"]:
+        digest = offset_hasher[1].hexdigest()
+    else:
+        digest = await run_in_threadpool(hash_file, path)
+    await upload_session_collection.delete_one({"_id": upload_id})
+    if session.get("sha256") and session["sha256"] != digest:
+        await discard(path)
+        raise HTTPException(status_code=422, detail="SHA-256 of the uploaded data does not match")
+    meta = await commit(path, digest, session["size"], session["filename"], session.get("content_type"))
+    return describe(meta, str(request.base_url))
+
+
+# --- Serving ---
+@router.api_route("/{digest}", methods=["GET", "HEAD"])
+@router.api_route("/{digest}/{filename}", methods=["GET", "HEAD"])
+async def serve_attachment(request: Request, digest: str = Path(..., pattern=r"^[0-9a-f]{64}$"),
+                           filename: Optional[str] = None):
+    """
+    Attachment bytes by content hash. The URL never changes content, so it
+    is cacheable forever and revalidates with a strong ETag.
+    """
+    meta = await get_attachment(digest)
+    try:
+        stat_result = os.stat(object_path(digest)) if meta else None
+    except FileNotFoundError:
+        forget_attachment(digest)
+        stat_result = None
+    if stat_result is None:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+
+    etag = f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match.strip() == "*" or etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    # FileResponse handles Range / If-Range and HEAD.
+    return FileResponse(
+        object_path(digest),
+        headers=headers,
+        media_type=meta["content_type"],
+        filename=filename or meta["filename"],
+        stat_result=stat_result,
+        content_disposition_type="inline",
+    )
@@ -1,12 +1,14 @@
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
 from app.auth.auth_handler import (
-    get_password_hash,
-    verify_password,
+    hash_password_async,
+    verify_and_update_password_async,
     create_access_token,
-    get_current_user  # Ensure this dependency is implemented
+    get_current_user,  # Ensure this dependency is implemented
+    invalidate_user,
 )
 from app.database import user_collection
+from app.responses import FastJSONResponse
 
 # Ensure Router Uses "/auth"
 router = APIRouter(prefix="/auth", tags=["Auth"])  
@@ -29,7 +31,7 @@ async def register_user(user: UserCreate):
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already exists")
 
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await hash_password_async(user.password)
     new_user = {
         "name": user.name,
         "email": user.email,
@@ -38,16 +40,24 @@ async def register_user(user: UserCreate):
     }
 
     await user_collection.insert_one(new_user)
+    invalidate_user(new_user["username"])
     return {"message": "User created successfully"}
 
 # Login User & Generate JWT Token
 @router.post("/login", summary="Login user and get JWT token")
 async def login_user(user: UserLogin):
     db_user = await user_collection.find_one({"username": user.username.lower()})
-    
-    if not db_user or not verify_password(user.password, db_user["password"]):
+    if not db_user:
         raise HTTPException(status_code=401, detail="Invalid username or password")
 
+    valid, new_hash = await verify_and_update_password_async(user.password, db_user["password"])
+    if not valid:
+        raise HTTPException(status_code=401, detail="Invalid username or password")
+
+    # Transparently upgrade hashes made with an older cost factor.
+    if new_hash:
+        await user_collection.update_one({"_id": db_user["_id"]}, {"$set": {"password": new_hash}})
+
     token = create_access_token({"sub": db_user["username"]})
     return {"access_token": token, "token_type": "bearer"}
 
@@ -55,6 +65,7 @@ async def login_user(user: UserLogin):
 @router.delete("/delete", summary="Delete user account")
 async def delete_account(current_user: dict = Depends(get_current_user)):
     deletion_result = await user_collection.delete_one({"username": current_user["username"]})
+    invalidate_user(current_user["username"])
     if deletion_result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     return {"message": "User account deleted successfully"}
@@ -62,15 +73,7 @@ async def delete_account(current_user: dict = Depends(get_current_user)):
 # Get All Users
 @router.get("/all", summary="Get all users")
 async def get_all_users():
-    users_cursor = user_collection.find({})
+    # Project out sensitive fields in the query itself
+    users_cursor = user_collection.find({}, {"_id": 0, "name": 1, "email": 1, "username": 1})
     users = await users_cursor.to_list(length=None)
-    # Remove sensitive fields before returning
-    sanitized_users = [
-        {
-            "name": user.get("name"),
-            "email": user.get("email"),
-            "username": user.get("username")
-        }
-        for user in users
-    ]
-    return {"users": sanitized_users}
\ No newline at end of file
+    return FastJSONResponse({"users": users})
@@ -1,74 +1,22 @@
-import os
-import numpy as np
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 from fastapi import APIRouter, HTTPException, Query, Depends
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from datetime import datetime
-from dotenv import load_dotenv
-from app.database import doc_conversation_collection  # ensure this collection exists in your DB
-from app.auth.auth_bearer import JWTBearer
-from app.auth.auth_handler import decode_access_token
-
-load_dotenv("app/.env")
-
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-if not GROQ_API_KEY:
-    raise ValueError("API key for Groq is missing in the .env file.")
-
-from groq import Client
-client = Client(api_key=GROQ_API_KEY)
+from app.database import doc_conversation_collection, doc_conversation_message_collection
+from app.conversation_store import ConversationStore
+from app.context_window import CHAT_HISTORY_FETCH, build_context, schedule_summary
+from app.auth.auth_bearer import Principal, get_principal
+from app.sse import stream_reply
+from app.llm import query_llm, stream_llm
+from app.responses import FastJSONResponse
+from app.vector_store import open_vector_db
+from app.doc_ingest import ingest_document, get_document, retrieve_chunks, format_doc_context
+from app.ingestion import resolve_upload, submit_ingestion, get_job
 
 router = APIRouter()
 
-# --- VectorDB Implementation ---
-def compute_embedding(text: str) -> List[float]:
-    """
-    A placeholder function to compute an embedding.
-    For demonstration purposes, this returns a fixed-length vector
-    based on character ordinals. Replace with your actual embedding model.
-    """
-    vec = [float(ord(c)) for c in text]
-    if len(vec) < 50:
-        vec += [0.0] * (50 - len(vec))
-    else:
-        vec = vec[:50]
-    return vec
-
-class VectorDB:
-    def __init__(self):
-        # Stored documents: each is a dict with doc_id, title, content, and its embedding.
-        self.documents = []
-    
-    def add_document(self, doc_id: str, title: str, content: str):
-        embedding = compute_embedding(content)
-        doc = {
-            "doc_id": doc_id,
-            "title": title,
-            "content": content,
-            "embedding": embedding
-        }
-        self.documents.append(doc)
-    
-    def get_document(self, doc_id: str) -> Dict:
-        for doc in self.documents:
-            if doc["doc_id"] == doc_id:
-                return doc
-        return None
-    
-    def search_documents(self, query: str, top_k: int = 1) -> List[Dict]:
-        query_embedding = np.array(compute_embedding(query))
-        results = []
-        for doc in self.documents:
-            doc_embedding = np.array(doc["embedding"])
-            similarity = np.dot(query_embedding, doc_embedding) / (
-                np.linalg.norm(query_embedding) * np.linalg.norm(doc_embedding) + 1e-10
-            )
-            results.append((similarity, doc))
-        results.sort(key=lambda x: x[0], reverse=True)
-        return [doc for sim, doc in results[:top_k]]
-
-# Instantiate a global in-memory vector database
-vector_db = VectorDB()
+# Vector index shared by all workers through VECTOR_INDEX_DIR (in memory if unset)
+vector_db = open_vector_db()
 
 # --- Pydantic Models ---
 class Document(BaseModel):
@@ -76,6 +24,11 @@ class Document(BaseModel):
     title: str
     content: str
 
+class IngestRequest(BaseModel):
+    filename: str                  # attachment URL or id returned by /ws/upload
+    doc_id: Optional[str] = None   # defaults to the filename
+    title: Optional[str] = None    # defaults to the filename
+
 class DocUserInput(BaseModel):
     message: str
     doc_id: str
@@ -83,103 +36,105 @@ class DocUserInput(BaseModel):
     role: str = "user"
 
 # --- Conversation Helpers ---
-async def get_or_create_doc_conversation(conversation_id: str) -> List[Dict[str, str]]:
-    conversation_doc = await doc_conversation_collection.find_one({"_id": conversation_id})
-    if conversation_doc:
-        return conversation_doc.get("messages", [])
-    else:
-        new_conversation = [{
-            "role": "system",
-            "content": "Welcome to the document chat. Ask me anything about the document."
-        }]
-        await doc_conversation_collection.insert_one({
-            "_id": conversation_id,
-            "messages": new_conversation,
-            "updated_at": datetime.utcnow()
-        })
-        return new_conversation
-
-async def update_doc_conversation_in_db(conversation_id: str, messages: List[Dict[str, str]]):
-    await doc_conversation_collection.update_one(
-        {"_id": conversation_id},
-        {"$set": {
-            "messages": messages,
-            "updated_at": datetime.utcnow()
-        }},
-        upsert=True
-    )
-
-def query_groq_api(messages: List[Dict[str, str]]) -> str:
-    try:
-        print("Sending messages to Groq API:", messages)
-        completion = client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=messages,
-            temperature=1,
-            max_tokens=1024,
-            top_p=1,
-            stream=True,
-            stop=None,
-        )
-        response = ""
-        for chunk in completion:
-            response += chunk.choices[0].delta.content or ""
-        print("Received response from Groq API:", response)
-        return response
-    except Exception as e:
-        print(f"Error with Groq API: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error with Groq API: {str(e)}")
+doc_conversation_store = ConversationStore(
+    doc_conversation_collection,
+    doc_conversation_message_collection,
+    greeting="Welcome to the document chat. Ask me anything about the document.",
+)
 
 # --- API Endpoints ---
 
-@router.post("/upload_document", dependencies=[Depends(JWTBearer())])
-async def upload_document(document: Document, token: str = Depends(JWTBearer())):
+@router.post("/upload_document")
+async def upload_document(document: Document, principal: Principal = Depends(get_principal)):
     """
-    Upload a document to the vector database.
+    Upload a document to the vector database, split into embedded chunks.
     """
-    vector_db.add_document(document.doc_id, document.title, document.content)
-    return {"message": "Document uploaded successfully", "doc_id": document.doc_id}
+    record = await ingest_document(vector_db, document.doc_id, document.title, document.content, principal.username)
+    return {"message": "Document uploaded successfully", "doc_id": document.doc_id, "chunks": record["chunks"]}
 
-@router.get("/doc_chats", dependencies=[Depends(JWTBearer())])
-async def get_doc_chat_history(conversation_id: str = Query(..., description="The ID of the document conversation")):
-    messages = await get_or_create_doc_conversation(conversation_id)
-    return {"conversation_id": conversation_id, "messages": messages}
-
-@router.post("/doc_chat", dependencies=[Depends(JWTBearer())])
-async def doc_chat(input: DocUserInput, token: str = Depends(JWTBearer())):
+@router.post("/ingest", status_code=202)
+async def ingest_file(request: IngestRequest, principal: Principal = Depends(get_principal)):
     """
-    Chat endpoint for interacting with a document.
-    The conversation context is updated with both the user’s query and
-    a snippet from the relevant document stored in the vector database.
+    Queue an uploaded PDF, DOCX or TXT file for text extraction and indexing.
+    Poll GET /ingest/{job_id} for progress.
     """
-    # Decode the JWT token to get the username if needed.
-    user_data = decode_access_token(token)
-    username = user_data.get("sub")
-    
-    # Retrieve or create conversation history.
-    messages = await get_or_create_doc_conversation(input.conversation_id)
+    path, filename = await resolve_upload(request.filename)
+    job = await submit_ingestion(
+        vector_db, path, filename, request.doc_id or filename, request.title or filename, principal.username
+    )
+    return FastJSONResponse({"job_id": job["_id"], "doc_id": job["doc_id"], "status": job["status"]}, status_code=202)
+
+@router.get("/ingest/{job_id}")
+async def ingest_status(job_id: str, principal: Principal = Depends(get_principal)):
+    job = await get_job(job_id, principal.username)
+    if not job:
+        raise HTTPException(status_code=404, detail="Ingestion job not found")
+    job["job_id"] = job.pop("_id")
+    return FastJSONResponse(job)
+
+@router.get("/doc_chats", dependencies=[Depends(get_principal)])
+async def get_doc_chat_history(
+    conversation_id: str = Query(..., description="The ID of the document conversation"),
+    limit: int = Query(50, ge=1, le=500),
+    before: Optional[int] = Query(None, description="next_before from the previous page"),
+):
+    messages, next_before = await doc_conversation_store.history_page(conversation_id, limit, before)
+    return FastJSONResponse({"conversation_id": conversation_id, "messages": messages, "next_before": next_before})
+
+async def prepare_doc_chat_messages(input: DocUserInput) -> Tuple[List[Dict[str, str]], List[Dict]]:
+    # Retrieve or create the recent conversation history and its running summary.
+    history, meta = await doc_conversation_store.get_context(input.conversation_id, limit=CHAT_HISTORY_FETCH)
     
-    # Append the user's message.
-    messages.append({"role": input.role, "content": input.message})
+    # Messages added this turn; only these are written back.
+    new_messages = [{"role": input.role, "content": input.message}]
     
     # Retrieve the document from the vector database.
-    doc = vector_db.get_document(input.doc_id)
+    doc = await get_document(vector_db, input.doc_id)
     if not doc:
         raise HTTPException(status_code=404, detail=f"Document with id {input.doc_id} not found in vector database.")
     
-    # Prepare a context message from the document.
-    # You can adjust this snippet as needed (e.g., limiting the length).
-    doc_context = (
-        f"Document Title: {doc['title']}\n"
-        f"Document Content (snippet): {doc['content'][:500]}"
-    )
-    messages.append({"role": "system", "content": doc_context})
+    # Prepare a context message from the chunks most relevant to the question.
+    # Embedding the question and searching the index are CPU and file work.
+    chunks = await run_in_threadpool(retrieve_chunks, vector_db, doc, input.message)
+    doc_context = format_doc_context(doc, chunks)
+    new_messages.append({"role": "system", "content": doc_context, "kind": "doc_context"})
+
+    # Fit the prompt into the token budget; older turns go into the summary.
+    messages, overflow = build_context(history, new_messages, meta.get("summary"), meta.get("summary_upto", 0))
+    schedule_summary(doc_conversation_store, input.conversation_id, meta.get("summary"), overflow)
+    return messages, new_messages
+
+@router.post("/doc_chat")
+async def doc_chat(input: DocUserInput, principal: Principal = Depends(get_principal)):
+    """
+    Chat endpoint for interacting with a document.
+    The conversation context is updated with both the user’s query and
+    the document excerpts most relevant to it.
+    """
+    username = principal.username
     
-    # Query the Groq API with the updated conversation context.
-    response = query_groq_api(messages)
+    messages, new_messages = await prepare_doc_chat_messages(input)
+    
+    # Query the LLM with the updated conversation context.
+    response = await query_llm(messages)
     
     # Append the assistant's response.
-    messages.append({"role": "assistant", "content": response})
-    await update_doc_conversation_in_db(input.conversation_id, messages)
+    new_messages.append({"role": "assistant", "content": response})
+    await doc_conversation_store.append(input.conversation_id, new_messages)
     
     return {"response": response, "conversation_id": input.conversation_id}
+
+@router.post("/doc_chat/stream")
+async def doc_chat_stream(input: DocUserInput, principal: Principal = Depends(get_principal)):
+    """
+    Streaming variant of `doc_chat`: deltas are sent as Server-Sent Events
+    and the conversation is persisted once the reply is complete.
+    """
+    messages, new_messages = await prepare_doc_chat_messages(input)
+
+    async def persist(response: str) -> dict:
+        new_messages.append({"role": "assistant", "content": response})
+        await doc_conversation_store.append(input.conversation_id, new_messages)
+        return {"response": response, "conversation_id": input.conversation_id}
+
+    return stream_reply(stream_llm(messages), persist)
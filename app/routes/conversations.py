@@ -1,50 +1,121 @@
+import os
+import json
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect,  File, UploadFile, Request
-from typing import Dict, List, Tuple
 from datetime import datetime
-from app.crud import create_chat_message, get_chat_history
-import shutil
-import os
+from typing import Optional
+from app.crud import (
+    create_chat_message, get_chat_history, conversation_key, has_chat_message, get_chat_messages_after,
+    get_chat_messages_before,
+)
+from app.responses import dumps
+from app.attachments import save_upload, describe
+from app.connections import ConnectionManager
+from app.backplane import get_backplane
+from app.chat_writer import get_chat_writer
 
 router = APIRouter()
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[Tuple[str, str], List[WebSocket]] = {}
+manager = ConnectionManager()
+# Messages from any worker reach this worker's connections through the backplane.
+backplane = get_backplane()
+backplane.subscribe("chat", manager.broadcast)
 
-    async def connect(self, conversation_id: Tuple[str, str], websocket: WebSocket):
-        await websocket.accept()
-        if conversation_id not in self.active_connections:
-            self.active_connections[conversation_id] = []
-        self.active_connections[conversation_id].append(websocket)
+# With ?protocol=json every frame is a JSON object:
+#   server -> client
+#     {"type": "history", "messages": [...], "reset": bool, "has_older": bool}  (batches)
+#     {"type": "ready"}                                   end of the replay, live from here
+#     {"type": "message", "id", "sender", "receiver", "message", "timestamp"}
+#     {"type": "left", "sender"}
+#     {"type": "backfill", "messages": [...], "has_older": bool}
+#     {"type": "ping"} / {"type": "error", "detail"}
+#   client -> server
+#     {"type": "message", "message": "..."}
+#     {"type": "backfill", "before_id": "...", "limit": 50}   older history, one page
+# A client reconnecting with ?last_seen_id=<id> is only sent the messages
+# after it. Without one (or with an unknown id) it gets the latest page with
+# "reset": true and pages back with backfill.
+HISTORY_BATCH_SIZE = int(os.getenv("CHAT_HISTORY_BATCH_SIZE", "100"))
+HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", "50"))
+BACKFILL_MAX = 200
+PING_FRAME = dumps({"type": "ping"}).decode()
 
-    def disconnect(self, conversation_id: Tuple[str, str], websocket: WebSocket):
-        if conversation_id in self.active_connections:
-            self.active_connections[conversation_id].remove(websocket)
-            if not self.active_connections[conversation_id]:
-                del self.active_connections[conversation_id]
 
-    async def broadcast(self, conversation_id: Tuple[str, str], message: str):
-        if conversation_id in self.active_connections:
-            for connection in self.active_connections[conversation_id]:
-                await connection.send_text(message)
+def render_text(event: dict) -> str:
+    # Legacy plain-text frames.
+    if event["type"] == "left":
+        return f"{event['sender']} left the chat."
+    return f"{event['sender']}: {event['message']}"
 
-manager = ConnectionManager()
 
-@router.websocket("/chat/{sender}/{receiver}")
-async def chat(websocket: WebSocket, sender: str, receiver: str):
-    conversation_id = tuple(sorted([sender, receiver]))
-    await manager.connect(conversation_id, websocket)
+def render_json(event: dict) -> str:
+    return dumps(event).decode()
+
 
-    # Fetch and send previous chat history to the new connection
-    history = await get_chat_history(sender, receiver)
-    for msg in history:
-        # Format message as sender: message
-        formatted_msg = f"{msg['sender']}: {msg['message']}"
-        await websocket.send_text(formatted_msg)
+async def replay_json(websocket: WebSocket, sender: str, receiver: str, last_seen_id: Optional[str]):
+    if last_seen_id and await has_chat_message(sender, receiver, last_seen_id):
+        async for batch in get_chat_messages_after(sender, receiver, last_seen_id, HISTORY_BATCH_SIZE):
+            await websocket.send_text(render_json({"type": "history", "messages": batch, "reset": False}))
+    else:
+        messages, has_older = await get_chat_messages_before(sender, receiver, None, HISTORY_PAGE_SIZE)
+        await websocket.send_text(render_json(
+            {"type": "history", "messages": messages, "reset": True, "has_older": has_older}
+        ))
+    await websocket.send_text(render_json({"type": "ready"}))
 
+
+async def handle_json_frame(connection, sender: str, receiver: str, data: str) -> Optional[str]:
+    # The chat text of a message frame; control frames are answered here.
     try:
-        while True:
+        frame = json.loads(data)
+    except ValueError:
+        frame = None
+    if not isinstance(frame, dict):
+        manager.send(connection, render_json({"type": "error", "detail": "Frames must be JSON objects"}))
+        return None
+    if frame.get("type") == "message" and isinstance(frame.get("message"), str):
+        return frame["message"]
+    if frame.get("type") == "backfill":
+        try:
+            limit = max(1, min(int(frame.get("limit") or HISTORY_PAGE_SIZE), BACKFILL_MAX))
+        except (TypeError, ValueError):
+            limit = HISTORY_PAGE_SIZE
+        messages, has_older = await get_chat_messages_before(sender, receiver, frame.get("before_id"), limit)
+        manager.send(connection, render_json({"type": "backfill", "messages": messages, "has_older": has_older}))
+        return None
+    manager.send(connection, render_json({"type": "error", "detail": "Unknown frame type"}))
+    return None
+
+
+@router.websocket("/chat/{sender}/{receiver}")
+async def chat(websocket: WebSocket, sender: str, receiver: str, protocol: str = "text",
+               last_seen_id: Optional[str] = None):
+    conversation_id = conversation_key(sender, receiver)
+    json_protocol = protocol == "json"
+    # Live messages queue up behind the history until the writer starts.
+    connection = await manager.connect(
+        conversation_id, websocket,
+        heartbeat=PING_FRAME if json_protocol else None,
+        render=render_json if json_protocol else render_text,
+        start=False,
+    )
+
+    try:
+        if json_protocol:
+            await replay_json(websocket, sender, receiver, last_seen_id)
+        else:
+            # Fetch and send previous chat history to the new connection
+            history = await get_chat_history(sender, receiver)
+            for msg in history:
+                await websocket.send_text(render_text({"type": "message", **msg}))
+        manager.start(connection)
+
+        # Stops when the connection is evicted as a slow consumer.
+        while not connection.closed:
             data = await websocket.receive_text()
+            if json_protocol:
+                data = await handle_json_frame(connection, sender, receiver, data)
+                if data is None:
+                    continue
             # Build a chat message 
             chat_data = {
                 "sender": sender,
@@ -53,22 +124,24 @@ async def chat(websocket: WebSocket, sender: str, receiver: str):
                 "timestamp": datetime.utcnow()
             }
             # Storing msg
-            await create_chat_message(chat_data)
+            message = await create_chat_message(chat_data)
             # Broadcast the message to all connections 
-            await manager.broadcast(conversation_id, f"{sender}: {data}")
+            await backplane.publish("chat", conversation_id, {"type": "message", **message})
     except WebSocketDisconnect:
-        manager.disconnect(conversation_id, websocket)
-        await manager.broadcast(conversation_id, f"{sender} left the chat.")
+        pass
+    finally:
+        manager.disconnect(connection)
+    await backplane.publish("chat", conversation_id, {"type": "left", "sender": sender})
+
+
+@router.get("/metrics")
+async def ws_metrics():
+    # Send queue depth, drops/evictions and fan-out latency of this worker.
+    return {**manager.stats(), "backplane": backplane.stats(), "writer": get_chat_writer().stats()}
 
 
 @router.post("/upload")
 async def upload_file(request: Request, file: UploadFile = File(...)):
-    upload_folder = "uploads"
-    os.makedirs(upload_folder, exist_ok=True)
-    file_path = os.path.join(upload_folder, file.filename)
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    # For simplicity, we return the URL as a relative path.
-    file_url = f"{request.base_url}uploads/{file.filename}"
-    print("Returning file URL:", file_url)
-    return {"url": file_url}
\ No newline at end of file
+    # Streamed into the content-addressed store; identical files share one copy.
+    meta = await save_upload(file, file.filename, file.content_type)
+    return describe(meta, str(request.base_url))
\ No newline at end of file
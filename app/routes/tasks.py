@@ -1,44 +1,165 @@
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File
-from app.schemas import TaskCreate, TaskUpdate
-from app.auth.auth_bearer import JWTBearer
-from app.auth.auth_handler import decode_access_token
+import base64
+import json
+from typing import Optional, Iterable
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Query, WebSocket, WebSocketDisconnect
+from app.schemas import TaskCreate, TaskUpdate, BulkTaskRequest
+from app.auth.auth_bearer import Principal, get_principal
 from app.database import todo_collection
 from bson import ObjectId
+from pymongo import InsertOne, UpdateOne, DeleteOne, ReturnDocument
+from pymongo.errors import BulkWriteError
+from app.responses import FastJSONResponse, dumps
+from app.auth.auth_handler import decode_access_token
+from app.connections import ConnectionManager
+from app.backplane import get_backplane
+from app.attachments import add_refs, sync_refs, release_refs
+from app.task_digest import (
+    DIGEST_FIELDS, digest_task_saved, digest_task_deleted, digest_tasks_changed, rebuild_task_digest,
+    get_task_digest, summarize_digest,
+)
 from pathlib import Path
 
 router = APIRouter()
 
 
+TASK_FIELDS = ("title", "description", "dueDate", "priority", "status", "completed", "username", "pinned", "attachments")
+# Lean fields for list views that don't need descriptions or attachments.
+SUMMARY_FIELDS = ("title", "dueDate", "priority", "status", "completed", "pinned")
+TASK_DEFAULTS = {"pinned": False, "attachments": []}
+
+# Listing order; matches the todos (username, pinned, dueDate, _id) index.
+TASK_SORT = [("pinned", -1), ("dueDate", 1), ("_id", 1)]
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+# Per-user change feed. Every frame is {"type": "changes", "changes": [...]}
+# with deltas {"op": "create", "task"}, {"op": "update", "_id", "fields"}
+# or {"op": "delete", "_id"}, so clients patch their list instead of
+# reloading it. Deltas from any worker arrive through the backplane.
+task_feed = ConnectionManager()
+backplane = get_backplane()
+backplane.subscribe("tasks", task_feed.broadcast)
+FEED_PING_FRAME = dumps({"type": "ping"}).decode()
+
+def render_task_changes(changes: list) -> str:
+    return dumps({"type": "changes", "changes": changes}).decode()
+
+async def publish_task_changes(username: str, changes: list):
+    if changes:
+        await backplane.publish("tasks", username, changes)
+
 # Helper function to serialize a task document
-def task_serializer(task) -> dict:
+def task_serializer(task, fields: Iterable[str] = TASK_FIELDS) -> dict:
+    serialized = {"_id": str(task["_id"])}
+    for field in fields:
+        serialized[field] = task.get(field, TASK_DEFAULTS.get(field))
+    return serialized
+
+def task_projection(fields: Iterable[str], sort_keys: Iterable[str] = ()) -> dict:
+    """
+    Projection giving listed documents the shape task_serializer produces
+    (missing fields become their default or null), so they are encoded as
+    they come back instead of being copied. Sort keys keep their stored
+    value, null when missing, so cursors match the sort order.
+    """
+    sort_keys = set(sort_keys)
     return {
-        "_id": str(task["_id"]),
-        "title": task.get("title"),
-        "description": task.get("description"),
-        "dueDate": task.get("dueDate"),
-        "priority": task.get("priority"),
-        "status": task.get("status"),
-        "completed": task.get("completed"),
-        "username": task.get("username"),
-        "pinned": task.get("pinned", False),
-        "attachments": task.get("attachments", []),
+        field: {"$ifNull": [f"${field}", None if field in sort_keys else TASK_DEFAULTS.get(field)]}
+        for field in fields
     }
 
-# Get All Tasks for a Logged-In User
-@router.get("/", dependencies=[Depends(JWTBearer())])
-async def get_tasks(token: str = Depends(JWTBearer())):
-    user_data = decode_access_token(token)
-    username = user_data.get("sub")
-    
-    tasks_cursor = todo_collection.find({"username": username})
-    tasks = await tasks_cursor.to_list(length=None)
-    return {"tasks": [task_serializer(task) for task in tasks]}
+def encode_task_cursor(task) -> str:
+    raw = json.dumps([task.get("pinned"), task.get("dueDate"), str(task["_id"])])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_task_cursor(cursor: str) -> dict:
+    """
+    Build the filter matching every task that sorts after the cursor
+    position in TASK_SORT order (pinned desc, dueDate asc, _id asc).
+    """
+    try:
+        pinned, due_date, task_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        task_id = ObjectId(task_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    # Missing/null due dates sort before any date string.
+    due_after = {"$ne": None} if due_date is None else {"$gt": due_date}
+    after = [
+        {"pinned": pinned, "dueDate": due_after},
+        {"pinned": pinned, "dueDate": due_date, "_id": {"$gt": task_id}},
+    ]
+    if pinned is True:
+        after.append({"pinned": {"$ne": True}})
+    elif pinned is False:
+        after.append({"pinned": None})
+    return {"$or": after}
+
+def parse_fields(fields: Optional[str], summary: bool) -> tuple:
+    if fields:
+        requested = tuple(f.strip() for f in fields.split(",") if f.strip())
+        unknown = [f for f in requested if f not in TASK_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown task fields: {', '.join(unknown)}")
+        return requested
+    return SUMMARY_FIELDS if summary else TASK_FIELDS
+
+# Get Tasks for a Logged-In User, one page at a time
+@router.get("/")
+async def get_tasks(
+    principal: Principal = Depends(get_principal),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    status: Optional[str] = None,
+    priority: Optional[str] = None,
+    completed: Optional[bool] = None,
+    fields: Optional[str] = Query(None, description="Comma-separated task fields to return"),
+    summary: bool = Query(False, description="Return only the fields needed for list views"),
+):
+    username = principal.username
+    output_fields = parse_fields(fields, summary)
+
+    query = {"username": username}
+    if status is not None:
+        query["status"] = status
+    if priority is not None:
+        query["priority"] = priority
+    if completed is not None:
+        query["completed"] = completed
+    if cursor:
+        query.update(decode_task_cursor(cursor))
+
+    # The sort keys are always fetched so the next cursor can be built.
+    sort_keys = {"pinned", "dueDate"}
+    projection = task_projection({*output_fields, *sort_keys}, sort_keys)
+    tasks_cursor = todo_collection.find(query, projection).sort(TASK_SORT).limit(limit + 1)
+    tasks = await tasks_cursor.to_list(length=limit + 1)
+
+    next_cursor = None
+    if len(tasks) > limit:
+        del tasks[limit:]
+        next_cursor = encode_task_cursor(tasks[-1])
+    unrequested = sort_keys.difference(output_fields)
+    if unrequested:
+        for task in tasks:
+            for key in unrequested:
+                del task[key]
+    return FastJSONResponse({"tasks": tasks, "next_cursor": next_cursor})
+
+# Task counts and next due items from the user's task digest
+@router.get("/digest")
+async def get_digest(principal: Principal = Depends(get_principal)):
+    return summarize_digest(await get_task_digest(principal.username))
+
+# Rebuild the user's task digest from their tasks
+@router.post("/digest/rebuild")
+async def rebuild_digest(principal: Principal = Depends(get_principal)):
+    return summarize_digest(await rebuild_task_digest(principal.username))
 
 # Add a New Task
-@router.post("/", dependencies=[Depends(JWTBearer())])
-async def create_task(task: TaskCreate, token: str = Depends(JWTBearer())):
-    user_data = decode_access_token(token)
-    username = user_data.get("sub")
+@router.post("/")
+async def create_task(task: TaskCreate, principal: Principal = Depends(get_principal)):
+    username = principal.username
     new_task = task.dict()
     new_task["username"] = username
 
@@ -46,14 +167,17 @@ async def create_task(task: TaskCreate, token: str = Depends(JWTBearer())):
     if not result.inserted_id:
         raise HTTPException(status_code=500, detail="Task creation failed")
     
-    created_task = await todo_collection.find_one({"_id": result.inserted_id})
-    return task_serializer(created_task)
+    new_task["_id"] = result.inserted_id
+    await digest_task_saved(username, new_task)
+    await add_refs({f"task:{new_task['_id']}": new_task.get("attachments")})
+    serialized = task_serializer(new_task)
+    await publish_task_changes(username, [{"op": "create", "task": serialized}])
+    return serialized
 
 # Update a Task
-@router.put("/{task_id}", dependencies=[Depends(JWTBearer())])
-async def update_task(task_id: str, updated_task: TaskUpdate, token: str = Depends(JWTBearer())):
-    user_data = decode_access_token(token)
-    username = user_data.get("sub")
+@router.put("/{task_id}")
+async def update_task(task_id: str, updated_task: TaskUpdate, principal: Principal = Depends(get_principal)):
+    username = principal.username
 
     if not ObjectId.is_valid(task_id):
         raise HTTPException(status_code=400, detail="Invalid Task ID")
@@ -62,22 +186,25 @@ async def update_task(task_id: str, updated_task: TaskUpdate, token: str = Depen
     if not update_fields:
         raise HTTPException(status_code=400, detail="No fields provided for update")
 
-    result = await todo_collection.update_one(
+    updated = await todo_collection.find_one_and_update(
         {"_id": ObjectId(task_id), "username": username},
         {"$set": update_fields},
+        return_document=ReturnDocument.AFTER,
     )
 
-    if result.matched_count == 0:
+    if updated is None:
         raise HTTPException(status_code=404, detail="Task not found or you don't have permission to edit this task")
 
-    updated = await todo_collection.find_one({"_id": ObjectId(task_id)})
+    await digest_task_saved(username, updated)
+    if "attachments" in update_fields:
+        await sync_refs({f"task:{task_id}": update_fields["attachments"]})
+    await publish_task_changes(username, [{"op": "update", "_id": task_id, "fields": update_fields}])
     return task_serializer(updated)
 
 # Delete a Task
-@router.delete("/{task_id}", dependencies=[Depends(JWTBearer())])
-async def delete_task(task_id: str, token: str = Depends(JWTBearer())):
-    user_data = decode_access_token(token)
-    username = user_data.get("sub")
+@router.delete("/{task_id}")
+async def delete_task(task_id: str, principal: Principal = Depends(get_principal)):
+    username = principal.username
 
     if not ObjectId.is_valid(task_id):
         raise HTTPException(status_code=400, detail="Invalid Task ID")
@@ -87,4 +214,174 @@ async def delete_task(task_id: str, token: str = Depends(JWTBearer())):
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Task not found or you don't have permission to delete this task")
 
+    await digest_task_deleted(username, task_id)
+    await release_refs([f"task:{task_id}"])
+    await publish_task_changes(username, [{"op": "delete", "_id": task_id}])
+
     return {"message": "Task deleted successfully"}
+
+async def _update_bulk_attachment_refs(operations, results):
+    created, updated, deleted = {}, {}, []
+    for op, result in zip(operations, results):
+        if result is None or result.get("status") != "ok":
+            continue
+        owner = f"task:{result['id']}"
+        if op.op == "create":
+            created[owner] = op.task.attachments
+        elif op.op == "update" and op.changes.attachments is not None:
+            updated[owner] = op.changes.attachments
+        elif op.op == "delete":
+            deleted.append(owner)
+    await add_refs(created)
+    await sync_refs(updated)
+    await release_refs(deleted)
+
+async def _update_bulk_digest(username, changes, write_positions, results, current):
+    # Fold the successful operations into one digest update.
+    saved, deleted = {}, []
+    for index in write_positions:
+        if results[index]["status"] != "ok":
+            continue
+        change = changes[index]
+        if change["op"] == "create":
+            saved[change["task"]["_id"]] = change["task"]
+        elif change["op"] == "update":
+            task_id = change["_id"]
+            saved[task_id] = {**saved.get(task_id, current.get(task_id, {})), **change["fields"]}
+        else:
+            saved.pop(change["_id"], None)
+            deleted.append(change["_id"])
+    await digest_tasks_changed(username, saved, deleted)
+
+async def _mark_vanished_updates(username, writes, write_positions, results, matched):
+    """
+    Report updates whose task was deleted by another request between the
+    pre-read and the bulk write as not_found. The bulk result only has a
+    total match count, so the targets are re-read when it falls short.
+    A delete racing with another delete is still reported ok: the task is
+    gone either way, and `deleted` counts what this request removed.
+    In ordered mode the operations after such an update have already run.
+    """
+    updates = {
+        position: index for position, index in enumerate(write_positions)
+        if isinstance(writes[position], UpdateOne) and results[index]["status"] == "ok"
+    }
+    if matched >= len(updates):
+        return
+    ids = [ObjectId(results[index]["id"]) for index in updates.values()]
+    remaining = todo_collection.find({"_id": {"$in": ids}, "username": username}, {"_id": 1})
+    found = {str(doc["_id"]) for doc in await remaining.to_list(length=None)}
+    for index in updates.values():
+        if results[index]["id"] not in found:
+            results[index].update(status="not_found", detail="Task was deleted before the update was applied")
+
+# Apply many create/update/delete/pin operations in one bulk_write
+@router.post("/bulk")
+async def bulk_tasks(request: BulkTaskRequest, principal: Principal = Depends(get_principal)):
+    username = principal.username
+    operations = request.operations
+    results = [None] * len(operations)
+
+    # One read up front to tell "not found" apart from a write error. It
+    # also gives the digest fields that partial updates don't carry.
+    target_ids = [ObjectId(op.id) for op in operations if op.op != "create" and op.id and ObjectId.is_valid(op.id)]
+    existing = set()
+    current = {}
+    if target_ids:
+        owned = todo_collection.find({"_id": {"$in": target_ids}, "username": username}, dict.fromkeys(DIGEST_FIELDS, 1))
+        current = {str(doc["_id"]): doc for doc in await owned.to_list(length=None)}
+        existing = {doc["_id"] for doc in current.values()}
+
+    writes = []
+    write_positions = []  # writes[i] belongs to operations[write_positions[i]]
+    changes = {}  # operation index -> feed delta, published if the write succeeds
+    for index, op in enumerate(operations):
+        result = {"index": index, "op": op.op, "id": op.id}
+        results[index] = result
+        write = None
+
+        if op.op == "create":
+            if op.task is None:
+                result.update(status="error", detail="'task' is required for create")
+            else:
+                new_task = op.task.dict()
+                new_task["username"] = username
+                new_task["_id"] = ObjectId()
+                result["id"] = str(new_task["_id"])
+                write = InsertOne(new_task)
+                changes[index] = {"op": "create", "task": task_serializer(new_task)}
+        elif not op.id or not ObjectId.is_valid(op.id):
+            result.update(status="error", detail="Invalid Task ID")
+        elif ObjectId(op.id) not in existing:
+            result.update(status="not_found", detail="Task not found or you don't have permission to modify this task")
+        elif op.op == "delete":
+            write = DeleteOne({"_id": ObjectId(op.id), "username": username})
+            changes[index] = {"op": "delete", "_id": op.id}
+            # Later operations on the same task in this batch find nothing.
+            existing.discard(ObjectId(op.id))
+        else:
+            if op.op == "pin":
+                update_fields = {"pinned": bool(op.pinned)}
+            else:
+                update_fields = {k: v for k, v in (op.changes.dict() if op.changes else {}).items() if v is not None}
+            if not update_fields:
+                result.update(status="error", detail="No fields provided for update")
+            else:
+                write = UpdateOne({"_id": ObjectId(op.id), "username": username}, {"$set": update_fields})
+                changes[index] = {"op": "update", "_id": op.id, "fields": update_fields}
+
+        if write is not None:
+            result["status"] = "ok"
+            writes.append(write)
+            write_positions.append(index)
+        elif result["status"] in ("error", "not_found") and request.ordered:
+            # Nothing after the failed operation runs.
+            for later in range(index + 1, len(operations)):
+                results[later] = {"index": later, "op": operations[later].op, "id": operations[later].id, "status": "skipped"}
+            break
+
+    counts = {"inserted": 0, "modified": 0, "deleted": 0}
+    if writes:
+        try:
+            bulk_result = await todo_collection.bulk_write(writes, ordered=request.ordered)
+            details = bulk_result.bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+            failed = {error["index"]: error for error in details.get("writeErrors", [])}
+            for position, index in enumerate(write_positions):
+                if position in failed:
+                    results[index].update(status="error", detail=failed[position].get("errmsg"))
+                elif request.ordered and failed and position > min(failed):
+                    results[index]["status"] = "skipped"
+        await _mark_vanished_updates(username, writes, write_positions, results, details.get("nMatched", 0))
+        counts = {
+            "inserted": details.get("nInserted", 0),
+            "modified": details.get("nModified", 0),
+            "deleted": details.get("nRemoved", 0),
+        }
+        await _update_bulk_digest(username, changes, write_positions, results, current)
+        await _update_bulk_attachment_refs(operations, results)
+        await publish_task_changes(
+            username, [changes[index] for index in write_positions if results[index]["status"] == "ok"]
+        )
+
+    return FastJSONResponse({"results": results, **counts})
+
+# Push task changes to the user's open tabs. Browsers can't set headers on
+# WebSockets, so the access token comes as ?token=.
+@router.websocket("/feed")
+async def task_feed_socket(websocket: WebSocket, token: str = Query(...)):
+    payload = decode_access_token(token)
+    username = payload.get("sub") if payload else None
+    if not username:
+        await websocket.close(code=1008)
+        return
+    connection = await task_feed.connect(username, websocket, heartbeat=FEED_PING_FRAME, render=render_task_changes)
+    try:
+        # Nothing is expected from the client; this waits for it to go away.
+        while not connection.closed:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        task_feed.disconnect(connection)
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel, EmailStr
-from app.auth.auth_handler import get_password_hash, verify_password, create_access_token
+from app.auth.auth_handler import get_password_hash, verify_password, create_access_token, invalidate_user
 from app.database import user_collection
 
 router = APIRouter()
@@ -32,6 +32,7 @@ async def register_user(user: UserCreate):
     }
 
     await user_collection.insert_one(new_user)
+    invalidate_user(new_user["username"])
     return {"message": "User created successfully"}
 
 # Login User & Generate JWT Token
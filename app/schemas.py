@@ -1,6 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Literal
 
 class TaskCreate(BaseModel):
     title: str
@@ -10,15 +10,29 @@ class TaskCreate(BaseModel):
     status: Optional[str] = "todo"
     completed: Optional[bool] = False
     pinned: Optional[bool] = False
+    attachments: Optional[List[str]] = []  # attachment URLs or ids
 
 class TaskUpdate(BaseModel):
-    title: Optional[str]
-    description: Optional[str]
-    dueDate: Optional[str]
-    priority: Optional[str]
-    status: Optional[str]
-    completed: Optional[bool]
+    title: Optional[str] = None
+    description: Optional[str] = None
+    dueDate: Optional[str] = None
+    priority: Optional[str] = None
+    status: Optional[str] = None
+    completed: Optional[bool] = None
     pinned: Optional[bool] = None
+    attachments: Optional[List[str]] = None
+
+class BulkTaskOperation(BaseModel):
+    op: Literal["create", "update", "delete", "pin"]
+    id: Optional[str] = None              # update / delete / pin
+    task: Optional[TaskCreate] = None     # create
+    changes: Optional[TaskUpdate] = None  # update
+    pinned: Optional[bool] = True         # pin
+
+class BulkTaskRequest(BaseModel):
+    operations: List[BulkTaskOperation] = Field(..., min_length=1, max_length=1000)
+    # Ordered: stop at the first failed or not_found operation. Unordered: attempt all.
+    ordered: bool = True
 
 class ChatMessageCreate(BaseModel):
     sender: str
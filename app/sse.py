@@ -0,0 +1,41 @@
+from typing import AsyncIterator, Awaitable, Callable
+from fastapi.responses import StreamingResponse
+from app.responses import dumps
+
+
+def sse_event(data: dict, event: str = None) -> str:
+    # Format a single Server-Sent Event frame.
+    frame = ""
+    if event:
+        frame += f"event: {event}\n"
+    frame += f"data: {dumps(data).decode()}\n\n"
+    return frame
+
+
+def stream_reply(
+    deltas: AsyncIterator[str],
+    on_complete: Callable[[str], Awaitable[dict]],
+) -> StreamingResponse:
+    """
+    Forward LLM deltas to the client as SSE frames and run `on_complete`
+    with the full reply once the model is done. Whatever `on_complete`
+    returns is sent as the final `done` event.
+    """
+    async def event_stream():
+        response = ""
+        try:
+            async for delta in deltas:
+                response += delta
+                yield sse_event({"delta": delta}, event="delta")
+        except Exception as e:
+            print(f"Error while streaming LLM reply: {str(e)}")
+            yield sse_event({"detail": f"Error with Groq API: {str(e)}"}, event="error")
+            return
+        done = await on_complete(response)
+        yield sse_event(done, event="done")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,2 +1,2 @@
 #!/bin/bash
-uvicorn app.main:app --host 0.0.0.0 --port 10000
\ No newline at end of file
+uvicorn app.main:app --host 0.0.0.0 --port 10000 --ws-ping-interval 20 --ws-ping-timeout 20
\ No newline at end of file
@@ -0,0 +1,128 @@
+"""
+Per-user task digest used as AI chat context.
+
+One document per user in `task_digests` holds a compact entry (with its
+pre-rendered line) for every task. The task routes keep it up to date
+with a single `$set` / `$unset` per write, so the AI path reads one
+document by key instead of scanning the user's tasks.
+
+    python -m app.task_digest rebuild [username ...]
+"""
+import asyncio
+import sys
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+from app.database import todo_collection, task_digest_collection
+
+NEXT_DUE_LIMIT = 5
+# Task fields a digest entry is built from.
+DIGEST_FIELDS = ("title", "dueDate", "priority", "status", "completed")
+
+
+def render_task_line(task: Dict) -> str:
+    title = task.get("title") or "Untitled Task"
+    due_date = task.get("dueDate")
+    priority = task.get("priority") or "N/A"
+    if due_date:
+        return f"- {title} (Due: {due_date}, Priority: {priority})"
+    return f"- {title} (Priority: {priority})"
+
+
+def digest_entry(task: Dict) -> Dict:
+    return {
+        "title": task.get("title"),
+        "dueDate": task.get("dueDate"),
+        "priority": task.get("priority"),
+        "status": task.get("status"),
+        "completed": task.get("completed", False),
+        "line": render_task_line(task),
+    }
+
+
+async def rebuild_task_digest(username: str) -> Dict:
+    tasks = await todo_collection.find({"username": username}, dict.fromkeys(DIGEST_FIELDS, 1)).to_list(length=None)
+    digest = {
+        "_id": username,
+        "tasks": {str(task["_id"]): digest_entry(task) for task in tasks},
+        "updated_at": datetime.utcnow(),
+    }
+    await task_digest_collection.replace_one({"_id": username}, digest, upsert=True)
+    return digest
+
+
+async def get_task_digest(username: str) -> Dict:
+    digest = await task_digest_collection.find_one({"_id": username})
+    if digest is None:
+        digest = await rebuild_task_digest(username)
+    return digest
+
+
+async def digest_task_saved(username: str, task: Dict):
+    # No upsert: a missing digest is rebuilt in full on its next read.
+    await task_digest_collection.update_one(
+        {"_id": username},
+        {"$set": {f"tasks.{task['_id']}": digest_entry(task), "updated_at": datetime.utcnow()}},
+    )
+
+
+async def digest_task_deleted(username: str, task_id: str):
+    await task_digest_collection.update_one(
+        {"_id": username},
+        {"$unset": {f"tasks.{task_id}": ""}, "$set": {"updated_at": datetime.utcnow()}},
+    )
+
+
+async def digest_tasks_changed(username: str, saved: Dict[str, Dict], deleted: Iterable[str]):
+    """Apply the saves and deletes of a bulk request to the digest in one update."""
+    update = {"$set": {f"tasks.{task_id}": digest_entry(task) for task_id, task in saved.items()}}
+    unset = {f"tasks.{task_id}": "" for task_id in deleted if task_id not in saved}
+    if not update["$set"] and not unset:
+        return
+    update["$set"]["updated_at"] = datetime.utcnow()
+    if unset:
+        update["$unset"] = unset
+    await task_digest_collection.update_one({"_id": username}, update)
+
+
+def _entries(digest: Dict, priority: Optional[str] = None) -> List[Dict]:
+    entries = list(digest.get("tasks", {}).values())
+    if priority:
+        entries = [e for e in entries if (e.get("priority") or "").lower() == priority.lower()]
+    return entries
+
+
+def format_tasks(digest: Dict, priority: Optional[str] = None) -> str:
+    entries = _entries(digest, priority)
+    if not entries:
+        return "You have no tasks at the moment."
+    return "Here are your current tasks:\n" + "\n".join(e["line"] for e in entries)
+
+
+def summarize_digest(digest: Dict) -> Dict:
+    entries = _entries(digest)
+    open_with_due = sorted(
+        (e for e in entries if e.get("dueDate") and not e.get("completed")),
+        key=lambda e: e["dueDate"],
+    )
+    return {
+        "total": len(entries),
+        "by_priority": dict(Counter(e.get("priority") or "N/A" for e in entries)),
+        "by_status": dict(Counter(e.get("status") or "todo" for e in entries)),
+        "next_due": [{"title": e["title"], "dueDate": e["dueDate"]} for e in open_with_due[:NEXT_DUE_LIMIT]],
+    }
+
+
+async def _main(argv):
+    if not argv or argv[0] != "rebuild":
+        print("usage: python -m app.task_digest rebuild [username ...]")
+        return 2
+    usernames = argv[1:] or await todo_collection.distinct("username")
+    for username in usernames:
+        digest = await rebuild_task_digest(username)
+        print(f"{username}: {len(digest['tasks'])} tasks")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
@@ -0,0 +1,207 @@
+import threading
+import numpy as np
+from typing import List, Dict, Optional, Sequence, Tuple
+from app.embeddings import EMBEDDING_DIM, get_embedder
+
+
+def embed_texts(texts: Sequence[str]) -> np.ndarray:
+    # One float32 row per text, from the configured embedding backend.
+    return get_embedder().embed_batch(list(texts))
+
+
+def compute_embedding(text: str) -> np.ndarray:
+    return get_embedder().embed(text)
+
+
+def item_text(item: Dict) -> str:
+    # The embedded text of a stored item: a chunk's text or a whole document.
+    return item.get("text") or item.get("content") or ""
+
+
+class VectorDB:
+    """
+    In-memory cosine-similarity index.
+
+    Embeddings live in one contiguous float32 matrix (one row per item) with
+    their L2 norms precomputed, next to an id -> row dict. The matrix grows
+    by doubling, and deleting an item moves the last row into its slot, so
+    rows stay dense and both operations are amortized O(d).
+
+    Public methods hold `_mutex`, so writes can run in a worker thread
+    while the event loop keeps searching.
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIM, capacity: int = 1024, ann=None):
+        self.dim = dim
+        self._vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self._norms = np.zeros(capacity, dtype=np.float32)
+        self._ids: List[str] = []          # row -> item id
+        self._items: List[Dict] = []       # row -> stored item
+        self._rows: Dict[str, int] = {}    # item id -> row
+        # Optional per-row liveness mask for subclasses that tombstone rows
+        # instead of compacting them; None means every row is live.
+        self._live: Optional[np.ndarray] = None
+        # Optional approximate index (see app.ann) used for whole-index
+        # searches. `_epoch` changes whenever existing rows are renumbered.
+        self.ann = ann
+        self._epoch = 0
+        self._mutex = threading.RLock()
+
+    def __len__(self) -> int:
+        with self._mutex:
+            self.refresh()
+            return len(self._rows)
+
+    def _reserve(self, size: int):
+        capacity = self._vectors.shape[0]
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+        norms = np.zeros(capacity, dtype=np.float32)
+        n = len(self._ids)
+        vectors[:n] = self._vectors[:n]
+        norms[:n] = self._norms[:n]
+        self._vectors, self._norms = vectors, norms
+
+    # --- Generic item API ---
+    def add_batch(self, ids: Sequence[str], embeddings, items: Sequence[Dict]):
+        if len(set(ids)) != len(ids):
+            raise ValueError("Duplicate ids in batch")
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), self.dim)
+        with self._mutex:
+            # Replacing an id keeps a single row per id.
+            for item_id in ids:
+                self.remove(item_id)
+            start = len(self._ids)
+            self._reserve(start + len(ids))
+            end = start + len(ids)
+            self._vectors[start:end] = embeddings
+            self._norms[start:end] = np.linalg.norm(embeddings, axis=1)
+            for offset, (item_id, item) in enumerate(zip(ids, items)):
+                self._rows[item_id] = start + offset
+                self._ids.append(item_id)
+                self._items.append(item)
+
+    def add(self, item_id: str, embedding, item: Dict):
+        self.add_batch([item_id], [embedding], [item])
+
+    def refresh(self):
+        # Hook for subclasses whose rows can change outside this process.
+        pass
+
+    def get(self, item_id: str) -> Optional[Dict]:
+        with self._mutex:
+            self.refresh()
+            row = self._rows.get(item_id)
+            return self._items[row] if row is not None else None
+
+    def remove(self, item_id: str) -> bool:
+        with self._mutex:
+            row = self._rows.pop(item_id, None)
+            if row is None:
+                return False
+            last = len(self._ids) - 1
+            if row != last:
+                self._vectors[row] = self._vectors[last]
+                self._norms[row] = self._norms[last]
+                self._ids[row] = self._ids[last]
+                self._items[row] = self._items[last]
+                self._rows[self._ids[row]] = row
+            if self.ann is not None:
+                self.ann.row_removed(self, row, last)
+            self._ids.pop()
+            self._items.pop()
+            return True
+
+    def remove_batch(self, ids: Sequence[str]) -> int:
+        with self._mutex:
+            return sum(self.remove(item_id) for item_id in ids)
+
+    def search_vectors(self, queries, top_k: int = 1, max_block: int = 1 << 24) -> List[List[Tuple[float, int]]]:
+        """
+        Cosine top-k for a batch of query vectors. Returns, per query, a
+        list of (score, row) sorted by descending score. Queries are
+        processed in blocks so the score matrix stays under `max_block` floats.
+        """
+        with self._mutex:
+            self.refresh()
+            return self._search_rows(queries, top_k, max_block)
+
+    def search_items(self, embedding, top_k: int = 1, ids: Optional[Sequence[str]] = None) -> List[Tuple[float, Dict]]:
+        """
+        Top-k (score, item) pairs for one query vector, optionally only
+        among the given item ids.
+        """
+        with self._mutex:
+            self.refresh()
+            rows = None
+            if ids is not None:
+                rows = np.array([self._rows[item_id] for item_id in ids if item_id in self._rows], dtype=np.int64)
+            return [(score, self._items[row]) for score, row in self._search_rows(embedding, top_k, rows=rows)[0]]
+
+    def _search_rows(self, queries, top_k: int, max_block: int = 1 << 24,
+                     rows: Optional[np.ndarray] = None) -> List[List[Tuple[float, int]]]:
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        if rows is None and self.ann is not None and self._ids and self.ann.sync(self):
+            return self.ann.search(self, queries, top_k)
+        return self._exact_search(queries, top_k, max_block, rows)
+
+    def _exact_search(self, queries, top_k: int, max_block: int = 1 << 24,
+                      rows: Optional[np.ndarray] = None) -> List[List[Tuple[float, int]]]:
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        if rows is None:
+            n = len(self._ids)
+            vectors, norms = self._vectors[:n], self._norms[:n]
+            live = self._live[:n] if self._live is not None else None
+        else:
+            n = len(rows)
+            vectors, norms = self._vectors[rows], self._norms[rows]
+            live = self._live[rows] if self._live is not None else None
+        candidates = n if live is None else int(live.sum())
+        if candidates == 0 or top_k <= 0:
+            return [[] for _ in range(len(queries))]
+        k = min(top_k, candidates)
+        query_norms = np.linalg.norm(queries, axis=1)
+
+        results = []
+        block = max(1, max_block // n)
+        for start in range(0, len(queries), block):
+            q = queries[start:start + block]
+            scores = q @ vectors.T
+            scores /= query_norms[start:start + block, None] * norms[None, :] + 1e-10
+            if live is not None:
+                scores[:, ~live] = -np.inf
+            if k < n:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            else:
+                top = np.broadcast_to(np.arange(n), (len(q), n))
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+            if rows is not None:
+                top = rows[top]
+            results.extend(
+                list(zip(row_scores.tolist(), row_ids.tolist())) for row_scores, row_ids in zip(top_scores, top)
+            )
+        return results
+
+    # --- Document API ---
+    def add_document(self, doc_id: str, title: str, content: str):
+        self.add(doc_id, compute_embedding(content), {"doc_id": doc_id, "title": title, "content": content})
+
+    def get_document(self, doc_id: str) -> Optional[Dict]:
+        return self.get(doc_id)
+
+    def remove_document(self, doc_id: str) -> bool:
+        return self.remove(doc_id)
+
+    def search_documents(self, query: str, top_k: int = 1) -> List[Dict]:
+        return self.search_documents_batch([query], top_k)[0]
+
+    def search_documents_batch(self, queries: List[str], top_k: int = 1) -> List[List[Dict]]:
+        embeddings = embed_texts(queries)
+        with self._mutex:
+            return [[self._items[row] for _, row in hits] for hits in self.search_vectors(embeddings, top_k)]
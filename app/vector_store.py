@@ -0,0 +1,322 @@
+"""
+Disk-backed VectorDB shared by every worker process.
+
+Layout of an index directory (generation `g` changes on compaction):
+
+    MANIFEST.json        {"generation": g, "dim": d, "base_rows": n}
+    vectors-g.f32        raw float32 rows, append-only, memory-mapped
+    items-g.jsonl        metadata of the first `base_rows` rows, one per line
+    log-g.jsonl          appended {"op": "add"|"del", ...} records after those
+    LOCK                 flock'ed by writers
+
+Writers append the vectors, fsync, then append and fsync the log records,
+all under an exclusive lock. Startup maps the vectors file instead of
+re-embedding every document. Readers pick up other processes' writes by
+replaying the log tail. A crash can only leave unreferenced vector rows
+or a torn last log line; readers skip both, and the next writer truncates
+them before appending. Compaction writes a complete new generation and
+swaps MANIFEST.json atomically.
+
+Within a process, writers hold the in-memory `_mutex` only while reading
+or applying the log, never while waiting for LOCK or fsyncing, so writes
+can run in a worker thread without stalling searches on the event loop.
+
+    python -m app.vector_store [stats|compact]
+"""
+import os
+import sys
+import json
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from app.ann import build_ann
+from app.embeddings import get_embedder
+from app.vector_db import VectorDB, EMBEDDING_DIM, item_text
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - single-process fallback (Windows)
+    fcntl = None
+
+# Directory of the on-disk index; empty keeps the index in memory only.
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "vector_index")
+MANIFEST = "MANIFEST.json"
+# Compact once at least this many rows, and half of all rows, are dead.
+COMPACT_MIN_DEAD_ROWS = int(os.getenv("VECTOR_INDEX_COMPACT_MIN_DEAD", "1000"))
+
+
+def _fsync_write(path: str, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _read_records(path: str, offset: int = 0) -> Tuple[List[dict], int]:
+    # Complete JSONL records after `offset`, and the offset just past them.
+    # A torn last line is left for the next read.
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read()
+    end = data.rfind(b"\n") + 1
+    records = []
+    for line in data[:end].splitlines():
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            continue
+    return records, offset + end
+
+
+class PersistentVectorDB(VectorDB):
+    """
+    `model` names the embedding space of the stored vectors. When it or
+    `dim` differs from the index on disk, the index is re-embedded from its
+    stored items with `embed` (items -> vectors) or, without one, refused.
+    """
+
+    def __init__(self, path: str, dim: int = EMBEDDING_DIM, model: str = "",
+                 embed: Optional[Callable[[List[Dict]], np.ndarray]] = None, ann=None):
+        super().__init__(dim=dim, capacity=1, ann=ann)
+        self.path = path
+        self.model = model
+        os.makedirs(path, exist_ok=True)
+        self._lock_path = os.path.join(path, "LOCK")
+        with self._locked():
+            if not os.path.exists(os.path.join(path, MANIFEST)):
+                self._write_generation(0, np.zeros((0, dim), dtype=np.float32), [])
+            elif embed is not None and not self._compatible(self._read_manifest()):
+                self._reindex_locked(embed)
+        self._load()
+
+    # --- Files ---
+    def _file(self, kind: str, generation: int) -> str:
+        suffix = "f32" if kind == "vectors" else "jsonl"
+        return os.path.join(self.path, f"{kind}-{generation}.{suffix}")
+
+    @contextmanager
+    def _locked(self):
+        with open(self._lock_path, "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_manifest(self) -> dict:
+        with open(os.path.join(self.path, MANIFEST)) as f:
+            return json.load(f)
+
+    def _write_generation(self, generation: int, vectors: np.ndarray, items: List[tuple]):
+        _fsync_write(self._file("vectors", generation), np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        lines = "".join(json.dumps({"id": item_id, "item": item}) + "\n" for item_id, item in items)
+        _fsync_write(self._file("items", generation), lines.encode())
+        _fsync_write(self._file("log", generation), b"")
+        manifest = {"generation": generation, "dim": self.dim, "model": self.model, "base_rows": len(items)}
+        tmp = os.path.join(self.path, MANIFEST + ".tmp")
+        _fsync_write(tmp, json.dumps(manifest).encode())
+        os.replace(tmp, os.path.join(self.path, MANIFEST))
+
+    # --- Loading and catching up ---
+    def _load(self):
+        self._manifest_inode = os.stat(os.path.join(self.path, MANIFEST)).st_ino
+        manifest = self._read_manifest()
+        if not self._compatible(manifest):
+            raise ValueError(
+                f"Vector index at {self.path} holds {manifest.get('model') or 'unnamed'} vectors of dim "
+                f"{manifest['dim']}, expected {self.model or 'unnamed'} of dim {self.dim}; rebuild it."
+            )
+        self._generation = manifest["generation"]
+        self._epoch += 1
+        self._ids, self._items, self._rows = [], [], {}
+        with open(self._file("items", self._generation)) as f:
+            for line in f:
+                record = json.loads(line)
+                self._rows[record["id"]] = len(self._ids)
+                self._ids.append(record["id"])
+                self._items.append(record["item"])
+        self._live = np.ones(len(self._ids), dtype=bool)
+        self._log_offset = 0
+        self._map_vectors(len(self._ids))
+        self._norms = np.linalg.norm(self._vectors, axis=1).astype(np.float32)
+        self._replay_log()
+
+    def _map_vectors(self, rows: int):
+        # Zero-copy view of the first `rows` rows of the vectors file.
+        if rows == 0:
+            self._vectors = np.zeros((0, self.dim), dtype=np.float32)
+        else:
+            self._vectors = np.memmap(self._file("vectors", self._generation), dtype=np.float32,
+                                      mode="r", shape=(rows, self.dim))
+
+    def _compatible(self, manifest: dict) -> bool:
+        return manifest["dim"] == self.dim and manifest.get("model", "") == self.model
+
+    def _replay_log(self):
+        log_path = self._file("log", self._generation)
+        if os.path.getsize(log_path) <= self._log_offset:
+            return
+        records, self._log_offset = _read_records(log_path, self._log_offset)
+        self._apply(records)
+
+    def _apply(self, records: List[dict]):
+        added_rows = [record["row"] for record in records if record["op"] == "add"]
+        old_rows = len(self._ids)
+        new_rows = max(added_rows, default=-1) + 1
+        if new_rows > old_rows:
+            grow = new_rows - old_rows
+            self._ids.extend([None] * grow)
+            self._items.extend([None] * grow)
+            self._live = np.concatenate([self._live, np.zeros(grow, dtype=bool)])
+            self._map_vectors(new_rows)
+            self._norms = np.concatenate([
+                self._norms, np.linalg.norm(self._vectors[old_rows:], axis=1).astype(np.float32)
+            ])
+        for record in records:
+            # An add for an existing id replaces it.
+            self._mark_dead(record["id"])
+            if record["op"] == "add":
+                row = record["row"]
+                self._ids[row] = record["id"]
+                self._items[row] = record["item"]
+                self._rows[record["id"]] = row
+                self._live[row] = True
+
+    def _mark_dead(self, item_id: str):
+        row = self._rows.pop(item_id, None)
+        if row is not None:
+            self._live[row] = False
+            self._items[row] = None
+
+    def refresh(self):
+        # Pick up writes made by other processes since the last call.
+        # MANIFEST.json is only ever replaced, so a new inode means a new generation.
+        with self._mutex:
+            try:
+                if os.stat(os.path.join(self.path, MANIFEST)).st_ino != self._manifest_inode:
+                    self._load()
+                else:
+                    self._replay_log()
+            except FileNotFoundError:
+                # Compacted by another process between the two checks.
+                self._load()
+
+    # --- Writes ---
+    def _append_log(self, records: List[dict], offset: int):
+        # Append at `offset`, the end of the last complete record, dropping
+        # a torn line left by a crashed writer so the first record doesn't
+        # join it.
+        data = "".join(json.dumps(record) + "\n" for record in records).encode()
+        with open(self._file("log", self._generation), "r+b") as f:
+            f.truncate(offset)
+            f.seek(offset)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def add_batch(self, ids: Sequence[str], embeddings, items: Sequence[Dict]):
+        if len(set(ids)) != len(ids):
+            raise ValueError("Duplicate ids in batch")
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), self.dim)
+        with self._locked():
+            with self._mutex:
+                self.refresh()
+                first_row, log_offset = len(self._ids), self._log_offset
+            with open(self._file("vectors", self._generation), "ab") as f:
+                # Drop rows never referenced by the log (left by a crash).
+                f.truncate(first_row * self.dim * 4)
+                f.write(embeddings.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self._append_log([
+                {"op": "add", "id": item_id, "row": first_row + i, "item": item}
+                for i, (item_id, item) in enumerate(zip(ids, items))
+            ], log_offset)
+            self.refresh()
+
+    def remove(self, item_id: str) -> bool:
+        return self.remove_batch([item_id]) > 0
+
+    def remove_batch(self, ids: Sequence[str]) -> int:
+        with self._locked():
+            with self._mutex:
+                self.refresh()
+                present = [item_id for item_id in dict.fromkeys(ids) if item_id in self._rows]
+                log_offset = self._log_offset
+            if not present:
+                return 0
+            self._append_log([{"op": "del", "id": item_id} for item_id in present], log_offset)
+            with self._mutex:
+                self.refresh()
+                dead_rows = len(self._ids) - len(self._rows)
+                compact = dead_rows >= COMPACT_MIN_DEAD_ROWS and dead_rows * 2 >= len(self._ids)
+            if compact:
+                self._compact_locked()
+        return len(present)
+
+    def compact(self):
+        with self._locked():
+            self._compact_locked()
+
+    def _reindex_locked(self, embed: Callable[[List[Dict]], np.ndarray]):
+        # Live items of the current generation, read without touching its vectors.
+        old = self._read_manifest()["generation"]
+        records, _ = _read_records(self._file("items", old))
+        items = {record["id"]: record["item"] for record in records}
+        for record in _read_records(self._file("log", old))[0]:
+            items.pop(record["id"], None)
+            if record["op"] == "add":
+                items[record["id"]] = record["item"]
+        vectors = embed(list(items.values())) if items else np.zeros((0, self.dim), dtype=np.float32)
+        self._write_generation(old + 1, vectors, list(items.items()))
+        self._remove_generation(old)
+
+    def _remove_generation(self, generation: int):
+        for kind in ("vectors", "items", "log"):
+            try:
+                os.remove(self._file(kind, generation))
+            except OSError:
+                pass
+
+    def _compact_locked(self):
+        with self._mutex:
+            self.refresh()
+            rows = [row for row in range(len(self._ids)) if self._live[row]]
+            items = [(self._ids[row], self._items[row]) for row in rows]
+            vectors = np.asarray(self._vectors[rows])
+            old = self._generation
+        self._write_generation(old + 1, vectors, items)
+        self._remove_generation(old)
+        self.refresh()
+
+
+def open_vector_db(path: str = VECTOR_INDEX_DIR) -> VectorDB:
+    # Sized for the configured embedder; an index built with another one is re-embedded.
+    embedder = get_embedder()
+    if not path:
+        return VectorDB(embedder.dim, ann=build_ann())
+    return PersistentVectorDB(
+        path, embedder.dim, embedder.model,
+        embed=lambda items: embedder.embed_batch([item_text(item) for item in items]),
+        ann=build_ann(),
+    )
+
+
+def _main(argv):
+    if not argv or argv[0] not in ("stats", "compact") or not VECTOR_INDEX_DIR:
+        print("usage: VECTOR_INDEX_DIR=<dir> python -m app.vector_store [stats|compact]")
+        return 2
+    db = open_vector_db()
+    if argv[0] == "compact":
+        db.compact()
+    print(f"generation {db._generation}: {len(db)} live rows, {len(db._ids) - len(db._rows)} dead rows")
+    if db.ann is not None:
+        db.ann.sync(db)
+        print(f"ann: {db.ann.stats()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
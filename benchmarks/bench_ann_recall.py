@@ -0,0 +1,83 @@
+"""
+Recall and latency of the IVF index against exact search.
+
+    python -m benchmarks.bench_ann_recall [n_vectors] [dim]
+
+Builds two VectorDBs over the same clustered synthetic corpus, one exact
+and one with an IVFIndex, and reports recall@10 and per-query latency
+for a range of nprobe values. Also checks that incremental inserts and
+removals after training are searchable.
+"""
+import sys
+import time
+import numpy as np
+from app.ann import IVFIndex
+from app.vector_db import VectorDB
+
+TOP_K = 10
+QUERIES = 200
+NPROBES = (1, 2, 4, 8, 16, 32)
+
+
+def clustered(n: int, means: np.ndarray, rng, spread: float = 1.5) -> np.ndarray:
+    # Topic-like structure: overlapping clouds around random centers.
+    labels = rng.integers(0, len(means), size=n)
+    return means[labels] + spread * rng.standard_normal((n, means.shape[1]), dtype=np.float32)
+
+
+def build(vectors: np.ndarray, ann=None) -> VectorDB:
+    db = VectorDB(dim=vectors.shape[1], capacity=len(vectors), ann=ann)
+    ids = [str(i) for i in range(len(vectors))]
+    db.add_batch(ids, vectors, [{"doc_id": i} for i in ids])
+    return db
+
+
+def recall(exact, approx) -> float:
+    hits = sum(len({r for _, r in e} & {r for _, r in a}) for e, a in zip(exact, approx))
+    return hits / sum(len(e) for e in exact)
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - start) / QUERIES * 1e3
+
+
+def main(n: int = 200_000, dim: int = 256):
+    rng = np.random.default_rng(0)
+    means = rng.standard_normal((1000, dim), dtype=np.float32)
+    vectors = clustered(n, means, rng)
+    queries = clustered(QUERIES, means, rng)
+
+    exact_db = build(vectors)
+    ivf = IVFIndex(min_rows=0)
+    ivf_db = build(vectors, ann=ivf)
+    start = time.perf_counter()
+    ivf.sync(ivf_db)
+    print(f"n={n:,} dim={dim}: trained {ivf.stats()['nlist']} lists in {time.perf_counter() - start:.1f} s")
+
+    exact, exact_ms = timed(lambda: [exact_db.search_vectors(q, TOP_K)[0] for q in queries])
+    print(f"exact:          {exact_ms:7.2f} ms/query")
+    for nprobe in NPROBES:
+        ivf.nprobe = nprobe
+        approx, ms = timed(lambda: [ivf_db.search_vectors(q, TOP_K)[0] for q in queries])
+        print(f"ivf nprobe={nprobe:<3} {ms:7.2f} ms/query  recall@{TOP_K} {recall(exact, approx):.3f}")
+
+    # Incremental insert and removal after training.
+    extra = clustered(1_000, means, rng)
+    for db in (exact_db, ivf_db):
+        db.add_batch([f"new{i}" for i in range(len(extra))], extra, [{"doc_id": f"new{i}"} for i in range(len(extra))])
+        db.remove_batch([str(i) for i in range(0, n, 7)])
+    ivf.nprobe = 16
+    probe = clustered(QUERIES, means, rng)
+    exact = [exact_db.search_vectors(q, TOP_K)[0] for q in probe]
+    approx = [ivf_db.search_vectors(q, TOP_K)[0] for q in probe]
+    exact_ids = [{exact_db._ids[r] for _, r in hits} for hits in exact]
+    approx_ids = [{ivf_db._ids[r] for _, r in hits} for hits in approx]
+    overlap = sum(len(e & a) for e, a in zip(exact_ids, approx_ids)) / sum(len(e) for e in exact_ids)
+    print(f"after inserts/removals, nprobe=16: recall@{TOP_K} {overlap:.3f}")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:]]
+    main(*args)
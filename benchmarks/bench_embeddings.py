@@ -0,0 +1,47 @@
+"""
+Throughput of the default embedding backend on one core.
+
+    python -m benchmarks.bench_embeddings [n_chunks]
+
+Embeds synthetic ~200-token chunks in batches of 64 (ingestion) and
+single short queries (doc chat), both with a cold cache.
+"""
+import sys
+import time
+import numpy as np
+from app.embeddings import HashingEmbedder
+from app.doc_ingest import DOC_EMBED_BATCH
+
+VOCAB = 20_000
+CHUNK_WORDS = 150
+QUERY_WORDS = 12
+
+
+def make_texts(n: int, words: int, rng) -> list:
+    # Zipf-distributed vocabulary, roughly like natural text.
+    ranks = np.minimum(rng.zipf(1.2, size=(n, words)), VOCAB)
+    return [" ".join(f"term{r}" for r in row) for row in ranks]
+
+
+def main(n: int = 5_000):
+    rng = np.random.default_rng(0)
+    chunks = make_texts(n, CHUNK_WORDS, rng)
+    queries = make_texts(1_000, QUERY_WORDS, rng)
+    embedder = HashingEmbedder(cache_size=0)
+    print(f"dim={embedder.dim}, chunk ~{CHUNK_WORDS} words, batch {DOC_EMBED_BATCH}")
+
+    start = time.perf_counter()
+    for i in range(0, n, DOC_EMBED_BATCH):
+        embedder.embed_batch(chunks[i:i + DOC_EMBED_BATCH])
+    elapsed = time.perf_counter() - start
+    print(f"ingest: {n / elapsed:10,.0f} chunks/s")
+
+    start = time.perf_counter()
+    for query in queries:
+        embedder.embed(query)
+    elapsed = time.perf_counter() - start
+    print(f"query:  {len(queries) / elapsed:10,.0f} queries/s ({elapsed / len(queries) * 1e3:.3f} ms each)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5_000)
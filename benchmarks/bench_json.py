@@ -0,0 +1,71 @@
+"""
+Encode time for a page of task documents: FastAPI's default path
+(jsonable_encoder + stdlib json) versus FastJSONResponse, with and
+without the task_serializer copy (GET /tasks/ now projects in MongoDB
+and encodes the documents as they are).
+
+    python -m benchmarks.bench_json [n_tasks]
+"""
+import sys
+import time
+from datetime import datetime, timedelta
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from app.responses import FastJSONResponse, orjson
+from app.routes.tasks import task_serializer
+
+
+def make_tasks(n: int) -> list:
+    now = datetime.utcnow()
+    return [
+        {
+            "_id": ObjectId(),
+            "title": f"Task {i}",
+            "description": "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 4,
+            "dueDate": (now + timedelta(days=i % 90)).strftime("%Y-%m-%d"),
+            "priority": ("Low", "Medium", "High")[i % 3],
+            "status": ("todo", "inprogress", "done")[i % 3],
+            "completed": i % 3 == 2,
+            "username": "benchmark",
+            "pinned": i % 50 == 0,
+            "attachments": [f"/uploads/file-{i}.pdf"] if i % 10 == 0 else [],
+        }
+        for i in range(n)
+    ]
+
+
+def best_of(func, repeat: int = 5) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main(n: int = 10_000):
+    tasks = make_tasks(n)
+
+    def default_path():
+        content = {"tasks": [task_serializer(task) for task in tasks]}
+        return JSONResponse(jsonable_encoder(content)).body
+
+    def fast_path():
+        return FastJSONResponse({"tasks": [task_serializer(task) for task in tasks]}).body
+
+    def direct_path():
+        return FastJSONResponse({"tasks": tasks}).body
+
+    baseline = best_of(default_path)
+    fast = best_of(fast_path)
+    direct = best_of(direct_path)
+    size = len(fast_path())
+    print(f"{n} tasks, {size / 1024:.0f} KiB payload (orjson {'available' if orjson else 'missing'})")
+    print(f"  jsonable_encoder + json : {baseline * 1000:8.1f} ms")
+    print(f"  FastJSONResponse        : {fast * 1000:8.1f} ms  ({baseline / fast:.1f}x)")
+    print(f"  FastJSONResponse, no copy: {direct * 1000:7.1f} ms  ({baseline / direct:.1f}x)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)
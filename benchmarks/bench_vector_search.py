@@ -0,0 +1,67 @@
+"""
+Top-k search latency of VectorDB at increasing corpus sizes.
+
+    python -m benchmarks.bench_vector_search [dim]
+
+Reports single-query and batched (32 queries) latency at 10k, 100k and 1M
+vectors, plus the previous per-document Python loop at 10k for reference.
+"""
+import sys
+import time
+import numpy as np
+from app.vector_db import VectorDB
+
+SIZES = (10_000, 100_000, 1_000_000)
+TOP_K = 5
+BATCH = 32
+
+
+def build(n: int, dim: int, rng) -> VectorDB:
+    db = VectorDB(dim=dim, capacity=n)
+    vectors = rng.standard_normal((n, dim), dtype=np.float32)
+    ids = [str(i) for i in range(n)]
+    db.add_batch(ids, vectors, [{"doc_id": i} for i in ids])
+    return db
+
+
+def legacy_search(documents, query, top_k):
+    # The original implementation: one np.array + norm per document, full sort.
+    query_embedding = np.array(query)
+    results = []
+    for doc in documents:
+        doc_embedding = np.array(doc["embedding"])
+        similarity = np.dot(query_embedding, doc_embedding) / (
+            np.linalg.norm(query_embedding) * np.linalg.norm(doc_embedding) + 1e-10
+        )
+        results.append((similarity, doc))
+    results.sort(key=lambda x: x[0], reverse=True)
+    return [doc for sim, doc in results[:top_k]]
+
+
+def timed(func, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(dim: int = 50):
+    rng = np.random.default_rng(0)
+    queries = rng.standard_normal((BATCH, dim), dtype=np.float32)
+    print(f"dim={dim}, top_k={TOP_K}")
+    for n in SIZES:
+        db = build(n, dim, rng)
+        single = timed(lambda: db.search_vectors(queries[0], TOP_K))
+        batch = timed(lambda: db.search_vectors(queries, TOP_K))
+        print(f"  {n:>9,} vectors: single {single * 1000:8.2f} ms | "
+              f"batch of {BATCH} {batch * 1000:8.2f} ms ({batch * 1000 / BATCH:.2f} ms/query)")
+        if n == SIZES[0]:
+            documents = [{"embedding": db._vectors[i].tolist()} for i in range(n)]
+            legacy = timed(lambda: legacy_search(documents, queries[0].tolist(), TOP_K), repeat=1)
+            print(f"  {n:>9,} vectors: previous implementation {legacy * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
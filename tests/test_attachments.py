@@ -0,0 +1,144 @@
+import asyncio
+import hashlib
+import os
+import pytest
+from datetime import datetime
+from fastapi import HTTPException
+from app import attachments
+from app.auth.auth_bearer import Principal
+from app.routes import attachments as attachment_routes
+
+USER = "alice"
+
+
+def matches(doc, query) -> bool:
+    for field, condition in query.items():
+        if field == "$or":
+            if not any(matches(doc, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = doc.get(field)
+            if "$lt" in condition and not (value is not None and value < condition["$lt"]):
+                return False
+        elif doc.get(field) != condition:
+            return False
+    return True
+
+
+class Result:
+    def __init__(self, modified_count=0, deleted_count=0):
+        self.modified_count = modified_count
+        self.deleted_count = deleted_count
+
+
+class StubCollection:
+    def __init__(self, docs=()):
+        self.docs = {doc["_id"]: dict(doc) for doc in docs}
+
+    async def find_one(self, query, projection=None):
+        return next((dict(doc) for doc in self.docs.values() if matches(doc, query)), None)
+
+    async def update_one(self, query, update):
+        doc = next((doc for doc in self.docs.values() if matches(doc, query)), None)
+        if doc is None:
+            return Result()
+        doc.update(update.get("$set", {}))
+        for field in update.get("$unset", {}):
+            doc.pop(field, None)
+        return Result(modified_count=1)
+
+    async def delete_one(self, query):
+        doc = next((doc for doc in self.docs.values() if matches(doc, query)), None)
+        if doc is not None:
+            del self.docs[doc["_id"]]
+        return Result(deleted_count=int(doc is not None))
+
+
+class StubRequest:
+    base_url = "http://test/"
+
+    def __init__(self, data: bytes, pieces: int = 4):
+        self.data = data
+        self.pieces = pieces
+
+    async def stream(self):
+        size = -(-len(self.data) // self.pieces)
+        for start in range(0, len(self.data), size):
+            await asyncio.sleep(0)  # let a concurrent request interleave
+            yield self.data[start:start + size]
+
+
+@pytest.fixture
+def sessions(tmp_path, monkeypatch):
+    monkeypatch.setattr(attachments, "ATTACHMENT_DIR", str(tmp_path))
+    sessions = StubCollection([{"_id": "u1", "username": USER, "filename": "f.bin", "size": 8, "offset": 0}])
+    monkeypatch.setattr(attachment_routes, "upload_session_collection", sessions)
+    monkeypatch.setattr(attachment_routes, "_session_hashers", attachments.TTLCache(maxsize=10))
+    committed = []
+
+    async def commit(path, digest, size, filename, content_type):
+        committed.append((attachments.hash_file(path), digest))
+        return {"_id": digest, "filename": filename, "content_type": "application/octet-stream", "size": size}
+
+    monkeypatch.setattr(attachment_routes, "commit", commit)
+    sessions.committed = committed
+    return sessions
+
+
+def put(data: bytes, offset: int):
+    return attachment_routes.upload_chunk("u1", StubRequest(data), offset, Principal(USER, "token", {}))
+
+
+def complete():
+    return attachment_routes.complete_upload("u1", StubRequest(b""), Principal(USER, "token", {}))
+
+
+def test_concurrent_puts_at_same_offset_keep_one_consistent_chunk(sessions):
+    async def scenario():
+        outcomes = await asyncio.gather(put(b"AAAA", 0), put(b"BBBB", 0), return_exceptions=True)
+        winners = [o for o in outcomes if not isinstance(o, Exception)]
+        losers = [o for o in outcomes if isinstance(o, HTTPException)]
+        assert len(winners) == 1 and len(losers) == 1 and losers[0].status_code == 409
+        await put(b"CCCC", 4)
+        return await complete()
+
+    asyncio.run(scenario())
+    (file_digest, digest), = sessions.committed
+    assert file_digest == digest
+    assert digest in (hashlib.sha256(b"AAAACCCC").hexdigest(), hashlib.sha256(b"BBBBCCCC").hexdigest())
+    tmp_dir = os.path.join(attachments.ATTACHMENT_DIR, "tmp")
+    assert [name for name in os.listdir(tmp_dir) if name != "u1.part"] == []
+
+
+def test_put_while_another_request_is_appending_is_rejected(sessions):
+    sessions.docs["u1"]["appending"] = "other"
+    sessions.docs["u1"]["appending_since"] = datetime.utcnow()
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(put(b"AAAA", 0))
+    assert error.value.status_code == 409
+    assert sessions.docs["u1"]["offset"] == 0
+
+
+def test_stale_append_claim_is_taken_over(sessions):
+    sessions.docs["u1"]["appending"] = "crashed"
+    sessions.docs["u1"]["appending_since"] = datetime(2000, 1, 1)
+    assert asyncio.run(put(b"AAAA", 0))["offset"] == 4
+    assert "appending" not in sessions.docs["u1"]
+
+
+def test_gc_puts_back_an_object_recommitted_during_removal(tmp_path, monkeypatch):
+    monkeypatch.setattr(attachments, "ATTACHMENT_DIR", str(tmp_path))
+    digest = hashlib.sha256(b"data").hexdigest()
+    path = attachments.object_path(digest)
+    os.makedirs(os.path.dirname(path))
+    with open(path, "wb") as f:
+        f.write(b"data")
+
+    # The record came back (a commit deduplicated against the file) after gc deleted it.
+    monkeypatch.setattr(attachments, "attachment_collection", StubCollection([{"_id": digest}]))
+    asyncio.run(attachments._remove_object(digest))
+    assert os.listdir(os.path.dirname(path)) == [digest]
+
+    monkeypatch.setattr(attachments, "attachment_collection", StubCollection())
+    asyncio.run(attachments._remove_object(digest))
+    assert os.listdir(os.path.dirname(path)) == []
@@ -0,0 +1,73 @@
+import asyncio
+from pymongo.errors import OperationFailure
+from app import backplane
+from app.backplane import MongoBackplane
+
+
+class StubStream:
+    def __init__(self, events):
+        self.events = events
+        self.resume_token = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.events:
+            await asyncio.sleep(3600)
+        event = self.events.pop(0)
+        self.resume_token = {"_data": event["key"]}
+        return {"fullDocument": event}
+
+
+class StubEventCollection:
+    """Fails like an oplog that rolled past the resume token."""
+
+    def __init__(self, code):
+        self.code = code
+        self.resume_afters = []
+
+    def watch(self, pipeline, resume_after=None):
+        self.resume_afters.append(resume_after)
+        if resume_after is not None:
+            raise OperationFailure("resume point lost", code=self.code)
+        return StubStream([{"channel": "chat", "key": "k2", "data": "after gap", "origin": "other"}])
+
+
+def watch_once(code):
+    collection = StubEventCollection(code)
+    plane = MongoBackplane(collection)
+    plane.resume_token = {"_data": "k1"}
+    delivered = []
+    plane.subscribe("chat", lambda key, data: delivered.append(data))
+
+    async def scenario():
+        await plane.start()
+        for _ in range(10):
+            await asyncio.sleep(0)
+        await plane.close()
+
+    asyncio.run(scenario())
+    return collection, plane, delivered
+
+
+def test_lost_resume_point_restarts_from_now(monkeypatch):
+    monkeypatch.setattr(backplane, "BACKPLANE_RETRY_SECONDS", 0)
+    collection, plane, delivered = watch_once(286)
+    assert collection.resume_afters == [{"_data": "k1"}, None]
+    assert delivered == ["after gap"]
+    assert plane.resume_token == {"_data": "k2"}
+
+
+def test_other_errors_keep_the_resume_token(monkeypatch):
+    monkeypatch.setattr(backplane, "BACKPLANE_RETRY_SECONDS", 0)
+    collection, plane, delivered = watch_once(11600)  # InterruptedAtShutdown
+    assert len(collection.resume_afters) > 1
+    assert all(token == {"_data": "k1"} for token in collection.resume_afters)
+    assert delivered == []
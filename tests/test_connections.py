@@ -0,0 +1,42 @@
+import asyncio
+from app import connections
+from app.connections import ConnectionManager, WS_CLOSE_SLOW_CONSUMER
+
+
+class StalledWebSocket:
+    def __init__(self):
+        self.close_codes = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message):
+        await asyncio.sleep(3600)
+
+    async def close(self, code=None):
+        self.close_codes.append(code)
+
+
+def test_full_queue_schedules_one_eviction(monkeypatch):
+    monkeypatch.setattr(connections, "WS_OVERFLOW_POLICY", "disconnect")
+    monkeypatch.setattr(connections, "WS_SEND_QUEUE_SIZE", 2)
+
+    async def scenario():
+        manager = ConnectionManager()
+        websocket = StalledWebSocket()
+        connection = await manager.connect("k", websocket, start=False)
+        for i in range(10):
+            manager.send(connection, str(i))
+        assert connection.evicting
+        assert len(manager._evictions) == 1
+        assert connection.queue.qsize() == 2
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        return manager, connection, websocket
+
+    manager, connection, websocket = asyncio.run(scenario())
+    assert manager._evictions == set()
+    assert manager.evicted == 1
+    assert connection.closed
+    assert websocket.close_codes == [WS_CLOSE_SLOW_CONSUMER]
+    assert manager.active_connections == {}
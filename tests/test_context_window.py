@@ -0,0 +1,74 @@
+import asyncio
+from app import context_window
+from app.context_window import count_tokens, summary_chunks, update_summary
+
+
+class FakeLLM:
+    def __init__(self, fail_after=None):
+        self.prompts = []
+        self.fail_after = fail_after
+
+    async def complete(self, prompt, **kwargs):
+        if self.fail_after is not None and len(self.prompts) >= self.fail_after:
+            raise RuntimeError("llm down")
+        self.prompts.append(prompt[-1]["content"])
+        return f"summary {len(self.prompts)}"
+
+
+class FakeStore:
+    def __init__(self):
+        self.saved = []
+
+    async def save_summary(self, conversation_id, summary, upto):
+        self.saved.append((summary, upto))
+
+
+def overflow(count, words=50):
+    return [{"role": "user", "content": " ".join([f"m{seq}"] * words), "seq": seq} for seq in range(2, count + 2)]
+
+
+def summarize(messages, monkeypatch, budget=300, llm=None):
+    llm = llm or FakeLLM()
+    store = FakeStore()
+    monkeypatch.setattr(context_window, "get_llm", lambda: llm)
+    monkeypatch.setattr(context_window, "CHAT_CONTEXT_TOKENS", budget + context_window.CHAT_SUMMARY_MAX_TOKENS)
+    asyncio.run(update_summary(store, "c1", "earlier", messages))
+    return llm, store
+
+
+def test_summary_chunks_keep_order_and_budget():
+    messages = overflow(10)
+    chunks = summary_chunks(messages, 300)
+    lines = [line for chunk in chunks for line in chunk]
+    assert lines == [f"user: {m['content']}" for m in messages]
+    assert len(chunks) > 1
+    assert all(sum(count_tokens(line) for line in chunk) <= 300 for chunk in chunks)
+
+
+def test_oversized_message_gets_its_own_chunk():
+    messages = overflow(3, words=10) + overflow(1, words=500)
+    chunks = summary_chunks(messages, 50)
+    assert [len(chunk) for chunk in chunks][-1] == 1
+
+
+def test_every_overflow_message_is_summarized_oldest_first(monkeypatch):
+    messages = overflow(20)
+    llm, store = summarize(messages, monkeypatch)
+    assert len(llm.prompts) > 1
+    assert "Previous summary:\nearlier" in llm.prompts[0]
+    assert "m2 " in llm.prompts[0]
+    assert f"m{messages[-1]['seq']} " in llm.prompts[-1]
+    for i, prompt in enumerate(llm.prompts[1:], start=1):
+        assert f"Previous summary:\nsummary {i}\n" in prompt
+    assert store.saved[-1] == (f"summary {len(llm.prompts)}", messages[-1]["seq"])
+    assert [upto for _, upto in store.saved] == sorted(upto for _, upto in store.saved)
+
+
+def test_failure_keeps_summary_upto_at_last_summarized_message(monkeypatch):
+    messages = overflow(20)
+    llm, store = summarize(messages, monkeypatch, llm=FakeLLM(fail_after=1))
+    assert len(store.saved) == 1
+    summarized_upto = store.saved[0][1]
+    assert summarized_upto < messages[-1]["seq"]
+    assert f"m{summarized_upto} " in llm.prompts[0]
+    assert f"m{summarized_upto + 1} " not in llm.prompts[0]
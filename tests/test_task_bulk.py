@@ -0,0 +1,208 @@
+import asyncio
+import json
+import pytest
+from bson import ObjectId
+from pymongo import InsertOne, UpdateOne, DeleteOne
+from pymongo.errors import BulkWriteError
+from app.auth.auth_bearer import Principal
+from app.routes import tasks as task_routes
+from app.schemas import BulkTaskRequest
+
+USER = "alice"
+
+
+class StubCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    async def to_list(self, length=None):
+        return self.docs
+
+
+class StubBulkResult:
+    def __init__(self, details):
+        self.bulk_api_result = details
+
+
+class StubCollection:
+    """Just enough of a motor collection for the bulk endpoint."""
+
+    def __init__(self, docs=()):
+        self.docs = {doc["_id"]: dict(doc) for doc in docs}
+        self.fail_positions = set()  # writes that fail with a write error
+        self.before_write = None     # called with the collection before bulk_write applies anything
+
+    def _matches(self, doc, query):
+        for field, condition in query.items():
+            if isinstance(condition, dict):
+                if doc.get(field) not in condition["$in"]:
+                    return False
+            elif doc.get(field) != condition:
+                return False
+        return True
+
+    def find(self, query, projection=None):
+        return StubCursor([dict(doc) for doc in self.docs.values() if self._matches(doc, query)])
+
+    async def bulk_write(self, writes, ordered=True):
+        if self.before_write is not None:
+            self.before_write(self)
+        details = {"nInserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "writeErrors": []}
+        for position, write in enumerate(writes):
+            if position in self.fail_positions:
+                details["writeErrors"].append({"index": position, "errmsg": "write failed"})
+                if ordered:
+                    break
+                continue
+            if isinstance(write, InsertOne):
+                self.docs[write._doc["_id"]] = dict(write._doc)
+                details["nInserted"] += 1
+                continue
+            target = next((doc for doc in self.docs.values() if self._matches(doc, write._filter)), None)
+            if target is None:
+                continue
+            if isinstance(write, UpdateOne):
+                target.update(write._doc["$set"])
+                details["nMatched"] += 1
+                details["nModified"] += 1
+            elif isinstance(write, DeleteOne):
+                del self.docs[target["_id"]]
+                details["nRemoved"] += 1
+        if details["writeErrors"]:
+            raise BulkWriteError(details)
+        return StubBulkResult(details)
+
+
+@pytest.fixture
+def collection(monkeypatch):
+    collection = StubCollection([
+        {"_id": ObjectId(), "username": USER, "title": "one"},
+        {"_id": ObjectId(), "username": USER, "title": "two"},
+        {"_id": ObjectId(), "username": "bob", "title": "not mine"},
+    ])
+    published = []
+
+    async def noop(*args, **kwargs):
+        pass
+
+    async def publish(username, changes):
+        published.extend(changes)
+
+    monkeypatch.setattr(task_routes, "todo_collection", collection)
+    monkeypatch.setattr(task_routes, "digest_tasks_changed", noop)
+    monkeypatch.setattr(task_routes, "add_refs", noop)
+    monkeypatch.setattr(task_routes, "sync_refs", noop)
+    monkeypatch.setattr(task_routes, "release_refs", noop)
+    monkeypatch.setattr(task_routes, "publish_task_changes", publish)
+    collection.published = published
+    return collection
+
+
+def ids(collection, username=USER):
+    return [str(doc["_id"]) for doc in collection.docs.values() if doc["username"] == username]
+
+
+def run_bulk(operations, ordered=True):
+    request = BulkTaskRequest(operations=operations, ordered=ordered)
+    response = asyncio.run(task_routes.bulk_tasks(request, Principal(USER, "token", {})))
+    return json.loads(response.body)
+
+
+def statuses(body):
+    return [result["status"] for result in body["results"]]
+
+
+def test_all_operations_succeed(collection):
+    first, second = ids(collection)
+    body = run_bulk([
+        {"op": "create", "task": {"title": "new", "description": ""}},
+        {"op": "update", "id": first, "changes": {"title": "renamed"}},
+        {"op": "pin", "id": second},
+        {"op": "delete", "id": first},
+    ])
+    assert statuses(body) == ["ok", "ok", "ok", "ok"]
+    assert (body["inserted"], body["modified"], body["deleted"]) == (1, 2, 1)
+    assert collection.docs[ObjectId(second)]["pinned"] is True
+    assert ObjectId(first) not in collection.docs
+    assert [change["op"] for change in collection.published] == ["create", "update", "update", "delete"]
+
+
+def test_ordered_stops_at_not_found(collection):
+    first, _ = ids(collection)
+    other = ids(collection, "bob")[0]
+    body = run_bulk([
+        {"op": "update", "id": first, "changes": {"title": "renamed"}},
+        {"op": "delete", "id": other},
+        {"op": "delete", "id": first},
+    ])
+    assert statuses(body) == ["ok", "not_found", "skipped"]
+    assert ObjectId(other) in collection.docs
+    assert ObjectId(first) in collection.docs
+    assert collection.docs[ObjectId(first)]["title"] == "renamed"
+
+
+def test_ordered_stops_at_invalid_operation(collection):
+    first, _ = ids(collection)
+    body = run_bulk([
+        {"op": "update", "id": "not-an-id", "changes": {"title": "x"}},
+        {"op": "delete", "id": first},
+    ])
+    assert statuses(body) == ["error", "skipped"]
+    assert body["results"][0]["detail"] == "Invalid Task ID"
+    assert ObjectId(first) in collection.docs
+
+
+def test_unordered_attempts_everything(collection):
+    first, second = ids(collection)
+    body = run_bulk([
+        {"op": "delete", "id": str(ObjectId())},
+        {"op": "update", "id": first},
+        {"op": "delete", "id": second},
+    ], ordered=False)
+    assert statuses(body) == ["not_found", "error", "ok"]
+    assert body["results"][1]["detail"] == "No fields provided for update"
+    assert ObjectId(second) not in collection.docs
+
+
+def test_operations_after_a_delete_of_the_same_task_are_not_found(collection):
+    first, _ = ids(collection)
+    body = run_bulk([
+        {"op": "delete", "id": first},
+        {"op": "pin", "id": first},
+    ], ordered=False)
+    assert statuses(body) == ["ok", "not_found"]
+
+
+def test_write_errors_skip_the_rest_when_ordered(collection):
+    first, second = ids(collection)
+    collection.fail_positions = {0}
+    body = run_bulk([
+        {"op": "delete", "id": first},
+        {"op": "delete", "id": second},
+    ])
+    assert statuses(body) == ["error", "skipped"]
+    assert body["results"][0]["detail"] == "write failed"
+    assert collection.published == []
+
+
+def test_write_errors_are_per_operation_when_unordered(collection):
+    first, second = ids(collection)
+    collection.fail_positions = {0}
+    body = run_bulk([
+        {"op": "delete", "id": first},
+        {"op": "delete", "id": second},
+    ], ordered=False)
+    assert statuses(body) == ["error", "ok"]
+    assert body["deleted"] == 1
+
+
+def test_update_of_task_deleted_after_pre_read_is_not_found(collection):
+    first, second = ids(collection)
+    collection.before_write = lambda c: c.docs.pop(ObjectId(first))
+    body = run_bulk([
+        {"op": "update", "id": first, "changes": {"title": "renamed"}},
+        {"op": "update", "id": second, "changes": {"title": "renamed"}},
+    ], ordered=False)
+    assert statuses(body) == ["not_found", "ok"]
+    assert body["results"][0]["detail"] == "Task was deleted before the update was applied"
+    assert [change["_id"] for change in collection.published] == [second]
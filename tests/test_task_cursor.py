@@ -0,0 +1,60 @@
+import itertools
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+from app.routes.tasks import encode_task_cursor, decode_task_cursor
+
+
+def matches(task, query) -> bool:
+    # The subset of MongoDB filter semantics the cursor filters use.
+    if "$or" in query:
+        return any(matches(task, clause) for clause in query["$or"])
+    for field, condition in query.items():
+        value = task.get(field)
+        if isinstance(condition, dict):
+            if "$ne" in condition and value == condition["$ne"]:
+                return False
+            if "$gt" in condition and not (value is not None and value > condition["$gt"]):
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+def sort_key(task):
+    # TASK_SORT: pinned desc (true, false, null), dueDate asc (null first), _id asc.
+    pinned_rank = {True: 0, False: 1, None: 2}[task.get("pinned")]
+    due = task.get("dueDate")
+    return (pinned_rank, due is not None, due or "", task["_id"])
+
+
+def all_tasks():
+    tasks = []
+    for pinned, due in itertools.product([True, False, None], [None, "2024-01-01", "2024-02-01"]):
+        for _ in range(2):
+            task = {"_id": ObjectId(), "dueDate": due}
+            if pinned is not None:
+                task["pinned"] = pinned
+            tasks.append(task)
+    return sorted(tasks, key=sort_key)
+
+
+def test_cursor_round_trip():
+    task = {"_id": ObjectId(), "pinned": True, "dueDate": "2024-01-01"}
+    query = decode_task_cursor(encode_task_cursor(task))
+    assert {"pinned": True, "dueDate": "2024-01-01", "_id": {"$gt": task["_id"]}} in query["$or"]
+
+
+def test_cursor_filter_selects_tasks_after_position():
+    tasks = all_tasks()
+    for position, task in enumerate(tasks):
+        query = decode_task_cursor(encode_task_cursor(task))
+        after = [t["_id"] for t in tasks if matches(t, query)]
+        assert after == [t["_id"] for t in tasks[position + 1:]], task
+
+
+@pytest.mark.parametrize("cursor", ["", "not-base64!", "W10=", "WzEsIDIsICJ4Il0="])
+def test_invalid_cursor(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_task_cursor(cursor)
+    assert error.value.status_code == 400
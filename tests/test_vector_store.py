@@ -0,0 +1,118 @@
+import os
+import json
+import numpy as np
+import pytest
+from app import vector_store
+from app.vector_store import PersistentVectorDB, MANIFEST
+
+DIM = 4
+
+
+def vector(seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).random(DIM, dtype=np.float32) + 0.1
+
+
+def add(db, *ids):
+    db.add_batch(list(ids), np.stack([vector(ord(i[0])) for i in ids]), [{"text": i} for i in ids])
+
+
+def live_ids(db):
+    db.refresh()
+    return sorted(db._rows)
+
+
+def log_path(db):
+    return db._file("log", db._generation)
+
+
+def test_reopen_after_add(tmp_path):
+    db = PersistentVectorDB(str(tmp_path), DIM)
+    add(db, "a", "b")
+    add(db, "b", "c")  # replaces b
+
+    reopened = PersistentVectorDB(str(tmp_path), DIM)
+    assert live_ids(reopened) == ["a", "b", "c"]
+    assert reopened.get("c") == {"text": "c"}
+    assert np.allclose(reopened._vectors[reopened._rows["c"]], db._vectors[db._rows["c"]])
+    assert reopened.search_items(vector(ord("a")))[0][1] == {"text": "a"}
+
+
+def test_tombstone_and_compaction(tmp_path):
+    db = PersistentVectorDB(str(tmp_path), DIM)
+    add(db, "a", "b", "c")
+    assert db.remove_batch(["b", "missing"]) == 1
+    assert db.get("b") is None
+    assert len(db._ids) == 3  # tombstoned, not yet compacted
+
+    db.compact()
+    assert db._generation == 1
+    assert len(db._ids) == 2
+    assert not os.path.exists(os.path.join(str(tmp_path), "vectors-0.f32"))
+
+    reopened = PersistentVectorDB(str(tmp_path), DIM)
+    assert reopened._generation == 1
+    assert live_ids(reopened) == ["a", "c"]
+    assert reopened.search_items(vector(ord("c")))[0][1] == {"text": "c"}
+
+
+def test_removes_trigger_compaction(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_store, "COMPACT_MIN_DEAD_ROWS", 2)
+    db = PersistentVectorDB(str(tmp_path), DIM)
+    add(db, "a", "b", "c")
+    db.remove_batch(["a", "b"])
+    assert db._generation == 1
+    assert live_ids(db) == ["c"]
+
+
+def test_torn_log_tail_is_truncated_before_append(tmp_path):
+    db = PersistentVectorDB(str(tmp_path), DIM)
+    add(db, "a")
+    with open(log_path(db), "ab") as f:
+        f.write(b'{"op": "add", "id": "torn"')
+
+    reopened = PersistentVectorDB(str(tmp_path), DIM)
+    assert live_ids(reopened) == ["a"]
+    add(reopened, "b", "c")
+
+    assert live_ids(PersistentVectorDB(str(tmp_path), DIM)) == ["a", "b", "c"]
+    with open(log_path(reopened), "rb") as f:
+        assert all(json.loads(line) for line in f)
+
+
+def test_refresh_follows_other_writer_and_manifest_swap(tmp_path):
+    writer = PersistentVectorDB(str(tmp_path), DIM)
+    reader = PersistentVectorDB(str(tmp_path), DIM)
+    add(writer, "a", "b")
+    assert live_ids(reader) == ["a", "b"]
+
+    writer.remove("a")
+    writer.compact()
+    add(writer, "c")
+    inode = os.stat(os.path.join(str(tmp_path), MANIFEST)).st_ino
+    assert inode != reader._manifest_inode
+
+    assert len(reader) == 2
+    assert reader._generation == writer._generation == 1
+    assert live_ids(reader) == ["b", "c"]
+    assert reader.get("c") == {"text": "c"}
+
+
+def test_reindex_on_model_change(tmp_path):
+    db = PersistentVectorDB(str(tmp_path), DIM, model="old")
+    add(db, "a", "b")
+    db.remove("a")
+
+    with pytest.raises(ValueError):
+        PersistentVectorDB(str(tmp_path), DIM, model="new")
+
+    embedded = []
+
+    def embed(items):
+        embedded.extend(item["text"] for item in items)
+        return np.ones((len(items), DIM), dtype=np.float32)
+
+    reindexed = PersistentVectorDB(str(tmp_path), DIM, model="new", embed=embed)
+    assert embedded == ["b"]
+    assert reindexed._generation == 1
+    assert live_ids(reindexed) == ["b"]
+    assert np.allclose(reindexed._vectors[reindexed._rows["b"]], 1.0)
@@ -233,16 +233,53 @@ const Conversations = () => {
       const convId = conversationId || Date.now().toString();
       if (!conversationId) setConversationId(convId);
       const token = localStorage.getItem("token");
-      const response = await axios.post(
-        "https://to-do-list-0f6z.onrender.com/api/todo-ai/",
-        { message, conversation_id: convId },
-        { headers: { Authorization: `Bearer ${token}` } }
+      const response = await fetch(
+        "https://to-do-list-0f6z.onrender.com/api/todo-ai/stream",
+        {
+          method: "POST",
+          headers: {
+            Authorization: `Bearer ${token}`,
+            "Content-Type": "application/json",
+          },
+          body: JSON.stringify({ message, conversation_id: convId }),
+        }
       );
-      // Append AI's reply as a JSON string
+      if (!response.ok) throw new Error(`AI request failed: ${response.status}`);
+      // Append an empty AI reply and grow it as Server-Sent Events arrive
+      let replyText = "";
+      const setReply = (text) =>
+        setAiChatHistory((prev) => {
+          const next = [...prev];
+          next[next.length - 1] = JSON.stringify({ type: "text", sender: "Llama-Ai", text });
+          return next;
+        });
       setAiChatHistory((prev) => [
         ...prev,
-        JSON.stringify({ type: "text", sender: "Llama-Ai", text: response.data.response }),
+        JSON.stringify({ type: "text", sender: "Llama-Ai", text: "" }),
       ]);
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const frames = buffer.split("\n\n");
+        buffer = frames.pop();
+        for (const frame of frames) {
+          const eventLine = frame.split("\n").find((l) => l.startsWith("event: "));
+          const dataLine = frame.split("\n").find((l) => l.startsWith("data: "));
+          if (!dataLine) continue;
+          const event = eventLine ? eventLine.slice(7) : "delta";
+          const data = JSON.parse(dataLine.slice(6));
+          if (event === "delta") {
+            replyText += data.delta;
+            setReply(replyText);
+          } else if (event === "error") {
+            throw new Error(data.detail);
+          }
+        }
+      }
       setMessage("");
     } catch (error) {
       console.error("Error sending AI message:", error);
@@ -124,9 +124,29 @@ function CalendarView({ tasks, currentMonth, setCurrentMonth }) {
   );
 }
 
+const TASK_FEED_URL = "wss://to-do-list-0f6z.onrender.com/tasks/feed";
+
+// Apply task deltas from the change feed. Applying a delta twice is
+// harmless, so our own changes can also come back through the feed.
+function applyTaskChanges(tasks, changes) {
+  let next = tasks;
+  for (const change of changes) {
+    if (change.op === "create") {
+      next = next.some((t) => t._id === change.task._id)
+        ? next.map((t) => (t._id === change.task._id ? { ...t, ...change.task } : t))
+        : [...next, change.task];
+    } else if (change.op === "update") {
+      next = next.map((t) => (t._id === change._id ? { ...t, ...change.fields } : t));
+    } else if (change.op === "delete") {
+      next = next.filter((t) => t._id !== change._id);
+    }
+  }
+  return next;
+}
+
 function Tasks() {
   const [tasks, setTasks] = useState([]);
-  const [pinnedTasks, setPinnedTasks] = useState([]);
+  const pinnedTasks = useMemo(() => tasks.filter((task) => task.pinned).slice(0, 5), [tasks]);
   const [title, setTitle] = useState("");
   const [description, setDescription] = useState("");
   const [dueDate, setDueDate] = useState("");
@@ -164,17 +184,57 @@ function Tasks() {
     // eslint-disable-next-line
   }, [token]);
 
+  // Live task changes from other tabs and devices. After a reconnect the
+  // list is reloaded once, since deltas sent meanwhile were missed.
+  useEffect(() => {
+    if (!token) return;
+    let ws = null;
+    let stopped = false;
+    let reconnected = false;
+    let retryDelay = 1000;
+    let retryTimer = null;
+    const connect = () => {
+      ws = new WebSocket(`${TASK_FEED_URL}?token=${encodeURIComponent(token)}`);
+      ws.onopen = () => {
+        retryDelay = 1000;
+        if (reconnected) fetchTasks();
+      };
+      ws.onmessage = (event) => {
+        const frame = JSON.parse(event.data);
+        if (frame.type === "changes") {
+          setTasks((prevTasks) => applyTaskChanges(prevTasks, frame.changes));
+        }
+      };
+      ws.onclose = () => {
+        if (stopped) return;
+        reconnected = true;
+        retryTimer = setTimeout(connect, retryDelay);
+        retryDelay = Math.min(retryDelay * 2, 30000);
+      };
+    };
+    connect();
+    return () => {
+      stopped = true;
+      clearTimeout(retryTimer);
+      if (ws) ws.close();
+    };
+    // eslint-disable-next-line
+  }, [token]);
+
   const fetchTasks = async () => {
     try {
-      const response = await axios.get("https://to-do-list-0f6z.onrender.com/tasks", {
-        headers: { Authorization: `Bearer ${token}` },
-      });
-      const tasksData = Array.isArray(response.data)
-        ? response.data
-        : response.data.tasks || [];
+      // The API is paginated; follow next_cursor until every page is loaded.
+      const tasksData = [];
+      let cursor = null;
+      do {
+        const response = await axios.get("https://to-do-list-0f6z.onrender.com/tasks", {
+          headers: { Authorization: `Bearer ${token}` },
+          params: { limit: 500, ...(cursor ? { cursor } : {}) },
+        });
+        tasksData.push(...(response.data.tasks || []));
+        cursor = response.data.next_cursor;
+      } while (cursor);
       setTasks(tasksData);
-      // Update pinned tasks from fetched tasks
-      setPinnedTasks(tasksData.filter((task) => task.pinned));
     } catch (error) {
       console.error("Error fetching tasks:", error);
       alert("Failed to fetch tasks");
@@ -203,7 +263,7 @@ function Tasks() {
         },
       });
       const createdTask = response.data;
-      setTasks((prevTasks) => [...prevTasks, createdTask]);
+      setTasks((prevTasks) => applyTaskChanges(prevTasks, [{ op: "create", task: createdTask }]));
       setTitle("");
       setDescription("");
       setDueDate("");
@@ -225,11 +285,6 @@ function Tasks() {
         setTasks((prevTasks) =>
           prevTasks.map((t) => (t._id === task._id ? updatedTask : t))
         );
-        // Update pinned tasks list based on the new pin status
-        setPinnedTasks((prev) => {
-          if (updatedTask.pinned) return [...prev, updatedTask].slice(0, 5);
-          return prev.filter((t) => t._id !== task._id);
-        });
       } catch (error) {
         console.error("Error pinning task:", error);
         alert("Failed to pin task");
@@ -278,8 +333,6 @@ function Tasks() {
         headers: { Authorization: `Bearer ${token}` },
       });
       setTasks((prevTasks) => prevTasks.filter((task) => task._id !== taskId));
-      // Remove the task from pinned tasks if needed
-      setPinnedTasks((prev) => prev.filter((task) => task._id !== taskId));
     } catch (error) {
       console.error("Error deleting task:", error);
       alert("Failed to delete task");